@@ -0,0 +1,42 @@
+"""Compare two runs of the benchmarks.
+
+Run with e.g.:
+
+    python benchmarks/compare.py results/abc1234.json results/def5678.json
+
+Benchmarks that became more than --threshold times slower are marked.
+"""
+import argparse
+import json
+from pathlib import Path
+
+import pandas as pd
+
+
+def read_results(path: Path) -> pd.Series:
+    """Read the time per call from a results file, by benchmark and size."""
+    results = pd.DataFrame(json.loads(Path(path).read_text())["results"])
+    return results.set_index(["case", "regions", "days"])["seconds"]
+
+
+def main() -> None:
+    """Print the times of both runs, and their ratio."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("before", type=Path)
+    parser.add_argument("after", type=Path)
+    parser.add_argument("--threshold", type=float, default=1.2)
+    args = parser.parse_args()
+
+    table = pd.DataFrame(
+        {
+            "before_ms": read_results(args.before) * 1000,
+            "after_ms": read_results(args.after) * 1000,
+        }
+    )
+    table["ratio"] = table["after_ms"] / table["before_ms"]
+    table["slower"] = (table["ratio"] > args.threshold).map({True: "*", False: ""})
+    print(table.round(3).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Benchmark how the forecast ensemble scales with the number of trajectories.
+
+Run with e.g. `python benchmarks/forecast_ensemble.py`. The timings are for one
+call to covid19.forecast.forecast_ensemble, which should stay within a few tens of
+milliseconds for the ensemble size used by the app.
+"""
+import argparse
+import timeit
+
+import numpy as np
+import pandas as pd
+
+import covid19.forecast
+
+
+def synthetic_infected(days: int, seed: int = 0) -> pd.Series:
+    """Create a cumulative number of infected, growing a bit slower every day."""
+    rng = np.random.default_rng(seed)
+    rates = 1 + 0.2 * np.exp(-np.arange(days) / 30)
+    noise = rng.normal(1, 0.01, size=days).clip(1 / rates)
+    return pd.Series(100 * np.cumprod(rates * noise))
+
+
+def main() -> None:
+    """Print the time per call, for each ensemble size and forecast horizon."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[100, 1000, 10_000, 100_000],
+        help="The numbers of trajectories",
+    )
+    parser.add_argument(
+        "--days-of-control",
+        type=int,
+        nargs="+",
+        default=[60, 120, 180],
+        help="The days of control, which decide the length of the forecast",
+    )
+    parser.add_argument("--observed-days", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    infected = synthetic_infected(args.observed_days)
+    print(f"{'samples':>8} {'day of control':>15} {'horizon':>8} {'ms per call':>12}")
+    for day_of_control in args.days_of_control:
+        horizon = len(np.arange(0, (day_of_control - args.observed_days + 1) / 4 * 6))
+        for size in args.sizes:
+            timer = timeit.Timer(
+                lambda: covid19.forecast.forecast_ensemble(
+                    infected, day_of_control, n_samples=size, seed=0
+                )
+            )
+            number, _ = timer.autorange()
+            best = min(timer.repeat(repeat=args.repeat, number=number)) / number
+            print(f"{size:8d} {day_of_control:15d} {horizon:8d} {best * 1000:12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+"""Load test the app under gunicorn, to find out how many workers it needs.
+
+The app is started under gunicorn with src/gunicorn_config.py, with the data served
+by standin.py instead of GitHub. A number of simulated users then replay realistic
+sessions against /_dash-update-component: the initial page load, changing the
+selected countries, toggling the plot options, dragging the sliders and the ticks of
+the update interval. This is repeated for each number of workers, and the latency
+(p50/p99) and throughput of each callback are reported. Run with e.g.:
+
+    python benchmarks/loadtest.py --workers 1 2 4 8 --users 16 --duration 60
+
+Note that the simulated users run on the same machine as the app, and use some of
+the CPU as well. Use --processes to spread them over more than one core.
+"""
+import argparse
+import concurrent.futures
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import pandas as pd
+import requests
+import standin
+import synthetic
+
+ROOT_DIR = Path(__file__).parent.parent
+STARTUP_TIMEOUT = 300
+
+# A property of a component, and a function that records a request
+Prop = Tuple[str, str]
+Record = Callable[[str, float, int], None]
+
+
+class Browser:
+    """A minimal stand-in for the Dash renderer in the browser.
+
+    It keeps the properties of all components, and when a property is set it calls
+    the server-side callbacks that depend on it, like the renderer does. Callbacks
+    that update other inputs are followed, and clientside callbacks are skipped.
+    """
+
+    def __init__(self, url: str, record: Record):
+        """Create the browser.
+
+        Args:
+            url (str): The URL of the app.
+            record (Callable): Called with the name, duration and HTTP status of
+                               each request.
+        """
+        self.url = url
+        self.record = record
+        self.session = requests.Session()
+        self.props: Dict[Prop, Any] = {}
+        self.components: Set[str] = set()
+        self.callbacks: List[Dict[str, Any]] = []
+
+    def load(self) -> None:
+        """Load the page, and call the initial callbacks."""
+        self._get("/")
+        self.props.clear()
+        self.components.clear()
+        self._add_components(self._get("/_dash-layout").json())
+        self.callbacks = [
+            {
+                **callback,
+                "outputs": parse_output(callback["output"]),
+                "input_props": [(i["id"], i["property"]) for i in callback["inputs"]],
+            }
+            for callback in self._get("/_dash-dependencies").json()
+            if not callback.get("clientside_function")
+        ]
+        self._fire(
+            [
+                callback
+                for callback in self.callbacks
+                if not callback.get("prevent_initial_call")
+            ],
+            set(),
+        )
+
+    def get(self, component_id: str, prop: str) -> Any:
+        """Return the current value of a property."""
+        return self.props.get((component_id, prop))
+
+    def set(self, component_id: str, prop: str, value: Any) -> None:
+        """Set a property, like the user does, and call the callbacks."""
+        self.props[(component_id, prop)] = value
+        changed = {(component_id, prop)}
+        self._fire(self._triggered_by(changed), changed)
+
+    def _fire(self, pending: List[Dict[str, Any]], changed: Set[Prop]) -> None:
+        """Call the pending callbacks, and the ones they trigger in turn.
+
+        A callback waits for the callbacks that update its inputs, and is called at
+        most once.
+        """
+        fired = []
+        while pending:
+            waiting = {prop for callback in pending for prop in callback["outputs"]}
+            ready = [
+                callback
+                for callback in pending
+                if not waiting.intersection(callback["input_props"])
+            ]
+            callback = (ready or pending)[0]
+            pending.remove(callback)
+            fired.append(callback)
+            if not all(i in self.components for i, _ in callback["input_props"]):
+                continue
+            updated = self._call(callback, changed)
+            changed = changed | updated
+            pending += [
+                triggered
+                for triggered in self._triggered_by(updated)
+                if triggered not in fired and triggered not in pending
+            ]
+
+    def _call(self, callback: Dict[str, Any], changed: Set[Prop]) -> Set[Prop]:
+        """Call a callback on the server, and return the properties it updated."""
+        outputs = [{"id": i, "property": p} for i, p in callback["outputs"]]
+        payload = {
+            "output": callback["output"],
+            "outputs": outputs if callback["output"].startswith("..") else outputs[0],
+            "inputs": self._values(callback["inputs"]),
+            "state": self._values(callback["state"]),
+            "changedPropIds": [
+                f"{i}.{p}" for i, p in callback["input_props"] if (i, p) in changed
+            ],
+        }
+        name = ", ".join(f"{i}.{p}" for i, p in callback["outputs"])
+        response = self._post("/_dash-update-component", name, payload)
+        if response.status_code != requests.codes.ok:
+            return set()
+        updated = set()
+        for component_id, props in response.json()["response"].items():
+            for prop, value in props.items():
+                self.props[(component_id, prop)] = value
+                self._add_components(value)
+                updated.add((component_id, prop))
+        return updated
+
+    def _triggered_by(self, changed: Set[Prop]) -> List[Dict[str, Any]]:
+        """Return the callbacks that have any of the properties as input."""
+        return [
+            callback
+            for callback in self.callbacks
+            if changed.intersection(callback["input_props"])
+        ]
+
+    def _values(self, dependencies: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+        """Return the current values of the inputs or states of a callback."""
+        return [
+            {**dependency, "value": self.get(dependency["id"], dependency["property"])}
+            for dependency in dependencies
+        ]
+
+    def _add_components(self, layout: Any) -> None:
+        """Remember the properties of all components in (a part of) a layout."""
+        if isinstance(layout, list):
+            for child in layout:
+                self._add_components(child)
+        elif isinstance(layout, dict) and "props" in layout:
+            props = layout["props"]
+            if "id" in props:
+                self.components.add(props["id"])
+                for prop, value in props.items():
+                    self.props[(props["id"], prop)] = value
+            self._add_components(props.get("children"))
+
+    def _get(self, path: str) -> requests.Response:
+        """GET a resource, and record the duration."""
+        start = time.perf_counter()
+        response = self.session.get(f"{self.url}{path}")
+        self.record(f"GET {path}", time.perf_counter() - start, response.status_code)
+        response.raise_for_status()
+        return response
+
+    def _post(self, path: str, name: str, payload: Any) -> requests.Response:
+        """POST to the app, and record the duration."""
+        start = time.perf_counter()
+        response = self.session.post(f"{self.url}{path}", json=payload)
+        self.record(name, time.perf_counter() - start, response.status_code)
+        return response
+
+
+def parse_output(output: str) -> List[Prop]:
+    """Split the output of a Dash callback into its components and properties."""
+    if output.startswith(".."):
+        outputs = output[2:-2].split("...")
+    else:
+        outputs = [output]
+    return [tuple(output.rsplit(".", 1)) for output in outputs]  # type: ignore
+
+
+def pick_countries(
+    browser: Browser, selector: str, rng: random.Random, multi: bool = True
+) -> None:
+    """Select one to five random options of a dropdown, or one if not multi."""
+    countries = [option["value"] for option in browser.get(selector, "options")]
+    if multi:
+        number = rng.randint(1, min(5, len(countries)))
+        browser.set(selector, "value", rng.sample(countries, number))
+    else:
+        browser.set(selector, "value", rng.choice(countries))
+
+
+def toggle(browser: Browser, checklist: str, rng: random.Random) -> None:
+    """Toggle a random option of a checklist."""
+    option = rng.choice(browser.get(checklist, "options"))["value"]
+    selected = browser.get(checklist, "value") or []
+    if option in selected:
+        browser.set(checklist, "value", [o for o in selected if o != option])
+    else:
+        browser.set(checklist, "value", selected + [option])
+
+
+def drag(browser: Browser, slider: str, rng: random.Random, steps: int = 5) -> None:
+    """Drag a slider back and forth, to a few of its values."""
+    minimum = browser.get(slider, "min")
+    maximum = browser.get(slider, "max")
+    step = browser.get(slider, "step") or 1
+    values = list(range(minimum, maximum + 1, step))
+    start = rng.randrange(len(values))
+    for offset in range(steps):
+        browser.set(slider, "value", values[(start + offset) % len(values)])
+
+
+def run_session(browser: Browser, rng: random.Random, think: float) -> None:
+    """Replay one session of a user, through all the tabs of the app.
+
+    Args:
+        browser (Browser): The browser of the user.
+        rng (random.Random): The random choices of the user.
+        think (float): The mean time between the actions of the user, in seconds.
+    """
+    actions: List[Callable[[], None]] = [
+        lambda: pick_countries(browser, "infected-countries-selector", rng),
+        lambda: toggle(browser, "infected-plot-options", rng),
+        lambda: drag(browser, "infected-map-date", rng),
+        lambda: browser.set("tabs", "value", "tab-deaths"),
+        lambda: pick_countries(browser, "deaths-countries-selector", rng),
+        lambda: toggle(browser, "deaths-plot-options", rng),
+        lambda: browser.set("tabs", "value", "tab-forecast"),
+        lambda: pick_countries(browser, "forecast-country-selector", rng, multi=False),
+        lambda: drag(browser, "day-of-control", rng),
+        lambda: drag(browser, "recovery-days", rng, steps=2),
+        lambda: drag(browser, "unrecorded-factor", rng, steps=2),
+        lambda: toggle(browser, "forecast-plot-options", rng),
+        lambda: browser.set("tabs", "value", "tab-us"),
+        lambda: pick_countries(browser, "us-state-selector", rng, multi=False),
+        lambda: pick_countries(browser, "us-counties-selector", rng),
+        lambda: toggle(browser, "us-plot-options", rng),
+        lambda: browser.set(
+            "interval-component",
+            "n_intervals",
+            browser.get("interval-component", "n_intervals") + 1,
+        ),
+    ]
+    browser.load()
+    for action in actions:
+        if think:
+            time.sleep(rng.expovariate(1 / think))
+        action()
+
+
+def run_users(
+    url: str, numbers: Iterable[int], duration: float, think: float, seed: int
+) -> pd.DataFrame:
+    """Let some users replay sessions against the app, each in its own thread."""
+    records: List[Tuple[str, float, int]] = []
+    deadline = time.monotonic() + duration
+
+    def user(number: int) -> None:
+        rng = random.Random(seed + number)
+        browser = Browser(url, lambda *record: records.append(record))  # type: ignore
+        while time.monotonic() < deadline:
+            run_session(browser, rng, think)
+
+    threads = [threading.Thread(target=user, args=(i,)) for i in numbers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return pd.DataFrame(records, columns=["name", "seconds", "status"])
+
+
+def load_test(
+    url: str,
+    users: int,
+    duration: float,
+    think: float = 0,
+    seed: int = 0,
+    processes: int = 1,
+) -> pd.DataFrame:
+    """Let users replay sessions against the app for a while.
+
+    Args:
+        url (str): The URL of the app.
+        users (int): The number of simultaneous users.
+        duration (float): For how long to run, in seconds.
+        think (float, optional): The mean time between the actions of a user.
+        seed (int, optional): Seed of the random choices of the users.
+        processes (int, optional): The number of processes to divide the users
+                                   between, so that the client is not the
+                                   bottleneck.
+
+    Returns:
+        pd.DataFrame: The name, duration and HTTP status of each request.
+    """
+    if processes == 1:
+        return run_users(url, range(users), duration, think, seed)
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        records = pool.map(
+            run_users,
+            [url] * processes,
+            [range(i, users, processes) for i in range(processes)],
+            [duration] * processes,
+            [think] * processes,
+            [seed] * processes,
+        )
+        return pd.concat(records, ignore_index=True)
+
+
+def summarize(records: pd.DataFrame, duration: float) -> pd.DataFrame:
+    """Summarize the latency and throughput of each callback.
+
+    Args:
+        records (pd.DataFrame): The requests, from load_test().
+        duration (float): The duration of the load test, in seconds.
+
+    Returns:
+        pd.DataFrame: The number of requests, errors, p50/p99 latency (in ms) and
+                      throughput (requests per second), by callback.
+    """
+    records = pd.concat([records, records.assign(name="all")])
+    by_name = records.groupby("name")
+    summary = pd.DataFrame(
+        {
+            "requests": by_name.size(),
+            "errors": by_name["status"].apply(lambda status: (status >= 400).sum()),
+            "p50_ms": by_name["seconds"].quantile(0.5) * 1000,
+            "p99_ms": by_name["seconds"].quantile(0.99) * 1000,
+            "per_second": by_name.size() / duration,
+        }
+    )
+    return summary
+
+
+def start_app(
+    workers: int, port: int, env: Dict[str, str], log: Optional[Path] = None
+) -> subprocess.Popen:
+    """Start the app under gunicorn, and wait until it is ready.
+
+    Args:
+        workers (int): The number of gunicorn workers.
+        port (int): The port to listen on.
+        env (dict): Environment variables of the app.
+        log (Path, optional): Where to write the output of gunicorn.
+
+    Returns:
+        subprocess.Popen: The gunicorn process.
+    """
+    command = [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "-c",
+        "src/gunicorn_config.py",
+        "--workers",
+        str(workers),
+        "--bind",
+        f"127.0.0.1:{port}",
+        "app:server",
+    ]
+    output = open(log, "a") if log else subprocess.DEVNULL
+    process = subprocess.Popen(
+        command, cwd=ROOT_DIR, env={**os.environ, **env}, stdout=output, stderr=output
+    )
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {process.returncode}")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/_dash-layout", timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("gunicorn did not start in time")
+
+
+def main() -> None:
+    """Run the load test for each number of workers, and print the results."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=60, help="Seconds")
+    parser.add_argument("--think", type=float, default=0, help="Seconds")
+    parser.add_argument("--processes", type=int, default=1, help="Of the users")
+    parser.add_argument(
+        "--regions", type=int, default=300, help="At least one per country (235)"
+    )
+    parser.add_argument("--days", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=5050)
+    parser.add_argument("--log", type=Path, help="Where to write the gunicorn log")
+    parser.add_argument("--output", type=Path, help="Write the results as CSV")
+    args = parser.parse_args()
+
+    # The app gets its data from the stand-in, and keeps its snapshot between runs
+    tmp_dir = Path(tempfile.mkdtemp(prefix="covid19-loadtest-"))
+    synthetic.write_csse_files(tmp_dir / "data", args.regions, args.days)
+    server, url = standin.serve(tmp_dir / "data")
+    env = {
+        "COVID19_SNAPSHOT_DIR": str(tmp_dir / "snapshots"),
+        "COVID19_HTTP_CACHE_DIR": str(tmp_dir / "http"),
+        "COVID19_CSSE_TIME_SERIES_URL": url,
+        "COVID19_GITHUB_API_URL": url,
+        "PYTHONPATH": os.pathsep.join(
+            [str(ROOT_DIR / "src"), os.environ.get("PYTHONPATH", "")]
+        ),
+    }
+
+    summaries = {}
+    for workers in args.workers:
+        process = start_app(workers, args.port, env, args.log)
+        try:
+            records = load_test(
+                f"http://127.0.0.1:{args.port}",
+                args.users,
+                args.duration,
+                args.think,
+                processes=args.processes,
+            )
+        finally:
+            process.terminate()
+            process.wait()
+        summaries[workers] = summarize(records, args.duration)
+        print(f"\n{workers} workers, {args.users} users:")
+        print(summaries[workers].round(1).to_string())
+    server.shutdown()
+
+    results = pd.concat(summaries, names=["workers"])
+    print("\nAll callbacks:")
+    print(results.xs("all", level="name").round(1).to_string())
+    if args.output:
+        results.to_csv(args.output)
+
+
+if __name__ == "__main__":
+    main()
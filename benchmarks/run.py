@@ -0,0 +1,218 @@
+"""Benchmark the hot paths of the app, on synthetic data of different sizes.
+
+The data is generated by synthetic.py and served by standin.py, so no network is
+needed. The parsing, preprocessing and forecasts are timed, and all the figure
+callbacks are invoked directly. Run with e.g.:
+
+    python benchmarks/run.py --regions 300 3000 --days 300 1000
+
+The results are written to benchmarks/results/<commit>.json, and two runs can be
+compared with compare.py.
+"""
+import argparse
+import datetime
+import importlib
+import inspect
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import standin
+import synthetic
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def best_time(function: Callable[[], Any], repeat: int) -> float:
+    """Return the best time of a function, in seconds per call."""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def commit() -> str:
+    """Return the current commit, with a suffix if there are uncommitted changes."""
+    try:
+        sha = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+        dirty = subprocess.run(["git", "diff", "--quiet", "HEAD"]).returncode != 0
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{sha}-dirty" if dirty else sha
+
+
+def cases(directory: Path, url: str) -> Dict[str, Callable[[], Any]]:
+    """Prepare the benchmarks for the data in one directory.
+
+    Args:
+        directory (Path): The synthetic data.
+        url (str): Where the directory is served.
+
+    Returns:
+        dict: The functions to time, by name.
+    """
+    import covid19.dash_app
+    import covid19.dash_deaths
+    import covid19.dash_forecast
+    import covid19.dash_infected
+    import covid19.dash_us
+    import covid19.data
+    import covid19.forecast
+
+    infected_csv = directory / synthetic.INFECTED_FILE
+    deaths_csv = directory / synthetic.DEATHS_FILE
+    covid19.data.INFECTED_SOURCE_GLOBAL = f"{url}/{synthetic.INFECTED_FILE}"
+    covid19.data.DEATHS_SOURCE_GLOBAL = f"{url}/{synthetic.DEATHS_FILE}"
+    us_infected_csv = directory / synthetic.US_INFECTED_FILE
+    us_deaths_csv = directory / synthetic.US_DEATHS_FILE
+    covid19.data.INFECTED_SOURCE_US = f"{url}/{synthetic.US_INFECTED_FILE}"
+    covid19.data.DEATHS_SOURCE_US = f"{url}/{synthetic.US_DEATHS_FILE}"
+
+    # The raw data, and a snapshot for the callbacks to use
+    n_keys = len(covid19.data.CSSE_KEY_COLUMNS)
+    with open(infected_csv) as file:
+        dates = file.readline().strip().split(",")[n_keys:]
+    raw = covid19.data._read_csse_csv(infected_csv, dates)
+    snapshot = covid19.data.ingest(
+        infected_csv,
+        deaths_csv,
+        us_infected_csv=us_infected_csv,
+        us_deaths_csv=us_deaths_csv,
+    )
+    covid19.dash_app.set_snapshot(snapshot)
+    countries = snapshot.infected.max().nlargest(3).index.tolist()
+    state = covid19.dash_us.largest_state()
+    counties_selector = covid19.dash_us.us_counties_selector_options_value
+    counties = inspect.unwrap(counties_selector)(state)[1]
+    last_date = len(snapshot.infected_raw) - 1
+
+    # The callbacks are called without Dash and without their caches
+    infected = covid19.dash_infected
+    deaths = covid19.dash_deaths
+    callbacks: List[Any] = [
+        (infected.infected_in_total_figure_base_data, snapshot, countries),
+        (infected.infected_per_day_figure_base_data, snapshot, countries),
+        (infected.infected_map_figure, snapshot, last_date),
+        (infected.infected_map_data_data, None, None),
+        (infected.infected_map_payload, snapshot),
+        (infected.infected_map_slider_div_children,),
+        (deaths.deaths_per_pop_figure_base_data, snapshot, countries),
+        (deaths.deaths_per_inf_figure_base_data, snapshot, countries),
+        (
+            covid19.dash_forecast.forecast_figure_figure,
+            countries[0],
+            120,
+            3,
+            15,
+            "linear",
+            [],
+        ),
+        (covid19.dash_app.population_store_data, None, None),
+        (covid19.dash_us.us_counties_selector_options_value, state),
+        (covid19.dash_us.us_series, snapshot, state, None),
+        (covid19.dash_us.us_in_total_figure_base_data, snapshot, state, counties),
+        (covid19.dash_us.us_per_day_figure_base_data, snapshot, state, counties),
+    ]
+
+    benchmarks = {
+        "read_covid_csv": lambda: covid19.data.read_covid_csv(infected_csv),
+        "preprocess_covid_dataframe": lambda: (
+            covid19.data.preprocess_covid_dataframe(raw)
+        ),
+        "get_population": covid19.data.get_population,
+        "get_shifted_data": covid19.data.get_shifted_data,
+        "ingest": lambda: covid19.data.ingest(infected_csv, deaths_csv),
+        "read_us_csv": lambda: covid19.data.read_us_csv(us_infected_csv),
+        "ingest_us": lambda: covid19.data.ingest_us(us_infected_csv, us_deaths_csv),
+        "create_forecast": lambda: covid19.forecast.create_forecast(
+            snapshot.infected[countries[0]], 120, days_to_recover=15
+        ),
+        "ForecastGrid": lambda: covid19.forecast.ForecastGrid(
+            snapshot.infected,
+            covid19.dash_forecast.DAYS_OF_CONTROL,
+            covid19.dash_forecast.RECOVERY_DAYS,
+        ),
+    }
+    for callback, *args in callbacks:
+        function = inspect.unwrap(callback)
+        benchmarks[
+            f"callback:{callback.__name__}"
+        ] = lambda function=function, args=args: function(*args)
+    return benchmarks
+
+
+def main() -> None:
+    """Run the benchmarks, print and store the results."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--regions", type=int, nargs="+", default=[300, 3000])
+    parser.add_argument("--days", type=int, nargs="+", default=[300, 1000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--filter", help="Only run benchmarks containing this")
+    parser.add_argument("--output", type=Path, help="Defaults to results/<commit>")
+    args = parser.parse_args()
+
+    # Serve the data sets locally. The app loads its first snapshot when it is
+    # imported, so it is configured before any data is generated.
+    tmp_dir = Path(tempfile.mkdtemp(prefix="covid19-benchmarks-"))
+    sizes = [(regions, days) for regions in args.regions for days in args.days]
+    server, url = standin.serve(tmp_dir)
+    first = f"{url}/{sizes[0][0]}x{sizes[0][1]}"
+    os.environ.update(
+        COVID19_SNAPSHOT_DIR=str(tmp_dir / "snapshots"),
+        COVID19_HTTP_CACHE_DIR=str(tmp_dir / "http"),
+        COVID19_CSSE_TIME_SERIES_URL=first,
+        COVID19_GITHUB_API_URL=first,
+        COVID19_START_SCHEDULER="0",
+    )
+    for regions, days in sizes:
+        synthetic.write_csse_files(tmp_dir / f"{regions}x{days}", regions, days)
+    importlib.import_module("covid19.dash_main")
+
+    results = []
+    print(f"{'benchmark':45} {'regions':>8} {'days':>6} {'ms':>10}")
+    for regions, days in sizes:
+        name = f"{regions}x{days}"
+        for case, function in cases(tmp_dir / name, f"{url}/{name}").items():
+            if args.filter and args.filter not in case:
+                continue
+            seconds = best_time(function, args.repeat)
+            results.append(
+                {"case": case, "regions": regions, "days": days, "seconds": seconds}
+            )
+            print(f"{case:45} {regions:8d} {days:6d} {seconds * 1000:10.2f}")
+    server.shutdown()
+
+    packages = ["numpy", "pandas", "plotly", "dash"]
+    output = args.output or RESULTS_DIR / f"{commit()}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(
+        json.dumps(
+            {
+                "commit": commit(),
+                "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": sys.version.split()[0],
+                "machine": platform.machine(),
+                "packages": {
+                    package: importlib.import_module(package).__version__
+                    for package in packages
+                },
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
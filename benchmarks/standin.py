@@ -0,0 +1,81 @@
+"""Serve a directory as a local stand-in for GitHub.
+
+Files are served with an ETag, and conditional requests are answered with 304 Not
+Modified, like raw.githubusercontent.com does. The query string is ignored, so the
+commits-file written by synthetic.py answers the requests to the GitHub API. Run
+with e.g.:
+
+    python benchmarks/standin.py /tmp/csse --port 8766
+
+and point the app to it with
+
+    COVID19_CSSE_TIME_SERIES_URL=http://localhost:8766
+    COVID19_GITHUB_API_URL=http://localhost:8766
+"""
+import argparse
+import functools
+import hashlib
+import http.server
+import threading
+from pathlib import Path
+from typing import Tuple, Type
+
+
+class StandInHandler(http.server.SimpleHTTPRequestHandler):
+    """Serve static files, with ETags and conditional requests."""
+
+    def do_GET(self) -> None:
+        """Serve a file, or 304 if the client already has it."""
+        path = Path(self.translate_path(self.path.split("?")[0]))
+        if not path.is_file():
+            super().do_GET()
+            return
+        body = path.read_bytes()
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:
+        """Don't log every request."""
+
+
+def serve(
+    directory: Path, port: int = 0, handler: Type[StandInHandler] = StandInHandler
+) -> Tuple[http.server.ThreadingHTTPServer, str]:
+    """Serve a directory in a background thread.
+
+    Args:
+        directory (Path): The directory to serve.
+        port (int, optional): The port to listen on. Defaults to any free port.
+        handler (type, optional): The request handler, e.g. a subclass of
+                                  StandInHandler that records the requests.
+
+    Returns:
+        The server (stop it with shutdown()), and its URL.
+    """
+    server = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", port), functools.partial(handler, directory=str(directory))
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main() -> None:
+    """Serve a directory from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("directory", type=Path)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+    handler = functools.partial(StandInHandler, directory=str(args.directory))
+    http.server.ThreadingHTTPServer(("", args.port), handler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Generate synthetic data in the format of the CSSE time series.
+
+The files look like the ones in the CSSE repository, but can have any number of
+regions, US counties and dates. A file with the latest commit, like the one from
+the GitHub API, is written as well, so that the directory can be served by
+standin.py. Run with e.g.:
+
+    python benchmarks/synthetic.py --regions 3000 --days 1000 /tmp/csse
+"""
+import argparse
+import json
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+FIRST_DATE = pd.Timestamp("2020-01-22")
+INFECTED_FILE = "time_series_covid19_confirmed_global.csv"
+DEATHS_FILE = "time_series_covid19_deaths_global.csv"
+US_INFECTED_FILE = "time_series_covid19_confirmed_US.csv"
+US_DEATHS_FILE = "time_series_covid19_deaths_US.csv"
+COMMITS_FILE = Path("repos", "CSSEGISandData", "COVID-19", "commits")
+
+# The number of US states the counties are divided between
+US_STATES = 50
+
+# The fraction of the infected that die, two weeks later
+DEATH_RATE = 0.015
+DEATH_DELAY = 14
+
+
+def synthetic_counts(
+    regions: int, days: int, seed: int = 0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Create cumulative numbers of infected and deaths.
+
+    Each region has a few waves of new cases per day, starting at random dates.
+
+    Args:
+        regions (int): The number of regions.
+        days (int): The number of dates.
+        seed (int, optional): Seed of the random generator.
+
+    Returns:
+        2 np.ndarrays: The infected and deaths, with one row per region.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(days)
+    rate = np.zeros((regions, days))
+    for _ in range(3):
+        peak = rng.uniform(0, max(days, 60), size=(regions, 1))
+        width = rng.uniform(10, 60, size=(regions, 1))
+        height = rng.lognormal(4, 2, size=(regions, 1))
+        rate += height * np.exp(-(((t - peak) / width) ** 2))
+    new_infected = rng.poisson(rate)
+    new_deaths = rng.binomial(new_infected, DEATH_RATE)
+    new_deaths = np.pad(new_deaths, ((0, 0), (DEATH_DELAY, 0)))[:, :days]
+    return new_infected.cumsum(axis=1), new_deaths.cumsum(axis=1)
+
+
+def csse_frame(counts: np.ndarray, seed: int = 0) -> pd.DataFrame:
+    """Put the counts in the format of the CSSE time series.
+
+    The regions are the countries of the population data. If there are more regions
+    than countries, the rest are provinces of the countries, in turn.
+
+    Args:
+        counts (np.ndarray): The cumulative counts, with one row per region.
+        seed (int, optional): Seed of the random generator.
+
+    Returns:
+        pd.DataFrame: The data, in the same format as the CSSE files.
+    """
+    # Imported here, so that the app can be configured before it is imported
+    import covid19.data
+
+    rng = np.random.default_rng(seed)
+    regions, days = counts.shape
+    countries = [
+        country
+        for country in covid19.data.get_population().index
+        if not country.startswith("China - ")
+    ]
+    keys = pd.DataFrame(
+        {
+            "Province/State": [
+                None if i < len(countries) else f"Province {i // len(countries)}"
+                for i in range(regions)
+            ],
+            "Country/Region": [countries[i % len(countries)] for i in range(regions)],
+            "Lat": rng.uniform(-60, 70, regions).round(4),
+            "Long": rng.uniform(-180, 180, regions).round(4),
+        }
+    )
+    dates = pd.date_range(FIRST_DATE, periods=days)
+    columns = [f"{date.month}/{date.day}/{date:%y}" for date in dates]
+    return pd.concat([keys, pd.DataFrame(counts, columns=columns)], axis=1)
+
+
+def us_csse_frame(
+    counts: np.ndarray, population: Optional[np.ndarray] = None
+) -> pd.DataFrame:
+    """Put the counts in the format of the CSSE time series of US counties.
+
+    The counties are divided between US_STATES states, in turn.
+
+    Args:
+        counts (np.ndarray): The cumulative counts, with one row per county.
+        population (np.ndarray, optional): The population of the counties, which is
+                                           only in the file with deaths.
+
+    Returns:
+        pd.DataFrame: The data, in the same format as the CSSE files.
+    """
+    counties, days = counts.shape
+    state = np.arange(counties) % US_STATES + 1
+    county = np.arange(counties) // US_STATES + 1
+    fips = state * 1000 + county
+    keys = pd.DataFrame(
+        {
+            "UID": 84000000 + fips,
+            "iso2": "US",
+            "iso3": "USA",
+            "code3": 840,
+            "FIPS": fips.astype(float),
+            "Admin2": [f"County {i}" for i in county],
+            "Province_State": [f"State {i}" for i in state],
+            "Country_Region": "US",
+            "Lat": 40.0,
+            "Long_": -100.0,
+            "Combined_Key": [
+                f"County {i}, State {j}, US" for i, j in zip(county, state)
+            ],
+        }
+    )
+    if population is not None:
+        keys["Population"] = population
+    dates = pd.date_range(FIRST_DATE, periods=days)
+    columns = [f"{date.month}/{date.day}/{date:%y}" for date in dates]
+    return pd.concat([keys, pd.DataFrame(counts, columns=columns)], axis=1)
+
+
+def write_csse_files(
+    directory: Path, regions: int, days: int, seed: int = 0, counties: int = 500
+) -> None:
+    """Write the synthetic time series of infected and deaths, and a commit.
+
+    Args:
+        directory (Path): Where to write the files.
+        regions (int): The number of regions.
+        days (int): The number of dates.
+        seed (int, optional): Seed of the random generator.
+        counties (int, optional): The number of US counties.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    infected, deaths = synthetic_counts(regions, days, seed)
+    csse_frame(infected, seed).to_csv(directory / INFECTED_FILE, index=False)
+    csse_frame(deaths, seed).to_csv(directory / DEATHS_FILE, index=False)
+
+    us_infected, us_deaths = synthetic_counts(counties, days, seed + 1)
+    population = np.random.default_rng(seed).lognormal(10, 1.5, counties).astype(int)
+    us_csse_frame(us_infected).to_csv(directory / US_INFECTED_FILE, index=False)
+    us_csse_frame(us_deaths, population).to_csv(directory / US_DEATHS_FILE, index=False)
+
+    # The last commit, as reported by the GitHub API
+    commits = directory / COMMITS_FILE
+    commits.parent.mkdir(parents=True, exist_ok=True)
+    date = FIRST_DATE + pd.Timedelta(days=days)
+    commits.write_text(
+        json.dumps([{"commit": {"committer": {"date": f"{date:%Y-%m-%dT04:00:00Z}"}}}])
+    )
+
+
+def main() -> None:
+    """Write the files from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("directory", type=Path)
+    parser.add_argument("--regions", type=int, default=300)
+    parser.add_argument("--days", type=int, default=1000)
+    parser.add_argument("--counties", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_csse_files(args.directory, args.regions, args.days, args.seed, args.counties)
+
+
+if __name__ == "__main__":
+    main()
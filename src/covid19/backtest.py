@@ -0,0 +1,221 @@
+"""Backtest the forecast model on the full history of all countries.
+
+The forecast is made from every historical day of every country, and compared to
+what was later observed. The countries are spread over a pool of processes, which
+all memory-map the same snapshot read-only, so the data is only kept once in
+memory. Run with e.g.:
+
+    python -m covid19.backtest --workers 4 --output backtest.csv
+"""
+import argparse
+import concurrent.futures
+import os
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+import covid19.forecast
+import covid19.refresh
+import covid19.snapshot
+
+# The number of days after the forecast start to compare at
+HORIZONS = (1, 7, 14, 28)
+
+# The days of control to backtest, like the Forecast tab
+DAYS_OF_CONTROL = (60, 120, 180)
+
+# The number of observed days needed before the first forecast
+MIN_HISTORY = 7
+
+# The shifted data of the snapshot, in each worker process
+_infected: Optional[pd.DataFrame] = None
+
+
+def backtest_country(
+    infected: pd.Series,
+    days_of_control: Iterable[int] = DAYS_OF_CONTROL,
+    horizons: Iterable[int] = HORIZONS,
+    min_history: int = MIN_HISTORY,
+) -> pd.DataFrame:
+    """Forecast from every day of a timeseries, and compare to the observations.
+
+    Args:
+        infected (pd.Series): The timeseries of a country.
+        days_of_control (iterable of int, optional): The days of control to use.
+        horizons (iterable of int, optional): The days after the forecast start to
+                                              compare at.
+        min_history (int, optional): The number of observed days needed before the
+                                     first forecast.
+
+    Returns:
+        pd.DataFrame: One row per day of control, forecast start and horizon, with
+                      the predicted and observed values.
+    """
+    observed_data = infected.dropna()
+    observed = observed_data.to_numpy()
+    rows = []
+    for day_of_control in days_of_control:
+        for forecast_start in range(min_history, len(observed_data) - 1):
+            _, forecast, _ = covid19.forecast.create_forecast(
+                observed_data, day_of_control, forecast_start=forecast_start
+            )
+            for horizon in horizons:
+                day = forecast_start + horizon
+                if day >= len(observed) or day not in forecast.index:
+                    continue
+                rows.append(
+                    (
+                        day_of_control,
+                        forecast_start,
+                        horizon,
+                        forecast[day],
+                        observed[day],
+                    )
+                )
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "day_of_control",
+            "forecast_start",
+            "horizon",
+            "predicted",
+            "observed",
+        ],
+    )
+
+
+def score(results: pd.DataFrame) -> pd.DataFrame:
+    """Summarize the forecast errors, by day of control and horizon.
+
+    Args:
+        results (pd.DataFrame): The results from backtest_country (or run_backtest).
+
+    Returns:
+        pd.DataFrame: The number of forecasts, the mean and median absolute
+                      percentage error, and the mean log-ratio of predicted to
+                      observed (positive when the model overestimates).
+    """
+    errors = results.assign(
+        ape=(results["predicted"] / results["observed"] - 1).abs() * 100,
+        log_ratio=np.log(results["predicted"] / results["observed"]),
+    )
+    return errors.groupby(["day_of_control", "horizon"]).agg(
+        forecasts=("ape", "size"),
+        mean_ape=("ape", "mean"),
+        median_ape=("ape", "median"),
+        bias=("log_ratio", "mean"),
+    )
+
+
+def _init_worker(root: str, version: str) -> None:
+    """Memory-map the snapshot in a worker process."""
+    global _infected
+    snapshot = covid19.snapshot.SnapshotStore(Path(root)).load(version)
+    if snapshot is None:
+        raise RuntimeError(f"Snapshot {version} is missing from {root}")
+    _infected = snapshot.infected
+
+
+def _backtest_worker(
+    country: str,
+    days_of_control: Sequence[int],
+    horizons: Sequence[int],
+    min_history: int,
+) -> pd.DataFrame:
+    """Backtest one country of the snapshot of this worker."""
+    assert _infected is not None
+    results = backtest_country(
+        _infected[country], days_of_control, horizons, min_history
+    )
+    return results.assign(country=country)
+
+
+def run_backtest(
+    store: covid19.snapshot.SnapshotStore,
+    countries: Optional[List[str]] = None,
+    days_of_control: Sequence[int] = DAYS_OF_CONTROL,
+    horizons: Sequence[int] = HORIZONS,
+    min_history: int = MIN_HISTORY,
+    workers: Optional[int] = None,
+) -> pd.DataFrame:
+    """Backtest the forecast model on the current snapshot of a store.
+
+    Args:
+        store (SnapshotStore): The store to read the snapshot from. It is refreshed
+                               first, if needed.
+        countries (list of str, optional): The countries to backtest. Defaults to
+                                           all countries.
+        days_of_control (sequence of int, optional): The days of control to use.
+        horizons (sequence of int, optional): The days after the forecast start to
+                                              compare at.
+        min_history (int, optional): The number of observed days needed before the
+                                     first forecast.
+        workers (int, optional): The number of processes. Defaults to the number of
+                                 CPUs. With 1, everything runs in this process.
+
+    Returns:
+        pd.DataFrame: The results from backtest_country, for all countries.
+    """
+    snapshot = covid19.refresh.update_snapshot(store)
+    if countries is None:
+        countries = snapshot.infected.columns.tolist()
+    initargs = (str(store.root), snapshot.version)
+    arguments = (days_of_control, horizons, min_history)
+
+    if workers == 1:
+        _init_worker(*initargs)
+        results = [_backtest_worker(country, *arguments) for country in countries]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=initargs
+        ) as executor:
+            futures = [
+                executor.submit(_backtest_worker, country, *arguments)
+                for country in countries
+            ]
+            results = [future.result() for future in futures]
+    return pd.concat(results, ignore_index=True)
+
+
+def main() -> None:
+    """Run the backtest from the command line, and print the scores."""
+    parser = argparse.ArgumentParser(description="Backtest the forecast model.")
+    parser.add_argument("--countries", nargs="+", help="Defaults to all countries")
+    parser.add_argument(
+        "--days-of-control", type=int, nargs="+", default=list(DAYS_OF_CONTROL)
+    )
+    parser.add_argument("--horizons", type=int, nargs="+", default=list(HORIZONS))
+    parser.add_argument("--min-history", type=int, default=MIN_HISTORY)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", type=Path, help="Write all results to a CSV-file")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = run_backtest(
+        covid19.snapshot.SnapshotStore(),
+        countries=args.countries,
+        days_of_control=args.days_of_control,
+        horizons=args.horizons,
+        min_history=args.min_history,
+        workers=args.workers,
+    )
+    elapsed = time.perf_counter() - start
+
+    if args.output is not None:
+        results.to_csv(args.output, index=False)
+    with pd.option_context("display.float_format", "{:.3f}".format):
+        print(score(results))
+    n_forecasts = len(
+        results.drop_duplicates(["country", "day_of_control", "forecast_start"])
+    )
+    print(
+        f"{n_forecasts} forecasts of {results['country'].nunique()} countries"
+        f" in {elapsed:.1f} s with {args.workers} workers"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,31 @@
 """Create and configure the Dash App."""
+import functools
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
 import dash
 import dash_bootstrap_components as dbc
 import dash_html_components as html
+import flask
+import numpy as np
 import pandas as pd
-from dash.dependencies import Input, Output
+import plotly.graph_objects as go
+import plotly.io
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 
 import covid19.data
+import covid19.metrics
+import covid19.profiling
+import covid19.refresh
+import covid19.snapshot
 
+# Compress the responses with gzip. Dash disables brotli, since it costs a lot
+# more CPU, and it doesn't make our responses any smaller.
 app = dash.Dash(
+    compress=True,
     external_stylesheets=[dbc.themes.CERULEAN],
     meta_tags=[{"name": "viewport", "content": "width=device-width, initial-scale=1"}],
     suppress_callback_exceptions=True,
@@ -16,35 +34,473 @@ app.title = "Corona Dashboard"
 
 DROPDOWN_SELECTED_COUNTRIES = ["Norway", "Denmark", "Sweden"]
 
-# We store all the data as global variables, and update them below
-infected, deaths, population = covid19.data.get_shifted_data()
-infected_raw = covid19.data.download_infected()
-all_countries = [{"label": country, "value": country} for country in infected.columns]
+# How many figures to keep in the cache of each figure callback
+FIGURE_CACHE_SIZE = 64
+
+# The number of significant digits sent to the browser for the numbers in the
+# figures. Whole numbers are always sent exactly.
+FIGURE_SIGNIFICANT_DIGITS = int(os.environ.get("COVID19_FIGURE_SIGNIFICANT_DIGITS", 4))
+
+# Set COVID19_START_SCHEDULER=0 to not refresh the data in the process that imports
+# the app, e.g. the gunicorn master process when preloading the app
+START_SCHEDULER = os.environ.get("COVID19_START_SCHEDULER", "1") != "0"
+
+# All workers share the same data snapshot on disk
+store = covid19.snapshot.SnapshotStore()
+
+
+def country_options(snapshot: covid19.snapshot.Snapshot) -> List[dict]:
+    """Return the dropdown options for all countries in the snapshot."""
+    return [{"label": country, "value": country} for country in snapshot.infected]
+
+
+def set_snapshot(new_snapshot: covid19.snapshot.Snapshot) -> None:
+    """Switch the global variables over to a new snapshot.
+
+    The caches of the old snapshot are cleared, so that it can be released
+    together with its memory-mapped files, see snapshot_cache.
+    """
+    global snapshot, all_countries
+    if new_snapshot.version != snapshot.version:
+        snapshot = new_snapshot
+        all_countries = country_options(snapshot)
+        for cache_clear in _cache_clears:
+            cache_clear()
+
+
+def limit_precision(values: Any, digits: int = FIGURE_SIGNIFICANT_DIGITS) -> np.ndarray:
+    """Round numbers to a number of significant digits, but not beyond the decimal.
+
+    Args:
+        values (array-like): The numbers to round.
+        digits (int, optional): The number of significant digits.
+
+    Returns:
+        np.ndarray: The rounded numbers, as floats. NaN is kept as is.
+    """
+    values = np.asarray(values, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        decimals = digits - 1 - np.floor(np.log10(np.abs(values)))
+    decimals = np.where(np.isfinite(decimals), decimals, 0).clip(0, 15)
+    # Dividing by the power of ten gives the shortest representation in JSON
+    scale = 10.0 ** decimals
+    return np.round(values * scale) / scale
+
+
+def json_array(values: Any) -> list:
+    """Convert an array to a list of plain Python values.
+
+    The figures are serialized faster when they only contain types that the json
+    module handles natively. Dates become ISO-strings, and NaN becomes None.
+
+    Args:
+        values (array-like): The values to convert.
+
+    Returns:
+        list: The values.
+    """
+    if isinstance(values, pd.DatetimeIndex):
+        return list(values.strftime("%Y-%m-%dT%H:%M:%S"))
+    values = np.asarray(values)
+    if values.dtype.kind == "f":
+        return np.where(np.isnan(values), None, values).tolist()
+    return values.tolist()
+
+
+def scatter_data(data: pd.Series) -> Dict[str, Any]:
+    """Return the x- and y-values of a scatter trace, in a compact form.
+
+    Evenly spaced x-values (e.g. days since day zero, or dates) are sent as the
+    first value and the step, and the y-values are rounded by limit_precision.
+
+    Args:
+        data (pd.Series): The y-values, indexed by the x-values.
+
+    Returns:
+        dict: The x- and y-properties of the trace.
+    """
+    xy: Dict[str, Any] = {"y": json_array(limit_precision(data.to_numpy()))}
+    index = data.index
+    steps = np.diff(index.to_numpy())
+    if len(index) < 2 or not (steps == steps[0]).all():
+        xy["x"] = json_array(index)
+    elif isinstance(index, pd.DatetimeIndex):
+        # The step of dates is given in milliseconds
+        xy["x0"] = json_array(index[:1])[0]
+        xy["dx"] = pd.Timedelta(steps[0]) / pd.Timedelta("1ms")
+    else:
+        xy["x0"] = index[0].item()
+        xy["dx"] = steps[0].item()
+    return xy
+
+
+# A scatter trace with lines only, see plain_figure
+LINE_TRACE = go.Scatter(mode="lines").to_plotly_json()
+
+
+def plain_figure(data: List[dict], layout: dict) -> Dict[str, Any]:
+    """Put together a figure from plain dicts, without validating it.
+
+    Validating every property with plotly takes a large part of the time spent in
+    the callbacks. Instead, the static parts of the traces and layouts are created
+    as plotly objects once, and then converted to plain dicts. tests/test_figures.py
+    checks that plotly builds the same figures.
+
+    Args:
+        data (list): The traces.
+        layout (dict): The layout.
+
+    Returns:
+        dict: The figure.
+    """
+    return {"data": data, "layout": layout}
+
+
+# The cache_clear() of all caches made by snapshot_cache
+_cache_clears: List[Callable[[], None]] = []
+
+CACHE_LOOKUPS = covid19.metrics.Counter(
+    "covid19_cache_lookups_total",
+    "Lookups in the caches of the figures and of data derived from the snapshot.",
+    ["cache", "result"],
+)
+
+
+def snapshot_cache(
+    maxsize: int, name: Optional[str] = None
+) -> Callable[[Callable], Callable]:
+    """Cache a function of a snapshot, and count the hits and misses.
+
+    The function is cached like with functools.lru_cache, and its first argument
+    must be the snapshot. The results (and keys) keep the memory-mapped files of
+    their snapshot alive, so the caches are cleared when the app switches to a new
+    snapshot. A call that was still using the old snapshot clears its cache again.
+    The hits and misses of all workers are exported as covid19_cache_lookups_total
+    on /metrics.
+
+    Args:
+        maxsize (int): The number of results to keep.
+        name (str, optional): The name of the cache. Defaults to the name of the
+                              function.
+
+    Returns:
+        Callable: A decorator.
+    """
+
+    def decorator(function: Callable) -> Callable:
+        cache = name or function.__name__
+        lookup = threading.local()
+
+        @functools.lru_cache(maxsize=maxsize)
+        def cached(*args: Any) -> Any:
+            lookup.missed = True
+            return function(*args)
+
+        @functools.wraps(function)
+        def wrapper(*args: Any) -> Any:
+            lookup.missed = False
+            result = cached(*args)
+            CACHE_LOOKUPS.inc(cache=cache, result="miss" if lookup.missed else "hit")
+            if args[0] != snapshot:
+                cached.cache_clear()
+            return result
+
+        wrapper.cache_info = cached.cache_info  # type: ignore
+        wrapper.cache_clear = cached.cache_clear  # type: ignore
+        _cache_clears.append(cached.cache_clear)
+        return wrapper
+
+    return decorator
+
+
+def memoize_figure(function: Callable) -> Callable:
+    """Memoize a figure callback on the snapshot version and its inputs.
+
+    The figure callbacks are pure functions of the data and their inputs, and most
+    visitors use the default inputs. The callback is given the current snapshot as
+    its first argument, followed by its inputs, and must only use the data of that
+    snapshot. Since snapshots are keyed by their version, a refresh during the
+    callback can't mix the data of two versions. See snapshot_cache.
+
+    Args:
+        function (Callable): The callback.
+
+    Returns:
+        Callable: The memoized callback.
+    """
+
+    @snapshot_cache(FIGURE_CACHE_SIZE, name=function.__name__)
+    def cached(data: covid19.snapshot.Snapshot, *args: Any) -> Any:
+        return function(
+            data, *[list(arg) if isinstance(arg, tuple) else arg for arg in args]
+        )
+
+    @functools.wraps(function)
+    def wrapper(*args: Any) -> Any:
+        # The lists of e.g. countries must be made hashable. Their order matters,
+        # since it decides the colors of the lines.
+        key = [tuple(arg) if isinstance(arg, list) else arg for arg in args]
+        return cached(snapshot, *key)
+
+    wrapper.cache_info = cached.cache_info  # type: ignore
+    return wrapper
+
+
+# The plotly template is sent to the browser once, instead of with every figure
+FIGURE_TEMPLATE = plotly.io.templates[plotly.io.templates.default].to_plotly_json()
+
+# Finish a figure stored by the server, and apply the plot options (if any)
+FIGURE_JS = """
+function(base, population, template, plotOptions) {
+    if (!base || !population) {
+        return window.dash_clientside.no_update;
+    }
+    plotOptions = plotOptions || [];
+    var perPop = plotOptions.indexOf("per_pop_size") !== -1;
+    var logScale = plotOptions.indexOf("log_scale") !== -1;
+    var populations = base.population || population.population;
+
+    var data = base.figure.data.map(function(trace) {
+        if (!perPop) {
+            return trace;
+        }
+        var tracePopulation = populations[trace.name];
+        return Object.assign({}, trace, {
+            y: trace.y.map(function(value) {
+                if (value === null || !tracePopulation) {
+                    return null;
+                }
+                return value / tracePopulation * 100000;
+            })
+        });
+    });
+
+    var layout = Object.assign({}, base.figure.layout, {template: template});
+    var yaxis = Object.assign({}, layout.yaxis);
+    if (perPop) {
+        layout.title = base.per_pop_size.title;
+        Object.assign(yaxis, base.per_pop_size.yaxis);
+    }
+    yaxis.type = logScale ? "log" : "linear";
+    layout.yaxis = yaxis;
+    return {data: data, layout: layout};
+}
+"""
+
+
+def figure_base(
+    figure: Dict[str, Any],
+    per_pop_size: Optional[dict] = None,
+    population: Optional[Dict[str, Optional[float]]] = None,
+) -> Dict[str, Any]:
+    """Prepare a figure to be finished in the browser, see clientside_figure.
+
+    Args:
+        figure (dict): The figure in absolute numbers, without a template. The
+                       browser adds the template.
+        per_pop_size (dict, optional): The title and y-axis to use per 100k
+                                       population.
+        population (dict, optional): The population of each trace, by name. By
+                                     default, the traces are countries, and the
+                                     population is taken from "population-store".
+
+    Returns:
+        dict: The data to store in the dcc.Store of the figure.
+    """
+    base = {"figure": figure, "per_pop_size": per_pop_size}
+    if population is not None:
+        base["population"] = population
+    return base
+
+
+def clientside_figure(figure_id: str, options_id: Optional[str] = None) -> None:
+    """Finish a figure in the browser, and apply its plot options there.
+
+    The server stores the figure (see figure_base) in a dcc.Store with the id
+    f"{figure_id}-base". Adding the template, and switching to a logarithmic scale
+    or per 100k population, is then done without asking the server.
+
+    Args:
+        figure_id (str): The id of the dcc.Graph.
+        options_id (str, optional): The id of the checklist with the plot options.
+    """
+    inputs = [
+        Input(f"{figure_id}-base", "data"),
+        Input("population-store", "data"),
+        Input("figure-template", "data"),
+    ]
+    if options_id is not None:
+        inputs.append(Input(options_id, "value"))
+    app.clientside_callback(FIGURE_JS, Output(figure_id, "figure"), inputs)
+
+
+# We store the snapshot as a global variable, and the scheduler updates it. Start
+# from the snapshot on disk, and only wait for the network if there is none.
+snapshot = store.load() or covid19.refresh.update_snapshot(store)
+all_countries = country_options(snapshot)
+scheduler: Optional[covid19.refresh.RefreshScheduler] = None
+
+
+def start_scheduler() -> None:
+    """Refresh the data in the background of this process.
+
+    The first refresh is done right away, if the snapshot is stale. Threads don't
+    survive a fork, so with gunicorn's preload_app the workers start their own
+    scheduler after forking (see gunicorn_config.py).
+    """
+    global scheduler
+    scheduler = covid19.refresh.RefreshScheduler(
+        store, on_update=set_snapshot, refresh_first=True
+    )
+    scheduler.start()
+
+
+if START_SCHEDULER:
+    start_scheduler()
+
+# The latency and payload size of the callbacks are measured for /metrics
+UPDATE_COMPONENT_PATH = f"{app.config.routes_pathname_prefix}_dash-update-component"
+CALLBACK_DURATION = covid19.metrics.Histogram(
+    "covid19_callback_duration_seconds",
+    "Time spent handling the requests of the Dash callbacks, by output.",
+    ["callback"],
+)
+CALLBACK_PAYLOAD_BYTES = covid19.metrics.Histogram(
+    "covid19_callback_payload_bytes",
+    "Size of the responses of the Dash callbacks before compression, by output.",
+    ["callback"],
+    buckets=covid19.metrics.SIZE_BUCKETS,
+)
+
+
+def _seconds(timedelta: Optional[pd.Timedelta]) -> Optional[float]:
+    """Return the length of a time period in seconds, if it is known."""
+    return None if timedelta is None else timedelta.total_seconds()
+
+
+covid19.metrics.Gauge(
+    "covid19_snapshot_age_seconds",
+    "Time since the snapshot was last known to be up to date.",
+    lambda: _seconds(store.age()),
+)
+covid19.metrics.Gauge(
+    "covid19_data_age_seconds",
+    "Time since the upstream update of the data in the snapshot.",
+    lambda: _seconds(
+        store.upstream() and pd.Timestamp.now(tz="UTC") - store.upstream()
+    ),
+)
+
+
+@app.server.before_request
+def start_timer() -> None:
+    """Note when the handling of a request started, see record_callback."""
+    flask.g.start_time = time.perf_counter()
+
+
+def callback_name() -> str:
+    """Return the output of the callback that the current request is for.
+
+    Anything that is not the output of one of our callbacks is named "other", so
+    that clients can't add new series to the metrics.
+    """
+    body = flask.request.get_json(silent=True)
+    output = body.get("output") if isinstance(body, dict) else None
+    if not isinstance(output, str) or output not in app.callback_map:
+        return "other"
+    # Multiple outputs are given as e.g. "..a.value...b.value.."
+    return output.strip(".").replace("...", ",")
+
+
+@app.server.after_request
+def record_callback(response: flask.Response) -> flask.Response:
+    """Record the latency and payload size of each callback."""
+    if flask.request.path == UPDATE_COMPONENT_PATH:
+        callback = callback_name()
+        CALLBACK_DURATION.observe(
+            time.perf_counter() - flask.g.start_time, callback=callback
+        )
+        CALLBACK_PAYLOAD_BYTES.observe(
+            response.calculate_content_length() or 0, callback=callback
+        )
+    return response
+
+
+def profile_dispatch() -> None:
+    """Profile the callbacks selected by covid19.profiling.
+
+    The view function of Dash that dispatches the callbacks is wrapped, so that the
+    profile contains the parsing of the request and the serialization of the
+    response as well.
+    """
+    endpoint = next(
+        rule.endpoint
+        for rule in app.server.url_map.iter_rules()
+        if rule.rule == UPDATE_COMPONENT_PATH
+    )
+    dispatch = app.server.view_functions[endpoint]
+
+    @functools.wraps(dispatch)
+    def profiled_dispatch(*args: Any, **kwargs: Any) -> Any:
+        token = flask.request.headers.get(covid19.profiling.HEADER)
+        with covid19.profiling.profile(
+            callback_name(), force=covid19.profiling.requested(token)
+        ):
+            return dispatch(*args, **kwargs)
+
+    app.server.view_functions[endpoint] = profiled_dispatch
+
+
+# Nothing is wrapped unless profiling is enabled
+if covid19.profiling.ENABLED:
+    profile_dispatch()
+
+
+@app.server.route("/metrics")
+def metrics() -> flask.Response:
+    """Export the metrics of all workers in the Prometheus text format."""
+    return flask.Response(
+        covid19.metrics.render(), content_type=covid19.metrics.CONTENT_TYPE
+    )
+
+
+@app.callback(
+    Output("population-store", "data"),
+    [Input("interval-component", "n_intervals")],
+    [State("population-store", "data")],
+)
+def population_store_data(_, current: Optional[dict]) -> Dict[str, Any]:
+    """Send the population of all countries to the browser, once per data version."""
+    if current is not None and current["version"] == snapshot.version:
+        raise PreventUpdate
+    return {
+        "version": snapshot.version,
+        "population": snapshot.population["Population"].to_dict(),
+    }
 
 
-# Periodically update the value of the global variables
 @app.callback(
     Output("live-update-text", "children"),
     [Input("interval-component", "n_intervals")],
 )
 def live_update_text_children(*_):
-    """Update global data and last-updated-text.
+    """Periodically update the last-updated-text.
 
     Returns:
         HTML text with last-updated-info.
     """
-    # We store all the data as global variables, and update them here
-    global infected, deaths, population, infected_raw, all_countries
-    infected, deaths, population = covid19.data.get_shifted_data()
-    infected_raw = covid19.data.download_infected()
-    all_countries = [
-        {"label": country, "value": country} for country in infected.columns
-    ]
-
-    # Find elapsed time since last update
-    data_timestamp = covid19.data.data_timestamp()
-    now = pd.Timestamp.now(tz=data_timestamp.tz)
-    since_update = (now - data_timestamp).round("10min")
+    # Find elapsed time since last update. Until the upstream timestamp has been
+    # found, use the one stored with the snapshot, if any.
+    data_timestamp = covid19.data.data_timestamp() or store.upstream()
+    now = pd.Timestamp.now(tz="UTC")
+    if data_timestamp is None:
+        updated = "Data update time unknown."
+    else:
+        since_update = (now - data_timestamp).round("10min")
+        updated = (
+            f"Data updated {since_update.components.hours} hours and "
+            f"{round(since_update.components.minutes/10)*10} minutes ago."
+        )
 
     # Find time until next update
     if now.timetz() < covid19.data.DATA_UPDATE_TIME:
@@ -56,8 +512,7 @@ def live_update_text_children(*_):
 
     # Return text about current and next update
     return html.P(
-        f"Data updated {since_update.components.hours} hours and "
-        f"{round(since_update.components.minutes/10)*10} minutes ago. "
+        f"{updated} "
         f"Next update expected in approx {until_update.components.hours} hours and "
         f"{round(until_update.components.minutes/10)*10} minutes."
     )
@@ -8,10 +8,27 @@ import plotly.graph_objects as go
 from dash.dependencies import Input, Output
 
 import covid19.dash_app
+import covid19.snapshot
 
 from .dash_app import app
 from .data import DAY_ZERO_START
 
+# The parts of the figures that don't depend on the data, validated once
+PER_POP_LAYOUT = go.Layout(
+    title="Death numbers in total",
+    xaxis={"title": f"Days since more that {DAY_ZERO_START} people confirmed infected"},
+    yaxis={"title": "Deaths total", "hoverformat": ".0f"},
+    hovermode="x",
+    margin={"l": 0, "r": 0},
+).to_plotly_json()
+PER_INF_LAYOUT = go.Layout(
+    title="Deaths per confirmed infected (CFR)",
+    xaxis={"title": f"Days since more that {DAY_ZERO_START} people confirmed infected"},
+    yaxis={"title": "Deaths per infected (CFR)", "hoverformat": ".3f"},
+    hovermode="x",
+    margin={"l": 0, "r": 0},
+).to_plotly_json()
+
 tab_deaths = html.Div(
     [
         dbc.Row(
@@ -58,6 +75,9 @@ tab_deaths = html.Div(
         ),
         dbc.Row([dbc.Col(dcc.Graph(id="deaths-per-pop-figure"), md=12)]),
         dbc.Row([dbc.Col(dcc.Graph(id="deaths-per-inf-figure"), md=12)]),
+        # The figures are finished in the browser
+        dcc.Store(id="deaths-per-pop-figure-base"),
+        dcc.Store(id="deaths-per-inf-figure-base"),
     ]
 )
 
@@ -73,89 +93,61 @@ def deaths_countries_selector_options(*_) -> List[dict]:
 
 
 @app.callback(
-    Output("deaths-per-pop-figure", "figure"),
-    [
-        Input("deaths-countries-selector", "value"),
-        Input("deaths-plot-options", "value"),
-    ],
+    Output("deaths-per-pop-figure-base", "data"),
+    [Input("deaths-countries-selector", "value")],
 )
-def deaths_per_pop_figure_figure(
-    countries_to_plot: List[str], plot_options: List[str]
-) -> go.Figure:
+@covid19.dash_app.memoize_figure
+def deaths_per_pop_figure_base_data(
+    snapshot: covid19.snapshot.Snapshot, countries_to_plot: List[str]
+) -> dict:
     """Create the death-per-pop figure."""
-    # Handle plot options
-    if "log_scale" in plot_options:
-        y_axis_type = "log"
-    else:
-        y_axis_type = "linear"
-    if "per_pop_size" in plot_options:
-        fig_title = "Deaths per 100.000 population"
-        y_axis_title = "Deaths per 100.000"
-        hoverformat = ".1f"
-    else:
-        fig_title = "Death numbers in total"
-        y_axis_title = "Deaths total"
-        hoverformat = ".0f"
-
-    deaths = covid19.dash_app.deaths
-    population = covid19.dash_app.population
-
-    fig = go.Figure(
-        layout={
-            "title": fig_title,
-            "xaxis": {
-                "title": (
-                    f"Days since more that {DAY_ZERO_START}"
-                    f" people confirmed infected"
-                )
-            },
-            "yaxis": {
-                "title": y_axis_title,
-                "type": y_axis_type,
-                "hoverformat": hoverformat,
-            },
-            "hovermode": "x",
-            "margin": {"l": 0, "r": 0},
+    deaths = snapshot.deaths
+
+    data = [
+        {
+            **covid19.dash_app.LINE_TRACE,
+            **covid19.dash_app.scatter_data(deaths[country].dropna()),
+            "name": country,
         }
+        for country in countries_to_plot
+    ]
+    fig = covid19.dash_app.plain_figure(data, PER_POP_LAYOUT)
+    return covid19.dash_app.figure_base(
+        fig,
+        per_pop_size={
+            "title": {"text": "Deaths per 100.000 population"},
+            "yaxis": {"title": {"text": "Deaths per 100.000"}, "hoverformat": ".1f"},
+        },
     )
-    for country in countries_to_plot:
-        if "per_pop_size" in plot_options:
-            data = (
-                deaths[country].dropna()
-                / population.loc[country, "Population"]
-                * 100_000
-            )
-        else:
-            data = deaths[country].dropna()
-        fig.add_trace(
-            go.Scatter(x=data.index, y=data.values, name=country, mode="lines")
-        )
-    return fig
+
+
+covid19.dash_app.clientside_figure("deaths-per-pop-figure", "deaths-plot-options")
 
 
 @app.callback(
-    Output("deaths-per-inf-figure", "figure"),
+    Output("deaths-per-inf-figure-base", "data"),
     [Input("deaths-countries-selector", "value")],
 )
-def deaths_per_inf_figure_figure(countries_to_plot: List[str]) -> go.Figure:
+@covid19.dash_app.memoize_figure
+def deaths_per_inf_figure_base_data(
+    snapshot: covid19.snapshot.Snapshot, countries_to_plot: List[str]
+) -> dict:
     """Create the figure with Case Fatality Rate."""
-    infected = covid19.dash_app.infected
-    deaths = covid19.dash_app.deaths
-    fig = go.Figure(
-        layout={
-            "title": "Deaths per confirmed infected (CFR)",
-            "xaxis": {
-                "title": f"Days since more that {DAY_ZERO_START}"
-                " people confirmed infected"
-            },
-            "yaxis": {"title": "Deaths per infected (CFR)", "hoverformat": ".3f"},
-            "hovermode": "x",
-            "margin": {"l": 0, "r": 0},
+    infected = snapshot.infected
+    deaths = snapshot.deaths
+
+    data = [
+        {
+            **covid19.dash_app.LINE_TRACE,
+            **covid19.dash_app.scatter_data(
+                (deaths[country] / infected[country]).dropna()
+            ),
+            "name": country,
         }
-    )
-    for country in countries_to_plot:
-        data = (deaths[country] / infected[country]).dropna()
-        fig.add_trace(
-            go.Scatter(x=data.index, y=data.values, name=country, mode="lines")
-        )
-    return fig
+        for country in countries_to_plot
+    ]
+    fig = covid19.dash_app.plain_figure(data, PER_INF_LAYOUT)
+    return covid19.dash_app.figure_base(fig)
+
+
+covid19.dash_app.clientside_figure("deaths-per-inf-figure")
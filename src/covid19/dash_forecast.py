@@ -1,5 +1,5 @@
 """The dash-tab with forecast data."""
-from typing import List
+from typing import List, Optional
 
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
@@ -7,11 +7,50 @@ import dash_html_components as html
 import plotly.graph_objects as go
 from dash.dependencies import Input, Output
 
+import covid19.dash_app
 import covid19.forecast
+import covid19.snapshot
 from covid19.data import DAY_ZERO_START
 
 from .dash_app import app
 
+# The values of the sliders, which all forecasts are computed for
+DAYS_OF_CONTROL = range(60, 181, 10)
+RECOVERY_DAYS = range(5, 26, 5)
+
+# The number of trajectories behind the uncertainty bands, and the percentiles they
+# show. The seed is fixed, so that all workers draw the same figure.
+ENSEMBLE_SIZE = 1000
+ENSEMBLE_SEED = 0
+BAND_PERCENTILES = (5, 95)
+
+# The parts of the figure that don't depend on the data, validated once
+OBSERVED_TRACE = go.Scatter(
+    name="Currently infected", line={"color": "green", "width": 8}, mode="lines"
+).to_plotly_json()
+FORECAST_TRACE = go.Scatter(
+    name="Forecast infected",
+    line={"color": "green", "width": 3, "dash": "dash"},
+    mode="lines",
+).to_plotly_json()
+BEING_ILL_TRACE = go.Scatter(
+    name="People being ill",
+    line={"color": "orange", "width": 3, "dash": "dash"},
+    mode="lines",
+).to_plotly_json()
+# The uncertainty bands are filled between a lower and an upper line
+BAND_LOWER_TRACE = go.Scatter(
+    line={"width": 0}, mode="lines", showlegend=False, hoverinfo="skip"
+).to_plotly_json()
+BAND_UPPER_TRACE = go.Scatter(
+    line={"width": 0}, mode="lines", fill="tonexty", hoverinfo="skip"
+).to_plotly_json()
+LAYOUT = go.Layout(
+    title="Forecast: Number of infected and ill people over time",
+    xaxis={"title": f"Days since more that {DAY_ZERO_START} people confirmed infected"},
+    margin={"l": 0, "r": 0},
+).to_plotly_json()
+
 tab_forecast = html.Div(
     [
         dbc.Row(
@@ -36,10 +75,10 @@ tab_forecast = html.Div(
                             dbc.Label("The day when spreading is under control"),
                             dcc.Slider(
                                 id="day-of-control",
-                                min=60,
-                                max=180,
-                                step=10,
-                                marks={i: f"{i}" for i in range(60, 181, 10)},
+                                min=DAYS_OF_CONTROL[0],
+                                max=DAYS_OF_CONTROL[-1],
+                                step=DAYS_OF_CONTROL.step,
+                                marks={i: f"{i}" for i in DAYS_OF_CONTROL},
                                 value=120,
                             ),
                         ]
@@ -74,10 +113,10 @@ tab_forecast = html.Div(
                             ),
                             dcc.Slider(
                                 id="recovery-days",
-                                min=5,
-                                max=25,
-                                step=5,
-                                marks={i: f"{i}" for i in range(5, 26, 5)},
+                                min=RECOVERY_DAYS[0],
+                                max=RECOVERY_DAYS[-1],
+                                step=RECOVERY_DAYS.step,
+                                marks={i: f"{i}" for i in RECOVERY_DAYS},
                                 value=15,
                             ),
                         ]
@@ -104,6 +143,27 @@ tab_forecast = html.Div(
                 md=6,
             )
         ),
+        dbc.Row(
+            dbc.Col(
+                dbc.FormGroup(
+                    [
+                        dbc.Label("Plot options"),
+                        dbc.Checklist(
+                            options=[
+                                {
+                                    "label": "Show 90% uncertainty bands",
+                                    "value": "uncertainty",
+                                },
+                            ],
+                            value=[],
+                            id="forecast-plot-options",
+                            switch=True,
+                        ),
+                    ]
+                ),
+                md=6,
+            )
+        ),
         dbc.Row([dbc.Col(dcc.Graph(id="forecast-figure"), md=12)]),
         dbc.Row(
             [
@@ -150,6 +210,23 @@ def forecast_country_selector_options(*_) -> List[dict]:
     return covid19.dash_app.all_countries
 
 
+@covid19.dash_app.snapshot_cache(maxsize=1)
+def forecast_grid(snapshot: covid19.snapshot.Snapshot) -> covid19.forecast.ForecastGrid:
+    """Compute the forecasts for all countries and slider values.
+
+    This is done once per snapshot version, when the first forecast is requested.
+
+    Args:
+        snapshot (Snapshot): The data. Snapshots are cached by their version.
+
+    Returns:
+        covid19.forecast.ForecastGrid: The forecasts.
+    """
+    return covid19.forecast.ForecastGrid(
+        snapshot.infected, DAYS_OF_CONTROL, RECOVERY_DAYS
+    )
+
+
 @app.callback(
     Output("forecast-figure", "figure"),
     [
@@ -158,6 +235,7 @@ def forecast_country_selector_options(*_) -> List[dict]:
         Input("unrecorded-factor", "value"),
         Input("recovery-days", "value"),
         Input("forecast-figure-scale", "value"),
+        Input("forecast-plot-options", "value"),
     ],
 )
 def forecast_figure_figure(
@@ -166,58 +244,80 @@ def forecast_figure_figure(
     unrecorded_factor: float,
     recovery_days: int,
     y_axis_type: str,
-) -> go.Figure:
+    plot_options: Optional[List[str]] = None,
+) -> dict:
     """Create figure with the forecasts."""
-    infected = covid19.dash_app.infected
-
-    observed_data, forecast, being_ill = covid19.forecast.create_forecast(
-        infected[country],
-        day_of_control=day_of_control,
-        days_to_recover=recovery_days,
-        forecast_start=-1,
-        ratio_avg_days=4,
-    )
+    snapshot = covid19.dash_app.snapshot
+
+    if day_of_control in DAYS_OF_CONTROL and recovery_days in RECOVERY_DAYS:
+        observed_data, forecast, being_ill = forecast_grid(snapshot).lookup(
+            country, day_of_control, recovery_days
+        )
+    else:
+        observed_data, forecast, being_ill = covid19.forecast.create_forecast(
+            snapshot.infected[country],
+            day_of_control=day_of_control,
+            days_to_recover=recovery_days,
+            forecast_start=-1,
+            ratio_avg_days=4,
+        )
 
     observed_data *= unrecorded_factor
     forecast *= unrecorded_factor
     being_ill *= unrecorded_factor
 
-    fig = go.Figure(
-        layout={
-            "title": "Forecast: Number of infected and ill people over time",
-            "xaxis": {
-                "title": f"Days since more that {DAY_ZERO_START}"
-                f" people confirmed infected"
-            },
-            "yaxis": {"type": y_axis_type},
-            "margin": {"l": 0, "r": 0},
-        }
-    )
-    fig.add_trace(
-        go.Scatter(
-            x=observed_data.index,
-            y=observed_data.values,
-            name="Currently infected",
-            line=dict(color="green", width=8),
-            mode="lines",
-        )
-    )
-    fig.add_trace(
-        go.Scatter(
-            x=forecast.index,
-            y=forecast.values,
-            name="Forecast infected",
-            line=dict(color="green", width=3, dash="dash"),
-            mode="lines",
-        )
-    )
-    fig.add_trace(
-        go.Scatter(
-            x=being_ill.index,
-            y=being_ill.values,
-            name="People being ill",
-            line=dict(color="orange", width=3, dash="dash"),
-            mode="lines",
+    data = [
+        {
+            **OBSERVED_TRACE,
+            "x": observed_data.index.tolist(),
+            "y": covid19.dash_app.json_array(observed_data),
+        },
+        {
+            **FORECAST_TRACE,
+            "x": forecast.index.tolist(),
+            "y": covid19.dash_app.json_array(forecast),
+        },
+        {
+            **BEING_ILL_TRACE,
+            "x": being_ill.index.tolist(),
+            "y": covid19.dash_app.json_array(being_ill),
+        },
+    ]
+    if plot_options and "uncertainty" in plot_options:
+        bands = covid19.forecast.forecast_ensemble(
+            snapshot.infected[country],
+            day_of_control=day_of_control,
+            days_to_recover=recovery_days,
+            n_samples=ENSEMBLE_SIZE,
+            percentiles=BAND_PERCENTILES,
+            seed=ENSEMBLE_SEED,
         )
-    )
-    return fig
+        for band, trace in zip(bands, (FORECAST_TRACE, BEING_ILL_TRACE)):
+            band = band * unrecorded_factor
+            x = band.index.tolist()
+            color = trace["line"]["color"]
+            data.append(
+                {
+                    **BAND_LOWER_TRACE,
+                    "x": x,
+                    "y": covid19.dash_app.json_array(band[BAND_PERCENTILES[0]]),
+                    "line": {**BAND_LOWER_TRACE["line"], "color": color},
+                    "legendgroup": trace["name"],
+                }
+            )
+            data.append(
+                {
+                    **BAND_UPPER_TRACE,
+                    "x": x,
+                    "y": covid19.dash_app.json_array(band[BAND_PERCENTILES[-1]]),
+                    "line": {**BAND_UPPER_TRACE["line"], "color": color},
+                    "legendgroup": trace["name"],
+                    "name": f"{trace['name']} (90%)",
+                }
+            )
+    layout = {
+        **LAYOUT,
+        "yaxis": {"type": y_axis_type},
+        "template": covid19.dash_app.FIGURE_TEMPLATE,
+    }
+    return covid19.dash_app.plain_figure(data, layout)
@@ -1,6 +1,8 @@
 """Create the tab with infection data."""
+import base64
 import itertools
-from typing import List
+import os
+from typing import Any, Dict, List, Optional
 
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
@@ -9,13 +11,58 @@ import numpy as np
 import pandas as pd
 import plotly.colors
 import plotly.graph_objects as go
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 
 import covid19.dash_app
+import covid19.snapshot
 
 from .dash_app import app
 from .data import DAY_ZERO_START
 
+# Update the map in the browser when the date-slider moves, instead of asking the
+# server for a new figure. Set COVID19_CLIENTSIDE_MAP=0 to use the server.
+CLIENTSIDE_MAP = os.environ.get("COVID19_CLIENTSIDE_MAP", "1") != "0"
+
+# The parts of the figures that don't depend on the data, validated once
+PER_DAY_TRACE = go.Scatter(hovertemplate="Average last week: %{y}").to_plotly_json()
+IN_TOTAL_LAYOUT = go.Layout(
+    title="Infected people in total",
+    xaxis={"title": f"Days since more that {DAY_ZERO_START} people confirmed infected"},
+    yaxis={"title": "Infected total", "hoverformat": ",.0f"},
+    hovermode="x",
+    margin={"l": 0, "r": 0},
+).to_plotly_json()
+PER_DAY_LAYOUT = go.Layout(
+    title="New infections per day",
+    xaxis={"title": "Date"},
+    yaxis={"title": "Infections per day", "hoverformat": ",.0f"},
+    hovermode="x",
+    margin={"l": 0, "r": 0},
+    legend={"tracegroupgap": 0},
+).to_plotly_json()
+MAP_TRACE = go.Choropleth(
+    zmax=2000,
+    zmin=0,
+    hovertemplate=(
+        "<b>%{text}</b><br><br>Total infected: %{customdata[0]:,.0f}"
+        "<br>Population: %{customdata[1]:,.0f}"
+        "<br>Inf. per pop.: %{customdata[2]:,.1f}<extra></extra>"
+    ),
+    colorscale="Reds",
+    marker={"line": {"color": "darkgray", "width": 0.5}},
+).to_plotly_json()
+MAP_LAYOUT = go.Layout(
+    title="COVID-19 Confirmed infected per 100.000 population",
+    margin={"l": 0, "r": 0, "b": 10},
+    geo={
+        "showframe": False,
+        "showcoastlines": False,
+        "projection": {"scale": 1.2},
+        "center": {"lon": 10, "lat": 20},
+    },
+).to_plotly_json()
+
 tab_infected = html.Div(
     [
         dbc.Row(
@@ -62,6 +109,9 @@ tab_infected = html.Div(
         ),
         dbc.Row([dbc.Col(dcc.Graph(id="infected-in-total-figure"), md=12)]),
         dbc.Row([dbc.Col(dcc.Graph(id="infected-per-day-figure"), md=12)]),
+        # The figures are finished in the browser
+        dcc.Store(id="infected-in-total-figure-base"),
+        dcc.Store(id="infected-per-day-figure-base"),
         html.H2("Interactive map showing world status", className="mt-4 mb-4"),
         dbc.Row(dbc.Col(dcc.Graph(id="infected-map"), md=12, className="mb-4")),
         dbc.Row(
@@ -78,6 +128,10 @@ tab_infected = html.Div(
                 md=12,
             )
         ),
+        # The map data for all dates, when the map is updated in the browser. Its
+        # version is stored separately, so the data isn't sent back to the server.
+        dcc.Store(id="infected-map-data"),
+        dcc.Store(id="infected-map-version"),
     ]
 )
 
@@ -88,18 +142,17 @@ tab_infected = html.Div(
 )
 def infected_map_slider_div_children(*_) -> dcc.Slider:
     """Create the slider for date-selection of map data."""
+    infected_raw = covid19.dash_app.snapshot.infected_raw
     slider = dcc.Slider(
         id="infected-map-date",
         min=0,
-        max=len(covid19.dash_app.infected_raw) - 1,
+        max=len(infected_raw) - 1,
         step=1,
-        value=len(covid19.dash_app.infected_raw) - 1,
+        value=len(infected_raw) - 1,
         marks={
-            covid19.dash_app.infected_raw.index.get_loc(date): f"{date.week}"
+            infected_raw.index.get_loc(date): f"{date.week}"
             for date in pd.date_range(
-                start=covid19.dash_app.infected_raw.index[0],
-                end=covid19.dash_app.infected_raw.index[-1],
-                freq="W-MON",
+                start=infected_raw.index[0], end=infected_raw.index[-1], freq="W-MON"
             )
         },
     )
@@ -116,196 +169,202 @@ def infected_countries_selector_options(*_) -> List[dict]:
 
 
 @app.callback(
-    Output("infected-in-total-figure", "figure"),
-    [
-        Input("infected-countries-selector", "value"),
-        Input("infected-plot-options", "value"),
-    ],
+    Output("infected-in-total-figure-base", "data"),
+    [Input("infected-countries-selector", "value")],
 )
-def infected_in_total_figure(
-    countries_to_plot: List[str], plot_options: List[str]
-) -> go.Figure:
-    """Update the infected-per-pop figure when the input changes."""
-    # Handle plot options
-    if "log_scale" in plot_options:
-        y_axis_type = "log"
-    else:
-        y_axis_type = "linear"
-
-    if "per_pop_size" in plot_options:
-        fig_title = "Infected in total per 100k population"
-        y_axis_title = "Infected per 100k"
-    else:
-        fig_title = "Infected people in total"
-        y_axis_title = "Infected total"
-
-    infected = covid19.dash_app.infected
-    population = covid19.dash_app.population
-
-    fig = go.Figure(
-        layout={
-            "title": fig_title,
-            "xaxis": {
-                "title": (
-                    f"Days since more that {DAY_ZERO_START}"
-                    f" people confirmed infected"
-                )
-            },
-            "yaxis": {
-                "title": y_axis_title,
-                "type": y_axis_type,
-                "hoverformat": ",.0f",
-            },
-            "hovermode": "x",
-            "margin": {"l": 0, "r": 0},
-        }
-    )
-    for country in countries_to_plot:
-        if "per_pop_size" in plot_options:
-            data = (
-                infected[country].dropna()
-                / population.loc[country, "Population"]
-                * 100_000
-            )
-        else:
-            data = infected[country].dropna()
+@covid19.dash_app.memoize_figure
+def infected_in_total_figure_base_data(
+    snapshot: covid19.snapshot.Snapshot, countries_to_plot: List[str]
+) -> dict:
+    """Update the infected-in-total figure when the selected countries change."""
+    infected = snapshot.infected
 
-        fig.add_trace(
-            go.Scatter(x=data.index, y=data.values, name=country, mode="lines")
-        )
+    data = [
+        {
+            **covid19.dash_app.LINE_TRACE,
+            **covid19.dash_app.scatter_data(infected[country].dropna()),
+            "name": country,
+        }
+        for country in countries_to_plot
+    ]
+    fig = covid19.dash_app.plain_figure(data, IN_TOTAL_LAYOUT)
 
-    return fig
+    return covid19.dash_app.figure_base(
+        fig,
+        per_pop_size={
+            "title": {"text": "Infected in total per 100k population"},
+            "yaxis": {"title": {"text": "Infected per 100k"}},
+        },
+    )
 
 
 @app.callback(
-    Output("infected-per-day-figure", "figure"),
-    [
-        Input("infected-countries-selector", "value"),
-        Input("infected-plot-options", "value"),
-    ],
+    Output("infected-per-day-figure-base", "data"),
+    [Input("infected-countries-selector", "value")],
 )
-def infected_per_day_figure(
-    countries_to_plot: List[str], plot_options: List[str]
-) -> go.Figure:
+@covid19.dash_app.memoize_figure
+def infected_per_day_figure_base_data(
+    snapshot: covid19.snapshot.Snapshot, countries_to_plot: List[str]
+) -> dict:
     """Plot number of infected people per day."""
-    # Handle plot options
-    if "log_scale" in plot_options:
-        y_axis_type = "log"
-    else:
-        y_axis_type = "linear"
-
-    if "per_pop_size" in plot_options:
-        fig_title = "New infections per day per 100k population"
-        y_axis_title = "Infections per day per 100k population"
-    else:
-        fig_title = "New infections per day"
-        y_axis_title = "Infections per day"
-
-    # Get data
-    infected = covid19.dash_app.infected_raw
-    population = covid19.dash_app.population
-
-    fig = go.Figure(
-        layout={
-            "title": fig_title,
-            "xaxis": {"title": "Date"},
-            "yaxis": {
-                "title": y_axis_title,
-                "type": y_axis_type,
-                "hoverformat": ",.0f",
-            },
-            "hovermode": "x",
-            "margin": {"l": 0, "r": 0},
-            "legend": {"tracegroupgap": 0},
-        }
-    )
+    infected_per_day = snapshot.infected_per_day
 
+    data = []
     for country, color in zip(
         countries_to_plot, itertools.cycle(plotly.colors.qualitative.Plotly)
     ):
-        # Sometimes, the number of total infections is frozen for several days and then
-        # updated. We detect these regions by looking at the diff, and then linearly
-        # interpolate the missing values.
-        data = infected[country]
-        data.loc[data.diff() == 0] = np.nan
-        data = data.interpolate(method="linear").diff()
-
-        if "per_pop_size" in plot_options:
-            data = data / population.loc[country, "Population"] * 100_000
-
-        line = data.rolling(window=pd.Timedelta("7days")).mean()
-        # points = data  # .replace(0, pd.NA)
-
-        # fig.add_trace(
-        #     go.Scatter(
-        #         x=points.index,
-        #         y=points.values,
-        #         name=country,
-        #         legendgroup=country,
-        #         showlegend=False,
-        #         hoverinfo="none",
-        #         mode="markers",
-        #         marker=go.scatter.Marker(color=color, size=3),
-        #     )
-        # )
-        fig.add_trace(
-            go.Scatter(
-                x=line.index,
-                y=line.values,
-                name=country,
-                legendgroup=country,
-                hovertemplate="Average last week: %{y}",
-                line=go.scatter.Line(color=color),
-            )
+        line = infected_per_day[country]
+        data.append(
+            {
+                **PER_DAY_TRACE,
+                **covid19.dash_app.scatter_data(line),
+                "name": country,
+                "legendgroup": country,
+                "line": {"color": color},
+            }
         )
-    return fig
+    fig = covid19.dash_app.plain_figure(data, PER_DAY_LAYOUT)
+
+    return covid19.dash_app.figure_base(
+        fig,
+        per_pop_size={
+            "title": {"text": "New infections per day per 100k population"},
+            "yaxis": {"title": {"text": "Infections per day per 100k population"}},
+        },
+    )
+
 
+covid19.dash_app.clientside_figure("infected-in-total-figure", "infected-plot-options")
+covid19.dash_app.clientside_figure("infected-per-day-figure", "infected-plot-options")
 
-@app.callback(Output("infected-map", "figure"), [Input("infected-map-date", "value")])
-def infected_map_figure(idx: int) -> go.Figure:
+
+def infected_map_figure(snapshot: covid19.snapshot.Snapshot, idx: int) -> dict:
     """When the date-slider-value changes, update the map."""
-    infected_raw = covid19.dash_app.infected_raw
-    population = covid19.dash_app.population
-    inf_at_date = infected_raw.iloc[idx]
-    inf_at_date = inf_at_date[round(inf_at_date) > 0]
-
-    inf_at_date.name = "Infected"
-    df = pd.concat([population, inf_at_date], axis=1, join="inner")
-    df["Inf/Pop"] = df["Infected"] / df["Population"] * 100_000
-
-    df["text"] = (
-        "<b>"
-        + df["Country"]
-        + "</b><br><br>Total infected: "
-        + df["Infected"].apply(lambda x: f"{x:,.0f}")
-        + "<br>Population: "
-        + df["Population"].apply(lambda x: f"{x:,.0f}")
-        + "<br>Inf. per pop.: "
-        + df["Inf/Pop"].apply(lambda x: f"{x:,.1f}")
-    )
+    inf_per_pop = snapshot.infected_map.iloc[idx].dropna()
+    countries = snapshot.population.loc[inf_per_pop.index]
+    infected = snapshot.infected_raw.iloc[idx][inf_per_pop.index]
 
-    fig = go.Figure(
-        data=go.Choropleth(
-            locations=df["ISO3"],
-            z=df["Inf/Pop"].round(decimals=0),
-            zmax=2000,
-            zmin=0,
-            text=df["text"],
-            hovertemplate="%{text}<extra></extra>",
-            colorscale="Reds",
-            marker_line_color="darkgray",
-            marker_line_width=0.5,
-        ),
-        layout={
-            "title": "COVID-19 Confirmed infected per 100.000 population",
-            "margin": {"l": 0, "r": 0, "b": 10},
-            "geo": {
-                "showframe": False,
-                "showcoastlines": False,
-                "projection": {"scale": 1.2},
-                "center": {"lon": 10, "lat": 20},
-            },
-        },
+    return covid19.dash_app.plain_figure(
+        [
+            {
+                **MAP_TRACE,
+                "locations": countries["ISO3"].tolist(),
+                "z": covid19.dash_app.json_array(inf_per_pop.round(decimals=0)),
+                "text": countries["Country"].tolist(),
+                "customdata": covid19.dash_app.json_array(
+                    np.column_stack(
+                        [
+                            infected,
+                            countries["Population"],
+                            covid19.dash_app.limit_precision(inf_per_pop),
+                        ]
+                    )
+                ),
+            }
+        ],
+        {**MAP_LAYOUT, "template": covid19.dash_app.FIGURE_TEMPLATE},
     )
 
-    return fig
+
+@covid19.dash_app.snapshot_cache(maxsize=1)
+def infected_map_payload(snapshot: covid19.snapshot.Snapshot) -> Dict[str, Any]:
+    """Encode the map data for all dates, once per snapshot version.
+
+    The number of infected is delta-encoded along the dates, with one row per
+    country, and sent as base64 of little-endian int32. A single string is cheap to
+    serialize, and the deltas of a country are small and compress well.
+
+    Args:
+        snapshot (Snapshot): The data. Snapshots are cached by their version.
+
+    Returns:
+        dict: The data to store in the browser.
+    """
+    countries = snapshot.population.loc[snapshot.infected_map.columns]
+    infected = snapshot.infected_raw[countries.index].fillna(0).round()
+    infected = infected.to_numpy(dtype=np.int64).T
+    deltas = np.diff(infected, axis=1, prepend=0).astype("<i4")
+    return {
+        "version": snapshot.version,
+        "locations": countries["ISO3"].tolist(),
+        "countries": countries["Country"].tolist(),
+        "population": countries["Population"].tolist(),
+        "dates": infected.shape[1],
+        "deltas": base64.b64encode(deltas.tobytes()).decode(),
+        "trace": MAP_TRACE,
+        "layout": MAP_LAYOUT,
+    }
+
+
+def infected_map_data_data(_, version: Optional[str]) -> Any:
+    """Send the map data for all dates to the browser, once per data version.
+
+    The browser decodes the numbers, and computes the per-capita values.
+    """
+    snapshot = covid19.dash_app.snapshot
+    if version == snapshot.version:
+        raise PreventUpdate
+    return infected_map_payload(snapshot), snapshot.version
+
+
+MAP_FIGURE_JS = """
+function(idx, data, template) {
+    if (idx === undefined || !data) {
+        return window.dash_clientside.no_update;
+    }
+
+    // Decode the numbers and undo the delta-encoding once per data version. There
+    // is one row per country, with one column per date.
+    var cache = window.covid19InfectedMap;
+    if (!cache || cache.version !== data.version) {
+        var bytes = atob(data.deltas);
+        var buffer = new Uint8Array(bytes.length);
+        for (var i = 0; i < bytes.length; i++) {
+            buffer[i] = bytes.charCodeAt(i);
+        }
+        // Typed arrays use the byte order of the platform, little-endian everywhere
+        var infected = new Int32Array(buffer.buffer);
+        for (var k = 0; k < infected.length; k++) {
+            if (k % data.dates !== 0) {
+                infected[k] += infected[k - 1];
+            }
+        }
+        cache = window.covid19InfectedMap = {version: data.version, infected: infected};
+    }
+
+    var trace = Object.assign(
+        {locations: [], z: [], text: [], customdata: []}, data.trace
+    );
+    data.population.forEach(function(population, j) {
+        var infected = cache.infected[j * data.dates + idx];
+        if (infected > 0) {
+            var infPerPop = infected / population * 100000;
+            trace.locations.push(data.locations[j]);
+            trace.z.push(Math.round(infPerPop));
+            trace.text.push(data.countries[j]);
+            trace.customdata.push([infected, population, infPerPop]);
+        }
+    });
+    return {data: [trace], layout: Object.assign({template: template}, data.layout)};
+}
+"""
+
+if CLIENTSIDE_MAP:
+    app.callback(
+        [Output("infected-map-data", "data"), Output("infected-map-version", "data")],
+        [Input("interval-component", "n_intervals")],
+        [State("infected-map-version", "data")],
+    )(infected_map_data_data)
+    app.clientside_callback(
+        MAP_FIGURE_JS,
+        Output("infected-map", "figure"),
+        [
+            Input("infected-map-date", "value"),
+            Input("infected-map-data", "data"),
+            Input("figure-template", "data"),
+        ],
+    )
+else:
+    app.callback(
+        Output("infected-map", "figure"), [Input("infected-map-date", "value")]
+    )(covid19.dash_app.memoize_figure(infected_map_figure))
@@ -8,7 +8,9 @@ from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
 
 import covid19.dash_deaths
+import covid19.dash_forecast
 import covid19.dash_infected
+import covid19.dash_us
 
 from .dash_app import app
 from .dash_footer import footer
@@ -29,6 +31,10 @@ app.layout = dbc.Container(
                     id="multiple-countries-selector-store",
                     data=covid19.dash_app.DROPDOWN_SELECTED_COUNTRIES,
                 ),
+                # The population of all countries, used to apply the plot options
+                dcc.Store(id="population-store"),
+                # The plotly template, which is added to the figures in the browser
+                dcc.Store(id="figure-template", data=covid19.dash_app.FIGURE_TEMPLATE),
                 html.H1("COVID-19: Current status", className="mt-4 mb-4",),
                 html.Div(id="live-update-text"),
                 dcc.Tabs(
@@ -50,13 +56,20 @@ app.layout = dbc.Container(
                             selected_className="bg-primary",
                             children=[covid19.dash_deaths.tab_deaths],
                         ),
-                        # dcc.Tab(
-                        #     label="Forecast",
-                        #     value="tab-forecast",
-                        #     className="h3",
-                        #     selected_className="bg-primary",
-                        #     children=[covid19.dash_forecast.tab_forecast],
-                        # ),
+                        dcc.Tab(
+                            label="Forecast",
+                            value="tab-forecast",
+                            className="h3",
+                            selected_className="bg-primary",
+                            children=[covid19.dash_forecast.tab_forecast],
+                        ),
+                        dcc.Tab(
+                            label="US",
+                            value="tab-us",
+                            className="h3",
+                            selected_className="bg-primary",
+                            children=[covid19.dash_us.tab_us],
+                        ),
                     ],
                 ),
                 footer,
@@ -0,0 +1,291 @@
+"""The dash-tab with US states and counties."""
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import dash_bootstrap_components as dbc
+import dash_core_components as dcc
+import dash_html_components as html
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from dash.dependencies import Input, Output
+from dash.exceptions import PreventUpdate
+
+import covid19.dash_app
+import covid19.data
+import covid19.snapshot
+
+from .dash_app import app
+
+# The number of counties selected when a state is selected
+DEFAULT_COUNTIES = 3
+
+# The parts of the figures that don't depend on the data, validated once
+IN_TOTAL_LAYOUT = go.Layout(
+    title="Infected in total",
+    yaxis={"title": "Infected", "hoverformat": ".0f"},
+    hovermode="x",
+    margin={"l": 0, "r": 0},
+).to_plotly_json()
+PER_DAY_LAYOUT = go.Layout(
+    title="Infected per day",
+    yaxis={"title": "Infected per day (7-day average)", "hoverformat": ".0f"},
+    hovermode="x",
+    margin={"l": 0, "r": 0},
+).to_plotly_json()
+PER_POP_YAXIS = {"title": {"text": "Infected per 100.000"}, "hoverformat": ".1f"}
+
+# How many states and counties to keep the daily numbers of
+SERIES_CACHE_SIZE = 256
+
+
+def largest_state() -> Optional[str]:
+    """Return the state with the most infected, if there is any US data."""
+    states_infected = covid19.dash_app.snapshot.us_states_infected
+    if states_infected.empty:
+        return None
+    return states_infected.iloc[:, -1].idxmax()
+
+
+tab_us = html.Div(
+    [
+        dbc.Row(
+            [
+                dbc.Col(
+                    dbc.FormGroup(
+                        [
+                            dbc.Label("Select a state"),
+                            dcc.Dropdown(
+                                id="us-state-selector",
+                                value=largest_state(),
+                                clearable=False,
+                            ),
+                        ]
+                    ),
+                    md=4,
+                ),
+                dbc.Col(
+                    dbc.FormGroup(
+                        [
+                            dbc.Label("Select one or more counties"),
+                            dcc.Dropdown(id="us-counties-selector", multi=True),
+                        ]
+                    ),
+                    md=4,
+                ),
+                dbc.Col(
+                    dbc.FormGroup(
+                        [
+                            dbc.Label("Plot options"),
+                            dbc.Checklist(
+                                options=[
+                                    {
+                                        "label": "Logarithmic scale",
+                                        "value": "log_scale",
+                                    },
+                                    {
+                                        "label": "Per population size",
+                                        "value": "per_pop_size",
+                                    },
+                                ],
+                                value=[],
+                                id="us-plot-options",
+                                switch=True,
+                            ),
+                        ]
+                    ),
+                    md=4,
+                ),
+            ]
+        ),
+        dbc.Row([dbc.Col(dcc.Graph(id="us-in-total-figure"), md=12)]),
+        dbc.Row([dbc.Col(dcc.Graph(id="us-per-day-figure"), md=12)]),
+        dcc.Store(id="us-in-total-figure-base"),
+        dcc.Store(id="us-per-day-figure-base"),
+    ]
+)
+
+
+@covid19.dash_app.snapshot_cache(maxsize=1)
+def us_index(snapshot: covid19.snapshot.Snapshot) -> covid19.data.USIndex:
+    """Index the US counties, once per snapshot version.
+
+    Args:
+        snapshot (Snapshot): The data.
+
+    Returns:
+        covid19.data.USIndex: The rows of the counties, by FIPS and by state.
+    """
+    return covid19.data.USIndex(snapshot.us_counties)
+
+
+@app.callback(
+    Output("us-state-selector", "options"),
+    [Input("interval-component", "n_intervals")],
+)
+def us_state_selector_options(*_) -> List[dict]:
+    """Scheduled update of the possible states."""
+    states = covid19.dash_app.snapshot.us_states.index
+    return [{"label": state, "value": state} for state in states]
+
+
+@app.callback(
+    [
+        Output("us-counties-selector", "options"),
+        Output("us-counties-selector", "value"),
+    ],
+    [Input("us-state-selector", "value")],
+)
+def us_counties_selector_options_value(state: Optional[str]) -> Any:
+    """List the counties of the selected state, and select the largest ones."""
+    if state is None:
+        raise PreventUpdate
+    snapshot = covid19.dash_app.snapshot
+    rows = us_index(snapshot).state(state)
+    counties = snapshot.us_counties.iloc[rows]
+
+    # Counties without a FIPS code (e.g. cruise ships) are only in the state total
+    has_fips = counties["FIPS"].notna().to_numpy()
+    counties = counties[has_fips]
+    latest = snapshot.us_infected.iloc[rows[has_fips], -1].to_numpy()
+    options = [
+        {"label": county, "value": int(fips)}
+        for county, fips in zip(counties["County"], counties["FIPS"])
+    ]
+    largest = np.argsort(-latest, kind="stable")[:DEFAULT_COUNTIES]
+    return options, [options[i]["value"] for i in largest]
+
+
+class USSeries(NamedTuple):
+    """The infected in a state or a county."""
+
+    name: str
+    population: Optional[float]
+    in_total: pd.Series
+    per_day: pd.Series
+
+
+@covid19.dash_app.snapshot_cache(maxsize=SERIES_CACHE_SIZE)
+def us_series(
+    snapshot: covid19.snapshot.Snapshot, state: str, fips: Optional[int]
+) -> Optional[USSeries]:
+    """Return the infected in a state or one of its counties, in total and per day.
+
+    The numbers per day are only computed once per snapshot version, for the
+    states and counties that are plotted.
+
+    Args:
+        snapshot (Snapshot): The data.
+        state (str): The state.
+        fips (int, optional): The FIPS code of the county, or None for the state.
+
+    Returns:
+        USSeries: The infected, or None if there is no such state or county.
+    """
+    if fips is None:
+        if state not in snapshot.us_states.index:
+            return None
+        name = f"{state} (all)"
+        population = snapshot.us_states.at[state, "Population"]
+        in_total = snapshot.us_states_infected.loc[state]
+    else:
+        try:
+            row = us_index(snapshot).county(fips)
+        except KeyError:
+            return None
+        name = snapshot.us_counties["County"].iat[row]
+        population = snapshot.us_counties["Population"].iat[row]
+        in_total = snapshot.us_infected.iloc[row]
+    in_total = in_total.astype(float).rename(name)
+    per_day = covid19.data.new_cases_per_day(in_total.to_frame())[name]
+    return USSeries(
+        name, float(population) if population > 0 else None, in_total, per_day
+    )
+
+
+def us_selected(
+    snapshot: covid19.snapshot.Snapshot, state: Optional[str], counties: List[int]
+) -> List[USSeries]:
+    """Return the infected in a state and the selected counties.
+
+    Unknown counties are left out, since the selection may be from an older
+    snapshot than the one used for the figures.
+
+    Args:
+        snapshot (Snapshot): The data.
+        state (str): The state.
+        counties (list): The FIPS codes of the counties.
+
+    Returns:
+        list: The infected in the state and the counties that were found.
+    """
+    if state is None:
+        raise PreventUpdate
+    selected = [us_series(snapshot, state, fips) for fips in [None, *counties]]
+    return [series for series in selected if series is not None]
+
+
+def us_figure_base(
+    selected: List[USSeries], per_day: bool, layout: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Put together one of the figures of the US tab, see figure_base.
+
+    The plot options are applied in the browser, using the population of each
+    state and county.
+    """
+    data = [
+        {
+            **covid19.dash_app.LINE_TRACE,
+            **covid19.dash_app.scatter_data(
+                (series.per_day if per_day else series.in_total).dropna()
+            ),
+            "name": series.name,
+        }
+        for series in selected
+    ]
+    return covid19.dash_app.figure_base(
+        covid19.dash_app.plain_figure(data, layout),
+        per_pop_size={"title": layout["title"], "yaxis": PER_POP_YAXIS},
+        population={series.name: series.population for series in selected},
+    )
+
+
+@app.callback(
+    Output("us-in-total-figure-base", "data"),
+    [
+        Input("us-state-selector", "value"),
+        Input("us-counties-selector", "value"),
+    ],
+)
+@covid19.dash_app.memoize_figure
+def us_in_total_figure_base_data(
+    snapshot: covid19.snapshot.Snapshot,
+    state: Optional[str],
+    counties: Optional[List[int]],
+) -> Dict[str, Any]:
+    """Create the figure with the infected in total."""
+    return us_figure_base(
+        us_selected(snapshot, state, counties or []), False, IN_TOTAL_LAYOUT
+    )
+
+
+@app.callback(
+    Output("us-per-day-figure-base", "data"),
+    [
+        Input("us-state-selector", "value"),
+        Input("us-counties-selector", "value"),
+    ],
+)
+@covid19.dash_app.memoize_figure
+def us_per_day_figure_base_data(
+    snapshot: covid19.snapshot.Snapshot,
+    state: Optional[str],
+    counties: Optional[List[int]],
+) -> Dict[str, Any]:
+    """Create the figure with the infected per day."""
+    return us_figure_base(
+        us_selected(snapshot, state, counties or []), True, PER_DAY_LAYOUT
+    )
+
+
+covid19.dash_app.clientside_figure("us-in-total-figure", "us-plot-options")
+covid19.dash_app.clientside_figure("us-per-day-figure", "us-plot-options")
@@ -1,112 +1,504 @@
 """Get data and preprocess."""
+import csv
 import datetime
+import functools
 import io
+import os
 from importlib import resources
-from typing import Tuple
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
 
+import numpy as np
 import pandas as pd
-import requests
-import requests_cache
 
-# Use caching of requests
-requests_cache.install_cache(
-    expire_after=datetime.timedelta(seconds=60), backend="memory"
-)
+import covid19.freshness
 
-INFECTED_SOURCE_GLOBAL = (
-    r"https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/"
-    r"csse_covid_19_data/csse_covid_19_time_series/"
-    r"time_series_covid19_confirmed_global.csv"
-)
+from .fetch import fetch
+from .snapshot import Snapshot
 
-INFECTED_SOURCE_US = (
+# The CSSE time series. Override the location to e.g. use a local mirror.
+CSSE_TIME_SERIES_URL = os.environ.get(
+    "COVID19_CSSE_TIME_SERIES_URL",
     r"https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/"
-    r"csse_covid_19_data/csse_covid_19_time_series/"
-    r"time_series_covid19_confirmed_US.csv"
+    r"csse_covid_19_data/csse_covid_19_time_series",
 )
 
-DEATHS_SOURCE_US = (
-    r"https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/"
-    r"csse_covid_19_data/csse_covid_19_time_series/"
-    r"time_series_covid19_deaths_US.csv"
-)
-
-DEATHS_SOURCE_GLOBAL = (
-    r"https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master"
-    r"/csse_covid_19_data/csse_covid_19_time_series"
-    r"/time_series_covid19_deaths_global.csv"
+INFECTED_SOURCE_GLOBAL = (
+    f"{CSSE_TIME_SERIES_URL}/time_series_covid19_confirmed_global.csv"
 )
+INFECTED_SOURCE_US = f"{CSSE_TIME_SERIES_URL}/time_series_covid19_confirmed_US.csv"
+DEATHS_SOURCE_US = f"{CSSE_TIME_SERIES_URL}/time_series_covid19_deaths_US.csv"
+DEATHS_SOURCE_GLOBAL = f"{CSSE_TIME_SERIES_URL}/time_series_covid19_deaths_global.csv"
+
+# The columns in the CSSE data that come before the dates
+CSSE_KEY_COLUMNS = ["Province/State", "Country/Region", "Lat", "Long"]
+
+# Compact dtypes for the CSSE data. The counts fit comfortably in 32 bits, but
+# columns with missing counts can't be parsed as integers, and fall back to floats.
+CSSE_KEY_DTYPES: Dict[str, Any] = {
+    "Province/State": "category",
+    "Country/Region": "category",
+    "Lat": np.float32,
+    "Long": np.float32,
+}
+COUNT_DTYPE = np.int32
+COUNT_FALLBACK_DTYPE = np.float64
+
+# The columns in the CSSE data of US counties that come before the dates. The
+# deaths-file has the Population of each county as well. Only the columns in
+# US_KEY_DTYPES are parsed.
+US_KEY_COLUMNS = [
+    "UID",
+    "iso2",
+    "iso3",
+    "code3",
+    "FIPS",
+    "Admin2",
+    "Province_State",
+    "Country_Region",
+    "Lat",
+    "Long_",
+    "Combined_Key",
+    "Population",
+]
+US_KEY_DTYPES: Dict[str, Any] = {
+    "UID": np.int64,
+    "FIPS": np.float64,
+    "Admin2": "category",
+    "Province_State": "category",
+    "Population": np.int64,
+}
+
+# When updating the data incrementally, this many of the latest dates may have been
+# revised. Revisions of older dates trigger a full rebuild.
+MAX_REVISED_DATES = 7
+
+# How rows in the CSSE data are mapped to the countries we show. The first rule that
+# matches the Country/Region and Province/State (None matches any province) of a row
+# gives the countries that the row is added to. Rows without a matching rule are
+# added to their Country/Region.
+REGION_RULES: List[Tuple[str, Optional[str], Tuple[str, ...]]] = [
+    # Rename some countries to match with the population data
+    ("Bahamas, The", None, ("Bahamas",)),
+    ("Congo (Brazzaville)", None, ("Congo",)),
+    ("Congo (Kinshasa)", None, ("Congo",)),
+    ("Cote d'Ivoire", None, ("Côte d'Ivoire",)),
+    ("Gambia, The", None, ("Gambia",)),
+    ("Korea, South", None, ("South Korea",)),
+    ("North Macedonia", None, ("Macedonia",)),
+    ("Taiwan*", None, ("Taiwan",)),
+    ("US", None, ("United States of America",)),
+    # Treat Greenland as a separate country
+    ("Denmark", "Greenland", ("Greenland",)),
+    # ("Denmark", "Faroe Islands", ("Faroe Islands",)),
+    # ("France", "French Guiana", ("French Guiana",)),
+    # Show Hubei and the rest of China as separate countries, in addition to China
+    ("China", "Hubei", ("China", "China - Hubei")),
+    ("China", None, ("China", "China - Others")),
+]
 
 DATA_UPDATE_TIME = datetime.time(1, 0, tzinfo=datetime.timezone.utc)
 DAY_ZERO_START = 20
 
 
+def read_covid_csv(
+    path: Path, previous: Optional[Tuple[Path, pd.DataFrame]] = None
+) -> pd.DataFrame:
+    """Read and preprocess one of the CSSE time series files.
+
+    The files grow by one date column per day. If we have preprocessed an older
+    version of the same file, we only parse and preprocess the new (or recently
+    revised) date columns, and append them to the previous result. If older dates
+    have been revised, or regions have been added, we preprocess the whole file.
+
+    Args:
+        path (Path): The file to read.
+        previous (tuple, optional): An older version of the file, and the result of
+                                    preprocessing it.
+
+    Returns:
+        pd.DataFrame: One row per date and one column per country.
+    """
+    if previous is not None:
+        data = _update_covid_dataframe(path, *previous)
+        if data is not None:
+            return data
+    with open(path, newline="") as file:
+        header = next(csv.reader(file))
+    n_keys = len(CSSE_KEY_COLUMNS)
+    data = _read_csse_csv(path, header[n_keys:])
+    return preprocess_covid_dataframe(data)
+
+
+def _read_csse_csv(
+    file: Union[Path, bytes],
+    dates: Sequence[str],
+    key_dtypes: Dict[str, Any] = CSSE_KEY_DTYPES,
+    **kwargs: Any,
+) -> pd.DataFrame:
+    """Parse CSSE data with compact dtypes.
+
+    Args:
+        file (Path or bytes): The file, or its contents.
+        dates (Sequence): The date columns in the file.
+        key_dtypes (dict, optional): The dtypes of the columns before the dates.
+        **kwargs: Passed on to pd.read_csv.
+
+    Returns:
+        pd.DataFrame: The parsed data, with the counts as COUNT_DTYPE if possible.
+    """
+
+    def read(count_dtype: Any) -> pd.DataFrame:
+        source = io.BytesIO(file) if isinstance(file, bytes) else file
+        dtype = {**key_dtypes, **dict.fromkeys(dates, count_dtype)}
+        return pd.read_csv(source, dtype=dtype, **kwargs)
+
+    try:
+        return read(COUNT_DTYPE)
+    except ValueError:
+        # Integer columns can't have missing values
+        return read(COUNT_FALLBACK_DTYPE)
+
+
 def download_infected() -> pd.DataFrame:
     """Download and preprocess infection data."""
-    response = requests.get(INFECTED_SOURCE_GLOBAL)
-    buffer = io.StringIO(response.content.decode("UTF-8"))
-    data = pd.read_csv(buffer)
-    return preprocess_covid_dataframe(data)
+    return read_covid_csv(fetch(INFECTED_SOURCE_GLOBAL).path)
 
 
 def download_deaths() -> pd.DataFrame:
     """Download and preprocess deaths data."""
-    response = requests.get(DEATHS_SOURCE_GLOBAL)
-    buffer = io.StringIO(response.content.decode("UTF-8"))
-    data = pd.read_csv(buffer)
-    return preprocess_covid_dataframe(data)
+    return read_covid_csv(fetch(DEATHS_SOURCE_GLOBAL).path)
 
 
 def preprocess_covid_dataframe(data: pd.DataFrame) -> pd.DataFrame:
-    """Preprocess the downloaded dataframe."""
-    # Rename some countries before we groupby and sum
-    data["Country/Region"] = data["Country/Region"].replace(
-        {"Congo (Brazzaville)": "Congo", "Congo (Kinshasa)": "Congo"}
+    """Preprocess the downloaded dataframe.
+
+    Each row (Province/State, Country/Region) is mapped to one or more countries by
+    REGION_RULES, and all rows are then summed per country in one aggregation.
+
+    Returns:
+        pd.DataFrame: One row per date and one column per country.
+    """
+    keys = data[["Province/State", "Country/Region"]].itertuples(index=False)
+    dates = data.columns.drop(CSSE_KEY_COLUMNS)
+    return _aggregate_regions(keys, data[dates].to_numpy(), dates)
+
+
+def _region_targets(province: str, country: str) -> Tuple[str, ...]:
+    """Return the countries that a row in the CSSE data should be added to."""
+    for rule_country, rule_province, targets in REGION_RULES:
+        if rule_country == country and rule_province in (None, province):
+            return targets
+    return (country,)
+
+
+def _aggregate_regions(
+    keys: Iterable[Tuple[str, str]], values: np.ndarray, dates: Sequence[str]
+) -> pd.DataFrame:
+    """Sum the rows of the CSSE data per country.
+
+    Args:
+        keys (Iterable): Province/State and Country/Region of each row.
+        values (np.ndarray): The numbers, one row per region and one column per date.
+        dates (Sequence): The dates of the columns.
+
+    Returns:
+        pd.DataFrame: One row per date and one column per country.
+    """
+    # Map each row to its countries. A row that belongs to several countries (e.g.
+    # Hubei) appears several times in rows/targets.
+    rows = []
+    targets = []
+    for row, (province, country) in enumerate(keys):
+        for target in _region_targets(province, country):
+            rows.append(row)
+            targets.append(target)
+    countries, target_idx = np.unique(targets, return_inverse=True)
+
+    # Sum the rows of each country
+    order = np.argsort(target_idx, kind="stable")
+    starts = np.searchsorted(target_idx[order], np.arange(len(countries)))
+    # Sum in the parsed dtype, casting would copy all the values
+    summed = np.add.reduceat(
+        values[np.asarray(rows)[order]], starts, axis=0, dtype=values.dtype
     )
 
-    # Treat Greenland as a separate country
-    data.loc[data["Province/State"] == "Greenland", "Country/Region"] = "Greenland"
-    # data.loc[
-    #     data["Province/State"] == "Faroe Islands", "Country/Region"] = "Faroe Islands"
-    # data.loc[
-    #     data["Province/State"] == "French Guiana", "Country/Region"] = "French Guiana"
+    return pd.DataFrame(
+        summed.T,
+        index=pd.DatetimeIndex(pd.to_datetime(dates, format="%m/%d/%y"), name="Date"),
+        columns=pd.Index(countries, name="Country/Region"),
+    )
 
-    # Append Hubei in China as a separate country
-    hubei = data[data["Province/State"] == "Hubei"].copy()
-    hubei.at[:, "Country/Region"] = "China - Hubei"
-    data = data.append(hubei)
 
-    # Sum over all Province/State within the same Country/Region
-    data = data.groupby("Country/Region").sum()
+def _update_covid_dataframe(
+    path: Path, previous_path: Path, previous_data: pd.DataFrame
+) -> Optional[pd.DataFrame]:
+    """Incrementally update previously preprocessed data.
+
+    Returns:
+        pd.DataFrame: The updated data, or None if the file has changed in a way
+                      that requires a full rebuild.
+    """
+    previous_lines = previous_path.read_bytes().splitlines()
+    lines = path.read_bytes().splitlines()
+    first_changed = _first_changed_date(previous_lines, lines)
+    if first_changed is None:
+        return None
+
+    header = next(csv.reader([lines[0].decode()]))
+    first_changed_column = len(CSSE_KEY_COLUMNS) + first_changed
+    changed_dates = header[first_changed_column:]
+    if not changed_dates:
+        return previous_data
+
+    # The dates are the last fields of each line, and never contain quotes. So we
+    # can cut them out without parsing the whole line.
+    tails = []
+    for line in lines[1:]:
+        comma = len(line)
+        for _ in changed_dates:
+            comma = line.rindex(b",", 0, comma)
+        start = comma + 1
+        tails.append(line[start:])
+    # A single changed date may be missing, which gives a blank line to keep. Each
+    # line is terminated, so that this works for the last line as well.
+    values = _read_csse_csv(
+        b"".join(tail + b"\n" for tail in tails),
+        changed_dates,
+        header=None,
+        names=changed_dates,
+        skip_blank_lines=False,
+    ).to_numpy()
+    if len(values) != len(tails):
+        return None
+
+    keys = (_split_keys(line) for line in lines[1:])
+    return pd.concat(
+        [
+            previous_data.iloc[:first_changed],
+            _aggregate_regions(keys, values, changed_dates),
+        ]
+    )
 
-    # Add the rest of China (minus Hubei) as a separate country
-    china_others = data.loc["China"] - data.loc["China - Hubei"]
-    china_others.name = "China - Others"
-    data = data.append(china_others)
 
-    # Rename some countries to match with the population data
-    data = data.rename(
+def _split_keys(line: bytes) -> Tuple[str, str]:
+    """Return Province/State and Country/Region of a line in a CSSE file."""
+    if b'"' in line:
+        province, country, *_ = next(csv.reader([line.decode()]))
+    else:
+        province, country, _ = line.decode().split(",", 2)
+    # Missing provinces are parsed as NaN by pd.read_csv
+    return province or np.nan, country
+
+
+def _first_changed_date(
+    previous_lines: List[bytes], lines: List[bytes]
+) -> Optional[int]:
+    """Find the first date column that differs between two versions of a file.
+
+    Returns:
+        int: Position of the first changed date in the previous file (equal to the
+             number of dates if only new dates were added), or None if the regions
+             or too old dates have changed.
+    """
+    if len(previous_lines) != len(lines):
+        # Regions have been added or removed
+        return None
+
+    n_dates = len(next(csv.reader([previous_lines[0].decode()])))
+    n_dates -= len(CSSE_KEY_COLUMNS)
+    first_changed = n_dates
+    for previous_line, line in zip(previous_lines, lines):
+        if line == previous_line or line.startswith(previous_line + b","):
+            # Only new dates have been appended to this line
+            continue
+        common = os.path.commonprefix([previous_line, line])
+        complete_fields = len(next(csv.reader([common.decode(errors="replace")]), []))
+        complete_fields -= 1
+        first_changed = min(first_changed, complete_fields - len(CSSE_KEY_COLUMNS))
+
+    if first_changed < max(0, n_dates - MAX_REVISED_DATES):
+        # The regions or older dates have been revised
+        return None
+    return first_changed
+
+
+def read_us_csv(path: Path) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Read one of the CSSE time series files of US counties.
+
+    The files have a row per county, and many columns we don't use. Only the
+    columns in US_KEY_DTYPES and the dates are parsed.
+
+    Args:
+        path (Path): The file to read.
+
+    Returns:
+        2 DataFrames: The FIPS, County, State (and Population, if the file has it)
+                      of the counties, and the numbers with one row per county and
+                      one column per date. Both are indexed by UID.
+    """
+    with open(path, newline="") as file:
+        header = next(csv.reader(file))
+    dates = [column for column in header if column not in US_KEY_COLUMNS]
+    keys = [column for column in US_KEY_DTYPES if column in header]
+    data = _read_csse_csv(
+        path,
+        dates,
+        key_dtypes={key: US_KEY_DTYPES[key] for key in keys},
+        usecols=keys + dates,
+    )
+
+    index = pd.Index(data["UID"], name="UID")
+    state = data["Province_State"].astype(str).to_numpy()
+    counties = pd.DataFrame(
         {
-            "Bahamas, The": "Bahamas",
-            "Cote d'Ivoire": "Côte d'Ivoire",
-            "Gambia, The": "Gambia",
-            "US": "United States of America",
-            "Korea, South": "South Korea",
-            "Taiwan*": "Taiwan",
-            "North Macedonia": "Macedonia",
-        }
+            "FIPS": data["FIPS"].to_numpy(),
+            # E.g. cruise ships have no county
+            "County": np.where(
+                data["Admin2"].isna(), state, data["Admin2"].astype(str)
+            ),
+            "State": state,
+        },
+        index=index,
+    )
+    if "Population" in data:
+        counties["Population"] = data["Population"].to_numpy()
+    counts = pd.DataFrame(
+        data[dates].to_numpy(),
+        index=index,
+        columns=pd.DatetimeIndex(pd.to_datetime(dates, format="%m/%d/%y"), name="Date"),
+    )
+    return counties, counts
+
+
+def read_us_population(path: Path) -> pd.Series:
+    """Read the population of the US counties.
+
+    The population is only in the file with deaths. Only the UID and Population
+    columns are parsed, not the dates.
+
+    Args:
+        path (Path): The CSSE time series of deaths in US counties.
+
+    Returns:
+        pd.Series: The population of each county, indexed by UID.
+    """
+    keys = ["UID", "Population"]
+    data = pd.read_csv(
+        path, usecols=keys, dtype={key: US_KEY_DTYPES[key] for key in keys}
     )
+    return pd.Series(
+        data["Population"].to_numpy(),
+        index=pd.Index(data["UID"], name="UID"),
+        name="Population",
+    )
+
 
-    data = data.sort_index()
-    data = data.drop(["Lat", "Long"], axis=1).T
-    data.index = pd.to_datetime(data.index)
-    data.index.name = "Date"
+def us_state_rollup(counts: pd.DataFrame, counties: pd.DataFrame) -> pd.DataFrame:
+    """Sum the numbers of the counties in each state.
 
-    return data
+    Args:
+        counts (pd.DataFrame): One row per county and one column per date.
+        counties (pd.DataFrame): The counties, in the same order.
+
+    Returns:
+        pd.DataFrame: One row per state and one column per date.
+    """
+    states = pd.Index(counties["State"].to_numpy(), name="State")
+    return counts.groupby(states).sum().astype(counts.dtypes.iloc[0], copy=False)
+
+
+class USIndex:
+    """Find the rows of US counties and states, without scanning the data.
+
+    The rows are the same in the county-frames of a snapshot (us_counties and
+    us_infected), so one lookup serves both of them.
+    """
+
+    def __init__(self, counties: pd.DataFrame):
+        """Index the counties.
+
+        Args:
+            counties (pd.DataFrame): The us_counties of a snapshot.
+        """
+        self._fips = pd.Index(counties["FIPS"].to_numpy())
+        self._states = counties.groupby("State").indices
+
+    def county(self, fips: float) -> int:
+        """Return the row of a county, by its FIPS code."""
+        return self._fips.get_loc(fips)
+
+    def state(self, state: str) -> np.ndarray:
+        """Return the rows of all counties in a state."""
+        return self._states.get(state, np.array([], dtype=int))
+
+
+def ingest_us(infected_csv: Path, deaths_csv: Path) -> Dict[str, pd.DataFrame]:
+    """Preprocess the US source files, and precompute the sums per state.
+
+    Only the confirmed cases are plotted. The file with deaths is only read for the
+    population of the counties.
+
+    Args:
+        infected_csv (Path): The CSSE time series of confirmed cases in US counties.
+        deaths_csv (Path): The CSSE time series of deaths in US counties.
+
+    Returns:
+        dict: The US frames of a Snapshot, by name.
+    """
+    counties, infected = read_us_csv(infected_csv)
+
+    # The files are usually in sync. Counties missing from the file with deaths get
+    # no population.
+    population = read_us_population(deaths_csv)
+    counties["Population"] = population.reindex(counties.index, fill_value=0)
+
+    states = counties.groupby("State")[["Population"]].sum()
+    return {
+        "us_counties": counties,
+        "us_infected": infected,
+        "us_states": states,
+        "us_states_infected": us_state_rollup(infected, counties),
+    }
+
+
+def empty_us() -> Dict[str, pd.DataFrame]:
+    """Return the US frames of a Snapshot, without any counties."""
+    counties = pd.DataFrame(
+        {
+            "FIPS": pd.Series([], dtype=float),
+            "County": pd.Series([], dtype=object),
+            "State": pd.Series([], dtype=object),
+            "Population": pd.Series([], dtype=float),
+        },
+        index=pd.Index([], dtype=np.int64, name="UID"),
+    )
+    counts = pd.DataFrame(
+        np.zeros((0, 0), dtype=COUNT_DTYPE),
+        index=counties.index,
+        columns=pd.DatetimeIndex([], name="Date"),
+    )
+    states = pd.DataFrame(
+        {"Population": pd.Series([], dtype=float)},
+        index=pd.Index([], dtype=object, name="State"),
+    )
+    state_counts = counts.set_axis(states.index, axis=0)
+    return {
+        "us_counties": counties,
+        "us_infected": counts,
+        "us_states": states,
+        "us_states_infected": state_counts,
+    }
 
 
 def get_population() -> pd.DataFrame:
     """Load population data from disk and preprocess."""
+    return _read_population().copy()
+
+
+@functools.lru_cache(maxsize=None)
+def _read_population() -> pd.DataFrame:
+    """Load population data once per process, it never changes."""
     with resources.path("covid19.resources", "world_population.csv") as file:
         countries = pd.read_csv(file, index_col=False)
 
@@ -144,48 +536,188 @@ def get_population() -> pd.DataFrame:
 
 
 def get_shifted_data() -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-    """Define a start date and shift each timeseries."""
-    infected_all = download_infected()
-    deaths_all = download_deaths()
+    """Download data, define a start date and shift each timeseries."""
     population = get_population()
+    infected, deaths = shift_to_day_zero(
+        download_infected(), download_deaths(), population
+    )
+    return infected, deaths, population
 
-    infected = []
-    deaths = []
-    for country in infected_all.columns:
-        if country not in population.index:
-            # Skip countries where we don't have population data
-            continue
-        day_zero_gt = infected_all[country].gt(DAY_ZERO_START)
-        if not day_zero_gt.any():
-            # Skip countries that haven't passed DAY_ZERO_START infected
-            continue
-        day_zero_idx = day_zero_gt.idxmax()
-        s_infected = infected_all[country].loc[day_zero_idx:].reset_index(drop=True)
-        s_deaths = deaths_all[country].loc[day_zero_idx:].reset_index(drop=True)
-        if len(s_infected.dropna()) < 5:
-            # If a country has less than 5 days of history, skip it
-            continue
-        infected.append(s_infected)
-        deaths.append(s_deaths)
 
-    # Transform list of Series into DataFrames
-    infected = pd.DataFrame(infected).T
-    deaths = pd.DataFrame(deaths).T
+def _shift_rows(values: np.ndarray, start: np.ndarray) -> np.ndarray:
+    """Shift each column of values up, so that it begins at its start row.
+
+    Args:
+        values (np.ndarray): 2D-array with one column per timeseries.
+        start (np.ndarray): The row where each column should begin.
+
+    Returns:
+        np.ndarray: The shifted columns, padded with NaN at the end.
+    """
+    n_rows, n_columns = values.shape
+    length = (n_rows - start).max(initial=0)
+    rows = start + np.arange(length)[:, np.newaxis]
+    inside = rows < n_rows
+    shifted = np.full((length, n_columns), np.nan)
+    shifted[inside] = values[rows[inside], np.nonzero(inside)[1]]
+    return shifted
+
+
+def shift_to_day_zero(
+    infected_all: pd.DataFrame, deaths_all: pd.DataFrame, population: pd.DataFrame
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Define a start date and shift each timeseries.
+
+    Day zero of each country is the first day with more than DAY_ZERO_START
+    infected. Countries without population data, that haven't reached day zero, or
+    that have less than 5 days of history after day zero are skipped.
+
+    Returns:
+        2 DataFrames: infected and deaths, indexed by days since day zero.
+    """
+    candidates = infected_all.loc[:, infected_all.columns.isin(population.index)]
+    values = candidates.to_numpy(dtype=float)
+
+    # Find day zero and the length of the remaining history, for all countries
+    passed = values > DAY_ZERO_START
+    day_zero = passed.argmax(axis=0)
+    observed = np.cumsum(~np.isnan(values[::-1]), axis=0)[::-1]
+    history = observed[day_zero, np.arange(values.shape[1])]
+    keep = passed.any(axis=0) & (history >= 5)
+
+    countries = candidates.columns[keep].rename(None)
+    day_zero = day_zero[keep]
+    infected = pd.DataFrame(_shift_rows(values[:, keep], day_zero), columns=countries)
+
+    # The deaths may have been updated to a different date, so we find day zero by
+    # the date instead of the position.
+    day_zero_deaths = deaths_all.index.searchsorted(infected_all.index[day_zero])
+    deaths = pd.DataFrame(
+        _shift_rows(deaths_all[countries].to_numpy(dtype=float), day_zero_deaths),
+        columns=countries,
+    )
+
+    return infected, deaths
+
+
+def new_cases_per_day(cumulative: pd.DataFrame) -> pd.DataFrame:
+    """Compute the number of new cases per day, as a 7-day rolling mean.
+
+    Sometimes, the cumulative number is frozen for several days and then updated.
+    We detect these regions by looking at the diff, and then linearly interpolate
+    the missing values.
+
+    Args:
+        cumulative (pd.DataFrame): Cumulative numbers, one row per date and one
+                                   column per country.
+
+    Returns:
+        pd.DataFrame: Average new cases during the last week, for each date.
+    """
+    data = cumulative.astype(float)
+    data = data.mask(data.diff() == 0)
+    data = data.interpolate(method="linear").diff()
+    return data.rolling(window=pd.Timedelta("7days")).mean()
+
+
+def infected_map_data(
+    infected_raw: pd.DataFrame, population: pd.DataFrame
+) -> pd.DataFrame:
+    """Compute the confirmed infected per 100k population, for the map.
+
+    Args:
+        infected_raw (pd.DataFrame): One row per date and one column per country.
+        population (pd.DataFrame): The population data.
+
+    Returns:
+        pd.DataFrame: Infected per 100k population for all dates, and the countries
+                      on the map. NaN where a country had no infected.
+    """
+    # Only countries with an ISO3-code can be shown on the map
+    on_map = population.dropna(subset=["ISO3"])
+    countries = on_map.index[on_map.index.isin(infected_raw.columns)]
+    infected = infected_raw[countries].astype(float)
+    per_capita = infected / on_map.loc[countries, "Population"] * 100_000
+    return per_capita.where(infected.round() > 0)
+
+
+def ingest(
+    infected_csv: Path,
+    deaths_csv: Path,
+    previous: Optional[Snapshot] = None,
+    previous_infected_csv: Optional[Path] = None,
+    previous_deaths_csv: Optional[Path] = None,
+    us_infected_csv: Optional[Path] = None,
+    us_deaths_csv: Optional[Path] = None,
+) -> Snapshot:
+    """Preprocess the source files, and derive everything the app needs.
+
+    Each source file is parsed at most once. If the previous snapshot and the
+    source files it was made from are given, only the new dates are processed. If
+    the US source files are not given, the US data of the previous snapshot (if
+    any) is kept.
+
+    Args:
+        infected_csv (Path): The CSSE time series of confirmed cases.
+        deaths_csv (Path): The CSSE time series of deaths.
+        previous (Snapshot, optional): The previous snapshot.
+        previous_infected_csv (Path, optional): The confirmed cases used for the
+                                                previous snapshot.
+        previous_deaths_csv (Path, optional): The deaths used for the previous
+                                              snapshot.
+        us_infected_csv (Path, optional): The CSSE time series of confirmed cases
+                                          in US counties.
+        us_deaths_csv (Path, optional): The CSSE time series of deaths in US
+                                        counties.
+
+    Returns:
+        Snapshot: The raw, shifted, daily, map and US data.
+    """
+    infected_raw = read_covid_csv(
+        infected_csv,
+        previous=(previous_infected_csv, previous.infected_raw)
+        if previous is not None and previous_infected_csv is not None
+        else None,
+    )
+    deaths_raw = read_covid_csv(
+        deaths_csv,
+        previous=(previous_deaths_csv, previous.deaths_raw)
+        if previous is not None and previous_deaths_csv is not None
+        else None,
+    )
+    population = get_population()
+    infected, deaths = shift_to_day_zero(infected_raw, deaths_raw, population)
+
+    # Only the countries in the shifted data can be selected in the app
+    infected_per_day = new_cases_per_day(infected_raw[infected.columns])
+
+    if us_infected_csv is not None and us_deaths_csv is not None:
+        us = ingest_us(us_infected_csv, us_deaths_csv)
+    elif previous is not None:
+        us = {name: getattr(previous, name) for name in empty_us()}
+    else:
+        us = empty_us()
+
+    return Snapshot.create(
+        infected_raw=infected_raw,
+        deaths_raw=deaths_raw,
+        population=population,
+        infected=infected,
+        deaths=deaths,
+        infected_per_day=infected_per_day,
+        infected_map=infected_map_data(infected_raw, population),
+        **us,
+    )
+
 
-    return infected, deaths, population
+def data_timestamp() -> Optional[pd.Timestamp]:
+    """Return the timestamp of the last commit to the .csv-file.
 
+    This is the cached timestamp, which is renewed when the data is refreshed. See
+    covid19.freshness.
 
-def data_timestamp() -> pd.Timestamp:
-    """Return the timestamp of the last commit to the .csv-file."""
-    r = requests.get(
-        r"https://api.github.com/repos/CSSEGISandData/COVID-19/commits",
-        params={
-            "path": r"csse_covid_19_data/csse_covid_19_time_series"
-            r"/time_series_covid19_confirmed_global.csv"
-        },
-    )
-    try:
-        timestamp = pd.Timestamp(r.json()[0]["commit"]["committer"]["date"])
-    except KeyError:
-        timestamp = pd.Timestamp(0)
-    return timestamp
+    Returns:
+        pd.Timestamp: The (timezone-aware) timestamp, or None if it has never been
+                      found, e.g. when rate limited since the first start.
+    """
+    return covid19.freshness.probe.cached()
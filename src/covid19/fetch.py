@@ -0,0 +1,158 @@
+"""Download files over HTTP, with a persistent on-disk cache.
+
+Responses are stored on disk together with their ETag/Last-Modified headers, and
+later requests for the same URL are made conditional. When the server responds
+with 304 Not Modified, the cached file is reused as-is.
+"""
+import dataclasses
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import requests
+
+from .metrics import Counter
+
+CACHE_DIR = Path(
+    os.environ.get(
+        "COVID19_HTTP_CACHE_DIR", Path(tempfile.gettempdir()) / "covid19" / "http"
+    )
+)
+TIMEOUT = 60
+CHUNK_SIZE = 1 << 16
+
+DOWNLOADED_BYTES = Counter(
+    "covid19_fetch_downloaded_bytes_total",
+    "Bytes of the files downloaded, by file. Nothing is downloaded when unmodified.",
+    ["source"],
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class FetchResult:
+    """A downloaded (or cached) file."""
+
+    url: str
+    path: Path
+    digest: str
+    modified: bool
+    previous: Optional[Path] = None
+    previous_digest: Optional[str] = None
+
+
+def _cache_paths(url: str, cache_dir: Path) -> Tuple[Path, Path, Path]:
+    """Return the paths of the cached body, previous body and headers for an URL."""
+    key = hashlib.sha1(url.encode()).hexdigest()
+    return (
+        cache_dir / f"{key}.body",
+        cache_dir / f"{key}.prev",
+        cache_dir / f"{key}.json",
+    )
+
+
+def fetch(
+    url: str,
+    cache_dir: Path = CACHE_DIR,
+    session: Optional[requests.Session] = None,
+) -> FetchResult:
+    """Download an URL, unless the cached copy is still valid.
+
+    When the file has been modified, the previously cached version is kept as well,
+    so that the caller can compare the two.
+
+    Args:
+        url (str): The URL to download.
+        cache_dir (Path, optional): Where to store the cached files.
+        session (requests.Session, optional): Session to use for the request.
+
+    Returns:
+        FetchResult: Path to the file on disk, the SHA-1 digest of its contents,
+                     whether it was modified since the previous fetch, and the
+                     path and digest of the previous version (if any).
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    body_path, previous_path, meta_path = _cache_paths(url, cache_dir)
+
+    # Make the request conditional if we have a cached copy
+    meta: Dict[str, str] = {}
+    headers = {}
+    if body_path.exists() and meta_path.exists():
+        meta = json.loads(meta_path.read_text())
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    response = (session or requests).get(
+        url, headers=headers, timeout=TIMEOUT, stream=True
+    )
+    with response:
+        if response.status_code == requests.codes.not_modified and meta:
+            return _result(url, body_path, previous_path, meta, modified=False)
+        response.raise_for_status()
+
+        # Stream the body to a temporary file, and then move it into place
+        digest = hashlib.sha1()
+        size = 0
+        fd, tmp_name = tempfile.mkstemp(prefix=".tmp-", dir=cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    digest.update(chunk)
+                    file.write(chunk)
+                    size += len(chunk)
+            _check_complete(response)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+    DOWNLOADED_BYTES.inc(size, source=url.rsplit("/", 1)[-1])
+
+    # Keep the previous version if the file has changed
+    modified = digest.hexdigest() != meta.get("digest")
+    if modified and meta:
+        os.replace(body_path, previous_path)
+        previous_digest = meta["digest"]
+    else:
+        previous_digest = meta.get("previous_digest", "")
+    os.replace(tmp_name, body_path)
+
+    meta = {
+        "url": url,
+        "etag": response.headers.get("ETag", ""),
+        "last_modified": response.headers.get("Last-Modified", ""),
+        "digest": digest.hexdigest(),
+        "previous_digest": previous_digest,
+    }
+    meta_path.write_text(json.dumps(meta))
+    return _result(url, body_path, previous_path, meta, modified=modified)
+
+
+def _check_complete(response: requests.Response) -> None:
+    """Raise an error if the connection was closed before the whole body was read.
+
+    Older versions of urllib3 silently return the part that was received.
+    """
+    expected = response.headers.get("Content-Length")
+    if expected is not None and response.raw.tell() < int(expected):
+        raise requests.exceptions.ChunkedEncodingError(
+            f"Received {response.raw.tell()} of {expected} bytes from {response.url}"
+        )
+
+
+def _result(
+    url: str, path: Path, previous_path: Path, meta: Dict[str, str], modified: bool
+) -> FetchResult:
+    """Create the FetchResult for a cached file."""
+    has_previous = bool(meta.get("previous_digest")) and previous_path.exists()
+    return FetchResult(
+        url,
+        path,
+        meta["digest"],
+        modified=modified,
+        previous=previous_path if has_previous else None,
+        previous_digest=meta["previous_digest"] if has_previous else None,
+    )
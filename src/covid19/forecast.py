@@ -1,5 +1,5 @@
 """Try to forecast the development..."""
-from typing import Tuple
+from typing import Optional, Sequence, Tuple
 
 import numpy as np
 import pandas as pd
@@ -71,3 +71,216 @@ def create_forecast(
     being_ill = combined - combined.shift(days_to_recover).fillna(0)
 
     return observed_data, forecast.astype(int), being_ill.astype(int)
+
+
+def forecast_ensemble(
+    infected: pd.Series,
+    day_of_control: int,
+    days_to_recover: int = 14,
+    ratio_avg_days: int = 4,
+    n_samples: int = 1000,
+    time_constant_spread: float = 0.25,
+    percentiles: Sequence[float] = (5, 25, 50, 75, 95),
+    seed: Optional[int] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Create percentile bands of the forecast, by Monte Carlo simulation.
+
+    Like create_forecast, but the initial growth rate is sampled from a normal
+    distribution with the exponentially weighted mean and standard deviation of the
+    last days. The time constant of the decay is sampled from a log-normal
+    distribution around its value in growth_rate_exp_decay. All trajectories are
+    computed at once, as one array.
+
+    Args:
+        infected (pd.Series): The initial timeseries.
+        day_of_control (int): The day when growth rate should reach (close to) 1.0
+        days_to_recover (int, optional): How many days it takes for a patient to
+                                         recover. Defaults to 14.
+        ratio_avg_days (int, optional): How many days to use for estimation of initial
+                                        growth rate. Defaults to 4.
+        n_samples (int, optional): The number of trajectories. Defaults to 1000.
+        time_constant_spread (float, optional): The standard deviation of the
+                                                logarithm of the time constant.
+                                                Defaults to 0.25.
+        percentiles (sequence of float, optional): The percentiles to return.
+                                                   Defaults to 5, 25, 50, 75, 95.
+        seed (int, optional): Seed of the random generator.
+
+    Returns:
+        2 Pandas DataFrames: forecast and being_ill, with one row per day from the
+                             last observed day, and one column per percentile.
+    """
+    rng = np.random.default_rng(seed)
+
+    # The observed data, and the distribution of the initial growth rate
+    observed_data = infected.dropna()
+    increase_ratio = observed_data / observed_data.shift(1)
+    ewm = increase_ratio.ewm(span=ratio_avg_days)
+    ratio_mean = ewm.mean().iloc[-1]
+    ratio_std = np.nan_to_num(ewm.std().iloc[-1])
+    last_obs_value = observed_data.iloc[-1]
+    last_obs_day = observed_data.index[-1]
+
+    # All trajectories have the length of the deterministic forecast
+    time_constant = (day_of_control - last_obs_day) / 4
+    x = np.arange(0, time_constant * 6)
+
+    # The growth rates of each trajectory (one per row). The cumulative number of
+    # infected can't decrease.
+    initial_ratios = rng.normal(ratio_mean, ratio_std, size=(n_samples, 1)).clip(1)
+    time_constants = time_constant * rng.lognormal(
+        sigma=time_constant_spread, size=(n_samples, 1)
+    )
+    growth_ratios = (initial_ratios - 1) * np.exp(-x / time_constants) + 1
+    forecast = last_obs_value * np.hstack(
+        [np.ones((n_samples, 1)), growth_ratios]
+    ).cumprod(axis=1)
+
+    # Number of ill people: Subtract the infected days_to_recover ago, which is an
+    # observation (or zero) early in the forecast
+    offsets = np.arange(forecast.shape[1])
+    observed_day = len(observed_data) - 1 + offsets[:days_to_recover] - days_to_recover
+    previous = np.where(
+        observed_day >= 0, observed_data.to_numpy()[observed_day.clip(0)], 0
+    )
+    being_ill = forecast.copy()
+    being_ill[:, :days_to_recover] -= previous
+    being_ill[:, days_to_recover:] -= forecast[
+        :, : max(len(offsets) - days_to_recover, 0)
+    ]
+
+    def bands(trajectories: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame(
+            np.percentile(trajectories, percentiles, axis=0).T,
+            index=last_obs_day + offsets,
+            columns=percentiles,
+        )
+
+    return bands(forecast), bands(being_ill)
+
+
+class ForecastGrid:
+    """Forecasts for all countries and a grid of parameters, computed at once.
+
+    The results are the same as from create_forecast (with forecast_start=-1), but
+    all countries, days of control and recovery times are computed in one go with
+    numpy. Getting a single forecast is then only a lookup.
+    """
+
+    def __init__(
+        self,
+        infected: pd.DataFrame,
+        days_of_control: Sequence[int],
+        days_to_recover: Sequence[int],
+        ratio_avg_days: int = 4,
+    ):
+        """Compute the forecasts.
+
+        Args:
+            infected (pd.DataFrame): The timeseries of all countries, indexed by the
+                                     days since day zero. Shorter timeseries are
+                                     padded with NaN at the end.
+            days_of_control (sequence of int): The days when the growth rate should
+                                               reach (close to) 1.0
+            days_to_recover (sequence of int): The numbers of days it takes for a
+                                               patient to recover.
+            ratio_avg_days (int, optional): How many days to use for estimation of
+                                            initial growth rate. Defaults to 4.
+        """
+        self.countries = infected.columns
+        self.days_of_control = list(days_of_control)
+        self.days_to_recover = list(days_to_recover)
+
+        # The observed data is kept with one row per country
+        self.lengths = infected.notna().sum().to_numpy()
+        self.observed = infected.to_numpy(dtype=float).T
+        last_obs_day = self.lengths - 1
+        last_obs_value = self.observed[np.arange(len(self.countries)), last_obs_day]
+
+        # The initial growth rate, on the last observed day of each country
+        increase_ratio = infected / infected.shift(1)
+        ewm = increase_ratio.ewm(span=ratio_avg_days).mean().to_numpy()
+        initial_ratio = ewm[last_obs_day, np.arange(len(self.countries))]
+
+        # The future growth rates, like growth_rate_exp_decay, by country and day of
+        # control. The rates after the end of each forecast are NaN.
+        days_until_control = (
+            np.array(self.days_of_control)[np.newaxis, :] - last_obs_day[:, np.newaxis]
+        )
+        time_constant = days_until_control / 4
+        self.n_growth = np.ceil(time_constant * 6).clip(0).astype(int)
+        x = np.arange(self.n_growth.max(initial=0), dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            growth_ratios = (initial_ratio[:, np.newaxis, np.newaxis] - 1) * np.exp(
+                -x / time_constant[:, :, np.newaxis]
+            ) + 1
+        growth_ratios[x >= self.n_growth[:, :, np.newaxis]] = np.nan
+
+        # The forecasts start when the observations end
+        ones = np.ones(growth_ratios.shape[:2] + (1,))
+        self.forecast = last_obs_value[:, np.newaxis, np.newaxis] * np.concatenate(
+            [ones, growth_ratios], axis=2
+        ).cumprod(axis=2)
+
+        # The number of ill people is the increase over the recovery time. Within
+        # the observations, it doesn't depend on the day of control.
+        self.ill_observed = np.stack(
+            [
+                self.observed
+                - np.pad(self.observed, ((0, 0), (days, 0)))[:, : -days or None]
+                for days in self.days_to_recover
+            ]
+        )
+
+        # After the observations, the value of days_to_recover ago is subtracted.
+        # Early in the forecast, that is an observation (or zero). The first day of
+        # the forecast is the last observed day.
+        offsets = np.arange(self.forecast.shape[2])
+        ill_forecast = []
+        for days in self.days_to_recover:
+            previous = np.zeros_like(self.forecast)
+            previous[:, :, days:] = self.forecast[:, :, : max(len(offsets) - days, 0)]
+            observed_day = last_obs_day[:, np.newaxis] + offsets - days
+            from_observed = (offsets < days) & (observed_day >= 0)
+            observed = np.take_along_axis(
+                self.observed, observed_day.clip(0, self.observed.shape[1] - 1), axis=1
+            )
+            previous += np.where(from_observed, observed, 0)[:, np.newaxis, :]
+            ill_forecast.append(self.forecast - previous)
+        self.ill_forecast = np.stack(ill_forecast, axis=2)
+
+    def lookup(
+        self, country: str, day_of_control: int, days_to_recover: int
+    ) -> Tuple[pd.Series, pd.Series, pd.Series]:
+        """Return the forecast of a country, for parameters in the grid.
+
+        Args:
+            country (str): The country.
+            day_of_control (int): The day when growth rate should reach (close to)
+                                  1.0
+            days_to_recover (int): How many days it takes for a patient to recover.
+
+        Returns:
+            3 Pandas Series: observed_data, forecast, being_ill (see create_forecast)
+        """
+        i = self.countries.get_loc(country)
+        j = self.days_of_control.index(day_of_control)
+        k = self.days_to_recover.index(days_to_recover)
+        length = self.lengths[i]
+        n_forecast = self.n_growth[i, j] + 1
+
+        observed_data = pd.Series(
+            self.observed[i, :length].copy(), index=np.arange(length), name=country
+        )
+        forecast_days = np.arange(length - 1, length - 1 + n_forecast)
+        forecast = pd.Series(self.forecast[i, j, :n_forecast], index=forecast_days)
+        being_ill = pd.Series(
+            np.concatenate(
+                [
+                    self.ill_observed[k, i, :length],
+                    self.ill_forecast[i, j, k, 1:n_forecast],
+                ]
+            ),
+            index=np.arange(length - 1 + n_forecast),
+        )
+        return observed_data, forecast.astype(int), being_ill.astype(int)
@@ -0,0 +1,162 @@
+"""Find out cheaply when the upstream data was last updated.
+
+The time of the last commit to the CSSE data is asked from the GitHub API, which
+has a low rate limit for unauthenticated requests. The answer is therefore cached
+in a file shared by all processes, and only renewed when it is older than a TTL.
+The requests are conditional, and after an error (e.g. when rate limited) we back
+off exponentially before asking again.
+"""
+import contextlib
+import fcntl
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+import pandas as pd
+import requests
+
+from .fetch import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+# The GitHub API. Override the location to e.g. use a local stand-in.
+GITHUB_API_URL = os.environ.get("COVID19_GITHUB_API_URL", "https://api.github.com")
+COMMITS_URL = f"{GITHUB_API_URL}/repos/CSSEGISandData/COVID-19/commits"
+SOURCE_PATH = (
+    "csse_covid_19_data/csse_covid_19_time_series"
+    "/time_series_covid19_confirmed_global.csv"
+)
+
+# How long the timestamp is considered fresh, and how long to wait after errors
+TTL = pd.Timedelta(minutes=5)
+MIN_BACKOFF = pd.Timedelta(minutes=1)
+MAX_BACKOFF = pd.Timedelta(hours=1)
+TIMEOUT = 10
+
+
+class FreshnessProbe:
+    """The timestamp of the last upstream commit, cached in a file."""
+
+    def __init__(
+        self,
+        path: Path = CACHE_DIR / "freshness.json",
+        url: str = COMMITS_URL,
+        source_path: str = SOURCE_PATH,
+        ttl: pd.Timedelta = TTL,
+        session: Optional[requests.Session] = None,
+    ):
+        """Create the probe.
+
+        Args:
+            path (Path, optional): The file to cache the timestamp in.
+            url (str, optional): The commits-endpoint of the GitHub API.
+            source_path (str, optional): The file in the repository to look for
+                                         commits to.
+            ttl (pd.Timedelta, optional): How long the timestamp is considered fresh.
+            session (requests.Session, optional): Session to use for the requests.
+        """
+        self.path = Path(path)
+        self.url = url
+        self.source_path = source_path
+        self.ttl = ttl
+        self.session = session
+
+    def cached(self) -> Optional[pd.Timestamp]:
+        """Return the cached timestamp without asking upstream, if we have one."""
+        timestamp = self._read().get("timestamp")
+        return pd.Timestamp(timestamp) if timestamp else None
+
+    def timestamp(self) -> Optional[pd.Timestamp]:
+        """Return the timestamp of the last upstream commit.
+
+        Upstream is only asked when the cached timestamp is older than the TTL, and
+        not while backing off after an error. Only one process asks at a time, the
+        others wait and then use its answer.
+
+        Returns:
+            pd.Timestamp: The timestamp, or None if it has never been found.
+        """
+        if not self._expired(self._read()):
+            return self.cached()
+        with self._lock():
+            state = self._read()
+            if self._expired(state):
+                self._write(self._probe(state))
+        return self.cached()
+
+    def _expired(self, state: Dict[str, Any]) -> bool:
+        """Return whether it is time to ask upstream again."""
+        now = pd.Timestamp.now(tz="UTC")
+        if state.get("retry_at"):
+            return now >= pd.Timestamp(state["retry_at"])
+        if state.get("checked"):
+            return now >= pd.Timestamp(state["checked"]) + self.ttl
+        return True
+
+    def _probe(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Ask upstream for the timestamp, and return the new state."""
+        now = pd.Timestamp.now(tz="UTC")
+        headers = {"If-None-Match": state["etag"]} if state.get("etag") else {}
+        try:
+            response = (self.session or requests).get(
+                self.url,
+                params={"path": self.source_path, "per_page": 1},
+                headers=headers,
+                timeout=TIMEOUT,
+            )
+            if response.status_code == requests.codes.not_modified and state.get(
+                "timestamp"
+            ):
+                timestamp = state["timestamp"]
+            else:
+                response.raise_for_status()
+                commit = response.json()[0]["commit"]
+                timestamp = pd.Timestamp(commit["committer"]["date"]).isoformat()
+        except (requests.RequestException, ValueError, LookupError) as error:
+            failures = state.get("failures", 0) + 1
+            retry_at = now + min(MIN_BACKOFF * 2 ** (failures - 1), MAX_BACKOFF)
+            response = getattr(error, "response", None)
+            if response is not None and response.headers.get("X-RateLimit-Reset"):
+                reset = pd.Timestamp(
+                    int(response.headers["X-RateLimit-Reset"]), unit="s", tz="UTC"
+                )
+                retry_at = max(retry_at, reset)
+            logger.warning(
+                "Probing %s failed (%s), retrying at %s", self.url, error, retry_at
+            )
+            return {**state, "failures": failures, "retry_at": retry_at.isoformat()}
+        return {
+            "timestamp": timestamp,
+            "etag": response.headers.get("ETag", state.get("etag", "")),
+            "checked": now.isoformat(),
+        }
+
+    def _read(self) -> Dict[str, Any]:
+        """Read the cached state, if any."""
+        try:
+            return json.loads(self.path.read_text())
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write(self, state: Dict[str, Any]) -> None:
+        """Atomically replace the cached state."""
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        tmp_path.write_text(json.dumps(state))
+        os.replace(tmp_path, self.path)
+
+    @contextlib.contextmanager
+    def _lock(self) -> Iterator[None]:
+        """Hold an exclusive lock, so that only one process probes at a time."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_name(f".{self.path.name}.lock"), "w") as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+
+# All processes share the same cached timestamp
+probe = FreshnessProbe()
@@ -0,0 +1,359 @@
+"""Collect metrics of the app, and export them in the Prometheus text format.
+
+The metrics are aggregated over all gunicorn workers. Each process adds its values
+to its own memory-mapped file in a directory shared by the workers, and /metrics
+(served by any worker) sums the files of all processes, including the ones of
+workers that have exited. Recording a value is then only a few writes to memory.
+This is how the multiprocess mode of prometheus_client works as well, but without
+the extra dependency.
+
+The directory must be new for each start of the app, see gunicorn_config.py.
+"""
+import bisect
+import collections
+import contextlib
+import json
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+INITIAL_FILE_SIZE = 1 << 16
+
+# Latencies in seconds, and sizes in bytes
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+SIZE_BUCKETS = tuple(10 ** exponent for exponent in range(2, 9))
+
+# The aggregated values, by sample name and the (name, value) pairs of the labels
+Samples = Dict[str, Dict[Tuple[Tuple[str, str], ...], float]]
+
+
+def _padded(size: int) -> int:
+    """Round up to a multiple of 8 bytes, so that the values are aligned."""
+    return (size + 7) // 8 * 8
+
+
+def _entries(data: Any) -> Iterator[Tuple[str, int, float]]:
+    """Iterate over the key, offset and value of the entries of a values file.
+
+    The file starts with the number of bytes used. Then follow the entries, each
+    with the length of its key, the key (padded to 8 bytes) and a float64 value.
+    """
+    used = struct.unpack_from("Q", data, 0)[0] if len(data) >= 8 else 0
+    position = 8
+    while position < used:
+        length = struct.unpack_from("I", data, position)[0]
+        start = position + 4
+        end = start + length
+        key = bytes(data[start:end]).decode()
+        position = _padded(end)
+        yield key, position, struct.unpack_from("d", data, position)[0]
+        position += 8
+
+
+class ValueFile:
+    """The values of the metrics of one process, in a memory-mapped file."""
+
+    def __init__(self, path: Path):
+        """Open the file, and create it if needed.
+
+        Args:
+            path (Path): The file.
+        """
+        self.path = Path(path)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+        size = os.fstat(self._fd).st_size
+        if size == 0:
+            size = INITIAL_FILE_SIZE
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._offsets = {key: offset for key, offset, _ in _entries(self._map)}
+        self._used = max(struct.unpack_from("Q", self._map, 0)[0], 8)
+
+    def add(self, key: str, amount: float) -> None:
+        """Add an amount to a value, which starts at 0."""
+        offset = self._offsets.get(key)
+        if offset is None:
+            offset = self._append(key)
+        value = struct.unpack_from("d", self._map, offset)[0]
+        struct.pack_into("d", self._map, offset, value + amount)
+
+    def _append(self, key: str) -> int:
+        """Add an entry for a new key, and return the offset of its value."""
+        encoded = key.encode()
+        offset = _padded(self._used + 4 + len(encoded))
+        end = offset + 8
+        if end > len(self._map):
+            size = len(self._map)
+            while end > size:
+                size *= 2
+            os.ftruncate(self._fd, size)
+            self._map = mmap.mmap(self._fd, size)
+        struct.pack_into(
+            f"I{len(encoded)}s", self._map, self._used, len(encoded), encoded
+        )
+        struct.pack_into("d", self._map, offset, 0.0)
+
+        # The entry is only visible to readers once it is complete
+        struct.pack_into("Q", self._map, 0, end)
+        self._used = end
+        self._offsets[key] = offset
+        return offset
+
+
+_directory: Optional[Path] = None
+_values: Optional[ValueFile] = None
+_lock = threading.Lock()
+
+
+def metrics_dir() -> Path:
+    """Return the directory of the values files of all processes.
+
+    It is given by COVID19_METRICS_DIR. If that is not set, the metrics are only
+    aggregated over this process and its children.
+    """
+    global _directory
+    if _directory is None:
+        _directory = Path(
+            os.environ.get("COVID19_METRICS_DIR")
+            or tempfile.mkdtemp(prefix="covid19-metrics-")
+        )
+    return _directory
+
+
+def _add(key: str, amount: float) -> None:
+    """Add an amount to a value of this process."""
+    global _values
+    if _values is None:
+        metrics_dir().mkdir(parents=True, exist_ok=True)
+        _values = ValueFile(metrics_dir() / f"{os.getpid()}.db")
+    _values.add(key, amount)
+
+
+def _after_fork() -> None:
+    """Let a forked process, e.g. a gunicorn worker, write to a file of its own."""
+    global _values, _lock
+    _values = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def _format(value: float) -> str:
+    """Format a number like Prometheus does."""
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _sample(name: str, labels: Dict[str, str], value: float) -> str:
+    """Format one sample of a metric."""
+    if not labels:
+        return f"{name} {_format(value)}"
+    pairs = ",".join(
+        '{}="{}"'.format(
+            label,
+            str(label_value)
+            .replace("\\", r"\\")
+            .replace("\n", r"\n")
+            .replace('"', r"\""),
+        )
+        for label, label_value in labels.items()
+    )
+    return f"{name}{{{pairs}}} {_format(value)}"
+
+
+class Metric:
+    """A family of metrics, with the same name and label names."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        """Create the metric, and add it to the exported metrics.
+
+        Args:
+            name (str): The name of the metric.
+            documentation (str): What the metric measures.
+            labelnames (sequence of str, optional): The names of the labels.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._keys: Dict[Tuple[Any, ...], str] = {}
+        REGISTRY.append(self)
+
+    def _key(self, sample: str, labelvalues: Tuple[str, ...], **extra: str) -> str:
+        """Return the key of a sample in the values files."""
+        cache_key = (sample, labelvalues, *extra.values())
+        key = self._keys.get(cache_key)
+        if key is None:
+            labels = {**dict(zip(self.labelnames, labelvalues)), **extra}
+            key = self._keys[cache_key] = json.dumps([sample, labels])
+        return key
+
+    def _labelvalues(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        """Return the values of the labels, in the order of the label names."""
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def collect(self, samples: Samples) -> List[str]:
+        """Return the lines of this metric to export.
+
+        Args:
+            samples (dict): The aggregated values, see aggregate().
+
+        Returns:
+            list: The formatted samples.
+        """
+        return [
+            _sample(name, dict(labels), value)
+            for name, by_labels in samples.items()
+            if name == self.name
+            for labels, value in sorted(by_labels.items())
+        ]
+
+
+class Counter(Metric):
+    """A value that only goes up, e.g. the number of bytes downloaded."""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increase the counter.
+
+        Args:
+            amount (float, optional): How much to increase the counter by.
+            **labels (str): The values of the labels.
+        """
+        key = self._key(self.name, self._labelvalues(labels))
+        with _lock:
+            _add(key, amount)
+
+
+class Histogram(Metric):
+    """The distribution of a value, e.g. the latency of a callback."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DURATION_BUCKETS,
+    ):
+        """Create the histogram.
+
+        Args:
+            name (str): The name of the metric.
+            documentation (str): What the metric measures.
+            labelnames (sequence of str, optional): The names of the labels.
+            buckets (sequence of float, optional): The upper bounds of the buckets.
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Add an observation.
+
+        Args:
+            value (float): The observed value.
+            **labels (str): The values of the labels.
+        """
+        labelvalues = self._labelvalues(labels)
+        upper = self.buckets[bisect.bisect_left(self.buckets, value)]
+        bucket = self._key(f"{self.name}_bucket", labelvalues, le=_format(upper))
+        total = self._key(f"{self.name}_sum", labelvalues)
+        count = self._key(f"{self.name}_count", labelvalues)
+        with _lock:
+            _add(bucket, 1)
+            _add(total, value)
+            _add(count, 1)
+
+    @contextlib.contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the time spent in a with-block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self, samples: Samples) -> List[str]:
+        """Return the lines of this metric to export, with cumulative buckets."""
+        lines = []
+        counts = samples.get(f"{self.name}_count", {})
+        buckets = samples.get(f"{self.name}_bucket", {})
+        sums = samples.get(f"{self.name}_sum", {})
+        for labels in sorted(counts):
+            cumulative = 0.0
+            for upper in self.buckets:
+                le = _format(upper)
+                cumulative += buckets.get(labels + (("le", le),), 0)
+                lines.append(
+                    _sample(
+                        f"{self.name}_bucket", dict(labels + (("le", le),)), cumulative
+                    )
+                )
+            lines.append(_sample(f"{self.name}_sum", dict(labels), sums.get(labels, 0)))
+            lines.append(_sample(f"{self.name}_count", dict(labels), counts[labels]))
+        return lines
+
+
+class Gauge(Metric):
+    """A value that is found when the metrics are exported, e.g. the data age."""
+
+    type = "gauge"
+
+    def __init__(
+        self, name: str, documentation: str, function: Callable[[], Optional[float]]
+    ):
+        """Create the gauge.
+
+        Args:
+            name (str): The name of the metric.
+            documentation (str): What the metric measures.
+            function (Callable): Returns the current value, or None if unknown.
+        """
+        super().__init__(name, documentation)
+        self.function = function
+
+    def collect(self, samples: Samples) -> List[str]:
+        """Return the current value to export, if any."""
+        value = self.function()
+        return [] if value is None else [_sample(self.name, {}, value)]
+
+
+# All metrics, in the order they are exported
+REGISTRY: List[Metric] = []
+
+
+def aggregate() -> Samples:
+    """Sum the values of all processes.
+
+    Returns:
+        dict: The values, by sample name and the (name, value) pairs of the labels.
+    """
+    samples: Samples = collections.defaultdict(lambda: collections.defaultdict(float))
+    for path in metrics_dir().glob("*.db"):
+        for key, _, value in _entries(path.read_bytes()):
+            name, labels = json.loads(key)
+            samples[name][tuple(labels.items())] += value
+    return samples
+
+
+def render() -> str:
+    """Return all metrics, in the Prometheus text format."""
+    samples = aggregate()
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.collect(samples))
+    return "\n".join(lines) + "\n"
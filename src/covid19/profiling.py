@@ -0,0 +1,156 @@
+"""Profile selected callbacks and data refreshes in production.
+
+Profiling is off by default, and then nothing is wrapped. It is enabled with
+environment variables:
+
+* COVID19_PROFILE: What to profile. Either "all", or a comma-separated list of
+  callbacks (given by their output, e.g. "forecast-figure.figure") and/or
+  "refresh".
+* COVID19_PROFILE_TOKEN: Profile any request that has this token in its
+  X-Covid19-Profile header.
+* COVID19_PROFILE_MODE: "cprofile" (the default) writes the output of cProfile,
+  which can be read with pstats or snakeviz. "sample" samples the stack every few
+  milliseconds instead, which costs less, and writes folded stacks for e.g.
+  flamegraph.pl or speedscope.
+* COVID19_PROFILE_DIR: Where to write the profiles. Only the newest
+  COVID19_PROFILE_KEEP profiles are kept.
+"""
+import collections
+import contextlib
+import cProfile
+import hmac
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterator, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+TARGETS = {
+    target.strip()
+    for target in os.environ.get("COVID19_PROFILE", "").split(",")
+    if target.strip()
+}
+TOKEN = os.environ.get("COVID19_PROFILE_TOKEN", "")
+HEADER = "X-Covid19-Profile"
+MODE = os.environ.get("COVID19_PROFILE_MODE", "cprofile")
+PROFILE_DIR = Path(
+    os.environ.get(
+        "COVID19_PROFILE_DIR", Path(tempfile.gettempdir()) / "covid19" / "profiles"
+    )
+)
+KEEP = max(int(os.environ.get("COVID19_PROFILE_KEEP", 100)), 1)
+SAMPLE_INTERVAL = 0.005
+
+# Whether anything can be profiled at all
+ENABLED = bool(TARGETS or TOKEN)
+
+
+class StackSampler:
+    """Sample the stack of a thread at regular intervals, from another thread."""
+
+    suffix = ".folded"
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        """Create the sampler.
+
+        Args:
+            interval (float, optional): The time between the samples, in seconds.
+        """
+        self.interval = interval
+        self.counts: collections.Counter = collections.Counter()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def enable(self) -> None:
+        """Start sampling the current thread."""
+        target = threading.get_ident()
+        self._thread = threading.Thread(
+            target=self._run, args=(target,), name="covid19-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def disable(self) -> None:
+        """Stop sampling."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, target: int) -> None:
+        """Count the stacks of the target thread until stopped."""
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def dump_stats(self, path: Path) -> None:
+        """Write the stacks in the folded format, with the number of samples."""
+        Path(path).write_text(
+            "".join(f"{stack} {count}\n" for stack, count in self.counts.items())
+        )
+
+
+class CProfiler(cProfile.Profile):
+    """A deterministic profile of all function calls."""
+
+    suffix = ".prof"
+
+
+def requested(token: Optional[str]) -> bool:
+    """Return whether a request asks to be profiled, with the right token."""
+    return bool(TOKEN and token and hmac.compare_digest(token, TOKEN))
+
+
+def selected(name: str) -> bool:
+    """Return whether a callback or the refresh is selected to be profiled."""
+    return "all" in TARGETS or name in TARGETS
+
+
+@contextlib.contextmanager
+def profile(name: str, force: bool = False) -> Iterator[None]:
+    """Profile a block of code, if it is selected, and write the profile.
+
+    Args:
+        name (str): What is profiled, e.g. the output of a callback or "refresh".
+        force (bool, optional): Profile even if not selected, e.g. when requested.
+    """
+    if not (force or selected(name)):
+        yield
+        return
+    profiler: Union[CProfiler, StackSampler] = (
+        StackSampler() if MODE == "sample" else CProfiler()
+    )
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _write(profiler, name)
+
+
+def _write(profiler: Any, name: str) -> None:
+    """Write a profile, and remove the oldest ones."""
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    safe_name = re.sub(r"[^\w.,-]", "_", name)
+    timestamp = time.strftime("%Y%m%dT%H%M%S")
+    path = PROFILE_DIR / (
+        f"{timestamp}-{time.time_ns() % 10**9:09d}-{os.getpid()}-{safe_name}"
+        f"{profiler.suffix}"
+    )
+    profiler.dump_stats(path)
+    logger.info("Profile of %s written to %s", name, path)
+
+    profiles = sorted(PROFILE_DIR.iterdir(), key=lambda path: path.name)
+    for old in profiles[:-KEEP]:
+        with contextlib.suppress(OSError):
+            old.unlink()
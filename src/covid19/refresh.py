@@ -0,0 +1,233 @@
+"""Refresh the data in the background, independently of the connected clients."""
+import dataclasses
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import pandas as pd
+
+import covid19.data
+import covid19.freshness
+import covid19.profiling
+import covid19.snapshot
+from covid19.fetch import FetchResult, fetch
+from covid19.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# How often to look for new data. The refreshes are aligned with DATA_UPDATE_TIME,
+# so that the schedulers in all the workers wake up at the same time.
+REFRESH_INTERVAL = pd.Timedelta(minutes=10)
+
+# Snapshots younger than this are considered fresh
+SNAPSHOT_MAX_AGE = REFRESH_INTERVAL / 2
+
+REFRESH_DURATION = Histogram(
+    "covid19_refresh_duration_seconds",
+    "Time spent refreshing the snapshot, including waiting for other processes.",
+    buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+REFRESHES = Counter(
+    "covid19_refreshes_total",
+    "Refreshes of the snapshot, by what they found out.",
+    ["outcome"],
+)
+
+
+def update_snapshot(
+    store: covid19.snapshot.SnapshotStore,
+    probe: covid19.freshness.FreshnessProbe = covid19.freshness.probe,
+) -> covid19.snapshot.Snapshot:
+    """Refresh the snapshot on disk if it is stale, and memory-map it.
+
+    Only one process refreshes at a time. The others wait for it to finish, and
+    then find a fresh snapshot on disk. If the upstream timestamp hasn't moved
+    since the current snapshot was made, nothing is downloaded. Otherwise, the
+    source files are fetched with conditional requests, and if none of them have
+    changed, we don't parse them at all. If they have, only the dates that have
+    changed since the current snapshot are processed, when possible. The US data is
+    optional: If it can't be fetched or parsed, the US data of the current snapshot
+    is kept, and the global data is refreshed anyway.
+
+    Args:
+        store (SnapshotStore): Where to store the snapshot.
+        probe (FreshnessProbe, optional): Where to find the upstream timestamp.
+
+    Returns:
+        Snapshot: The current snapshot.
+
+    Raises:
+        RuntimeError: If the current snapshot can't be loaded, e.g. if its files
+                      were removed by hand.
+    """
+    with REFRESH_DURATION.time(), store.lock():
+        age = store.age()
+        if age is None or age > SNAPSHOT_MAX_AGE:
+            upstream = probe.timestamp()
+            if (
+                age is not None
+                and upstream is not None
+                and upstream == store.upstream()
+            ):
+                REFRESHES.inc(outcome="upstream unchanged")
+                store.mark_checked()
+                return _load(store)
+            sources = {
+                url: fetch(url)
+                for url in (
+                    covid19.data.INFECTED_SOURCE_GLOBAL,
+                    covid19.data.DEATHS_SOURCE_GLOBAL,
+                )
+            }
+            try:
+                us_sources = {
+                    url: fetch(url)
+                    for url in (
+                        covid19.data.INFECTED_SOURCE_US,
+                        covid19.data.DEATHS_SOURCE_US,
+                    )
+                }
+            except Exception:
+                logger.exception("Fetching the US data failed, keeping the old")
+                us_sources = {}
+            previous_digests = store.sources()
+            digests = {
+                url: source.digest for url, source in {**sources, **us_sources}.items()
+            }
+            if not us_sources:
+                _keep_us_digests(digests, previous_digests)
+            if age is not None and digests == previous_digests:
+                # The files may not have reached the servers yet, so the upstream
+                # timestamp is only recorded together with new data
+                REFRESHES.inc(outcome="not modified")
+                store.mark_checked()
+            else:
+                REFRESHES.inc(outcome="ingested")
+                infected = sources[covid19.data.INFECTED_SOURCE_GLOBAL]
+                deaths = sources[covid19.data.DEATHS_SOURCE_GLOBAL]
+                # Without the US files, the US data of the previous snapshot is kept
+                snapshot = covid19.data.ingest(
+                    infected_csv=infected.path,
+                    deaths_csv=deaths.path,
+                    previous=store.load(),
+                    previous_infected_csv=_previous_path(
+                        infected, previous_digests.get(infected.url)
+                    ),
+                    previous_deaths_csv=_previous_path(
+                        deaths, previous_digests.get(deaths.url)
+                    ),
+                )
+                # The US data is only parsed again when it has changed
+                if us_sources and (
+                    age is None
+                    or any(
+                        source.digest != previous_digests.get(url)
+                        for url, source in us_sources.items()
+                    )
+                ):
+                    try:
+                        us = covid19.data.ingest_us(
+                            us_sources[covid19.data.INFECTED_SOURCE_US].path,
+                            us_sources[covid19.data.DEATHS_SOURCE_US].path,
+                        )
+                    except Exception:
+                        logger.exception("Parsing the US data failed, keeping the old")
+                        _keep_us_digests(digests, previous_digests)
+                    else:
+                        snapshot = dataclasses.replace(snapshot, **us)
+                store.write(snapshot, sources=digests, upstream=upstream)
+        else:
+            REFRESHES.inc(outcome="fresh")
+    return _load(store)
+
+
+def _load(store: covid19.snapshot.SnapshotStore) -> covid19.snapshot.Snapshot:
+    """Memory-map the current snapshot, which the refresh has made sure exists."""
+    snapshot = store.load()
+    if snapshot is None:
+        raise RuntimeError(f"The current snapshot is missing from {store.root}")
+    return snapshot
+
+
+def _keep_us_digests(digests: Dict[str, str], previous: Dict[str, str]) -> None:
+    """Record the digests of the US files that the kept US data was made from.
+
+    The new US files are then fetched and parsed again at the next refresh.
+    """
+    for url in (covid19.data.INFECTED_SOURCE_US, covid19.data.DEATHS_SOURCE_US):
+        if url in previous:
+            digests[url] = previous[url]
+        else:
+            digests.pop(url, None)
+
+
+def _previous_path(source: FetchResult, digest: Optional[str]) -> Optional[Path]:
+    """Return the version of a source file with the given digest, if we have it."""
+    if source.digest == digest:
+        return source.path
+    if source.previous_digest == digest:
+        return source.previous
+    return None
+
+
+def next_refresh(now: pd.Timestamp) -> pd.Timestamp:
+    """Return the time of the next scheduled refresh after now.
+
+    Args:
+        now (pd.Timestamp): The current (timezone-aware) time.
+
+    Returns:
+        pd.Timestamp: The next refresh time.
+    """
+    anchor = pd.Timestamp.combine(now.date(), covid19.data.DATA_UPDATE_TIME)
+    periods = (now - anchor) // REFRESH_INTERVAL + 1
+    return anchor + periods * REFRESH_INTERVAL
+
+
+class RefreshScheduler(threading.Thread):
+    """Background thread that refreshes the data on a fixed schedule."""
+
+    def __init__(
+        self,
+        store: covid19.snapshot.SnapshotStore,
+        on_update: Callable[[covid19.snapshot.Snapshot], None],
+        refresh_first: bool = False,
+    ):
+        """Create the scheduler.
+
+        Args:
+            store (SnapshotStore): Where to store the snapshots.
+            on_update (Callable): Called with the current snapshot after each
+                                  refresh.
+            refresh_first (bool, optional): Refresh (if stale) right away, instead
+                                            of waiting for the first scheduled
+                                            refresh.
+        """
+        super().__init__(name="covid19-refresh", daemon=True)
+        self.store = store
+        self.on_update = on_update
+        self.refresh_first = refresh_first
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        """Sleep until the next scheduled refresh, refresh, and repeat."""
+        if self.refresh_first:
+            self._refresh()
+        while True:
+            now = pd.Timestamp.now(tz="UTC")
+            if self._stopped.wait((next_refresh(now) - now).total_seconds()):
+                return
+            self._refresh()
+
+    def _refresh(self) -> None:
+        """Refresh the snapshot, and pass it on."""
+        try:
+            with covid19.profiling.profile("refresh"):
+                self.on_update(update_snapshot(self.store))
+        except Exception:
+            logger.exception("Refreshing the data failed")
+
+    def stop(self) -> None:
+        """Stop the scheduler after the current refresh."""
+        self._stopped.set()
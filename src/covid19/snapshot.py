@@ -0,0 +1,302 @@
+"""Versioned, memory-mapped data snapshots shared between processes.
+
+One process downloads and preprocesses the data, and writes it to disk as a
+snapshot: A directory with one .npy-file per numeric block and a small JSON
+manifest describing the index and columns. All other processes (e.g. the
+gunicorn workers) memory-map the same files read-only, so the data is only kept
+once in memory no matter how many workers we run.
+
+A new snapshot is written to a temporary directory, renamed into place, and then
+activated by atomically replacing the CURRENT-file.
+"""
+import contextlib
+import dataclasses
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+SNAPSHOT_DIR = Path(
+    os.environ.get(
+        "COVID19_SNAPSHOT_DIR", Path(tempfile.gettempdir()) / "covid19" / "snapshots"
+    )
+)
+SNAPSHOTS_TO_KEEP = 3
+
+
+@dataclasses.dataclass(frozen=True, eq=False)
+class Snapshot:
+    """All the data needed by the app, at one point in time.
+
+    The raw data has one row per date and one column per country. The shifted data
+    (infected, deaths) has one row per day since day zero, and only contains the
+    countries we have population data for. The daily data (infected_per_day) has
+    one row per date, and the same countries as the shifted data. The map data
+    (infected_map) has one row per date and one column per country on the map.
+
+    The US data has one row per county (us_counties, us_infected) or per state
+    (us_states, us_states_infected), and one column per date. This way the numbers
+    of a county are contiguous on disk, and reading them doesn't touch the rest of
+    the memory-mapped data.
+    """
+
+    version: str
+    created: pd.Timestamp
+    infected_raw: pd.DataFrame
+    deaths_raw: pd.DataFrame
+    population: pd.DataFrame
+    infected: pd.DataFrame
+    deaths: pd.DataFrame
+    infected_per_day: pd.DataFrame
+    infected_map: pd.DataFrame
+    us_counties: pd.DataFrame
+    us_infected: pd.DataFrame
+    us_states: pd.DataFrame
+    us_states_infected: pd.DataFrame
+
+    def __eq__(self, other: object) -> bool:
+        """Snapshots are equal if they have the same version."""
+        return isinstance(other, Snapshot) and other.version == self.version
+
+    def __hash__(self) -> int:
+        """Hash by the version, so that a snapshot can key a cache."""
+        return hash(self.version)
+
+    @classmethod
+    def create(cls, **frames: pd.DataFrame) -> "Snapshot":
+        """Create a new snapshot with a unique version."""
+        return cls(
+            version=f"{time.time_ns():x}",
+            created=pd.Timestamp.now(tz="UTC"),
+            **frames,
+        )
+
+
+def _data_fields() -> Iterator[str]:
+    """Names of the Snapshot-fields that contain data."""
+    for field in dataclasses.fields(Snapshot):
+        if field.name not in ("version", "created"):
+            yield field.name
+
+
+def _index_to_json(index: pd.Index) -> Dict[str, Any]:
+    """Describe an index in a way that can be stored in the manifest."""
+    if isinstance(index, pd.DatetimeIndex):
+        return {
+            "kind": "datetime",
+            "name": index.name,
+            "values": [date.isoformat() for date in index],
+        }
+    if isinstance(index, pd.RangeIndex):
+        return {
+            "kind": "range",
+            "name": index.name,
+            "start": index.start,
+            "stop": index.stop,
+            "step": index.step,
+        }
+    return {"kind": "labels", "name": index.name, "values": index.tolist()}
+
+
+def _index_from_json(spec: Dict[str, Any]) -> pd.Index:
+    """Recreate an index from the manifest."""
+    if spec["kind"] == "datetime":
+        return pd.DatetimeIndex(spec["values"], name=spec["name"])
+    if spec["kind"] == "range":
+        return pd.RangeIndex(
+            spec["start"], spec["stop"], spec["step"], name=spec["name"]
+        )
+    return pd.Index(spec["values"], name=spec["name"])
+
+
+def _write_frame(directory: Path, name: str, frame: pd.DataFrame) -> Dict[str, Any]:
+    """Write a DataFrame to disk.
+
+    All numeric columns are stored as one 2D-array, which can later be
+    memory-mapped. Other columns (e.g. country names) are stored as fixed-width
+    unicode arrays, and the positions of their missing values in the manifest.
+    """
+    numeric = frame.select_dtypes("number")
+    np.save(directory / f"{name}.npy", numeric.to_numpy())
+    others = [column for column in frame.columns if column not in numeric.columns]
+    for i, column in enumerate(others):
+        np.save(directory / f"{name}.{i}.npy", frame[column].to_numpy(dtype=str))
+    return {
+        "index": _index_to_json(frame.index),
+        "columns": _index_to_json(numeric.columns),
+        "other_columns": others,
+        "missing": [np.flatnonzero(frame[column].isna()).tolist() for column in others],
+    }
+
+
+def _read_frame(directory: Path, name: str, spec: Dict[str, Any]) -> pd.DataFrame:
+    """Memory-map a DataFrame written by _write_frame."""
+    values = np.load(directory / f"{name}.npy", mmap_mode="r")
+    frame = pd.DataFrame(
+        values,
+        index=_index_from_json(spec["index"]),
+        columns=_index_from_json(spec["columns"]),
+    )
+    for i, column in enumerate(spec["other_columns"]):
+        strings = np.load(directory / f"{name}.{i}.npy", mmap_mode="r")
+        if spec["missing"][i]:
+            strings = strings.astype(object)
+            strings[spec["missing"][i]] = np.nan
+        frame[column] = strings
+    return frame
+
+
+class SnapshotStore:
+    """A directory containing versioned snapshots."""
+
+    def __init__(self, root: Path = SNAPSHOT_DIR):
+        """Create the store, and the directory if needed."""
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @contextlib.contextmanager
+    def lock(self) -> Iterator[None]:
+        """Hold an exclusive lock, so that only one process refreshes at a time."""
+        with open(self.root / ".lock", "w") as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def current_version(self) -> Optional[str]:
+        """Return the version of the currently active snapshot, if any."""
+        try:
+            return (self.root / "CURRENT").read_text().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _manifest(self, version: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Return the manifest of a snapshot (by default the current one), if any.
+
+        Snapshots written by an older version of the app, which don't have the same
+        data fields as the current Snapshot, are ignored.
+        """
+        version = version or self.current_version()
+        if version is None:
+            return None
+        manifest = json.loads((self.root / version / "manifest.json").read_text())
+        if set(manifest["frames"]) != set(_data_fields()):
+            return None
+        return manifest
+
+    def age(self) -> Optional[pd.Timedelta]:
+        """Return the time since the current snapshot was last known to be fresh."""
+        manifest = self._manifest()
+        if manifest is None:
+            return None
+        checked = pd.Timestamp(manifest["created"])
+        try:
+            checked = max(checked, pd.Timestamp((self.root / "CHECKED").read_text()))
+        except (FileNotFoundError, ValueError):
+            pass
+        return pd.Timestamp.now(tz="UTC") - checked
+
+    def mark_checked(self) -> None:
+        """Record that the current snapshot is still up to date."""
+        checked_tmp = self.root / ".CHECKED.tmp"
+        checked_tmp.write_text(pd.Timestamp.now(tz="UTC").isoformat())
+        os.replace(checked_tmp, self.root / "CHECKED")
+
+    def sources(self) -> Dict[str, str]:
+        """Return the digests of the source files used by the current snapshot."""
+        manifest = self._manifest()
+        if manifest is None:
+            return {}
+        return manifest.get("sources", {})
+
+    def upstream(self) -> Optional[pd.Timestamp]:
+        """Return the upstream timestamp of the data in the current snapshot."""
+        manifest = self._manifest()
+        if manifest is None or not manifest.get("upstream"):
+            return None
+        return pd.Timestamp(manifest["upstream"])
+
+    def write(
+        self,
+        snapshot: Snapshot,
+        sources: Optional[Dict[str, str]] = None,
+        upstream: Optional[pd.Timestamp] = None,
+    ) -> None:
+        """Write a snapshot to disk and make it the current one.
+
+        Args:
+            snapshot (Snapshot): The snapshot to write.
+            sources (dict, optional): Digests of the source files, by URL.
+            upstream (pd.Timestamp, optional): When the source files were last
+                                               updated upstream.
+        """
+        tmp_dir = Path(tempfile.mkdtemp(prefix=".tmp-", dir=self.root))
+        manifest: Dict[str, Any] = {
+            "version": snapshot.version,
+            "created": snapshot.created.isoformat(),
+            "sources": sources or {},
+            "upstream": upstream.isoformat() if upstream is not None else None,
+            "frames": {
+                name: _write_frame(tmp_dir, name, getattr(snapshot, name))
+                for name in _data_fields()
+            },
+        }
+        (tmp_dir / "manifest.json").write_text(json.dumps(manifest))
+        os.rename(tmp_dir, self.root / snapshot.version)
+
+        # Atomically switch to the new version
+        current_tmp = self.root / ".CURRENT.tmp"
+        current_tmp.write_text(snapshot.version)
+        os.replace(current_tmp, self.root / "CURRENT")
+
+        self._prune()
+
+    def load(self, version: Optional[str] = None) -> Optional[Snapshot]:
+        """Memory-map a snapshot (by default the current one) read-only."""
+        manifest = self._manifest(version)
+        if manifest is None:
+            return None
+        directory = self.root / manifest["version"]
+        return Snapshot(
+            version=manifest["version"],
+            created=pd.Timestamp(manifest["created"]),
+            **{
+                name: _read_frame(directory, name, spec)
+                for name, spec in manifest["frames"].items()
+            },
+        )
+
+    def _prune(self) -> None:
+        """Delete old snapshots.
+
+        Processes that still have the old files memory-mapped can keep using them,
+        the disk space is released when the last of them lets go.
+        """
+        snapshots = sorted(
+            (int(path.name, 16), path)
+            for path in self.root.iterdir()
+            if _is_version(path.name) and (path / "manifest.json").is_file()
+        )
+        for _, path in snapshots[:-SNAPSHOTS_TO_KEEP]:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _is_version(name: str) -> bool:
+    """Return whether a name in the store is the version of a snapshot.
+
+    The versions are hexadecimal, see Snapshot.create. Anything else in the store
+    (e.g. a backup made by hand) is left alone.
+    """
+    try:
+        int(name, 16)
+    except ValueError:
+        return False
+    return True
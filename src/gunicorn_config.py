@@ -1,4 +1,30 @@
 """Configuration options for gunicorn."""
+import os
+import shutil
+import tempfile
+
 bind = "0.0.0.0:5000"
+# Measure the latency and throughput for other numbers with benchmarks/loadtest.py
 workers = 4
 errorlog = "-"
+
+# Load the app (and the data snapshot) once, before forking the workers. The data
+# is refreshed in the workers, not in the master process.
+preload_app = True
+os.environ.setdefault("COVID19_START_SCHEDULER", "0")
+
+# The workers add up their metrics in a directory that is new for each start
+metrics_dir = tempfile.mkdtemp(prefix="covid19-metrics-")
+os.environ["COVID19_METRICS_DIR"] = metrics_dir
+
+
+def post_fork(server, worker):
+    """Start refreshing the data in each worker."""
+    import covid19.dash_app
+
+    covid19.dash_app.start_scheduler()
+
+
+def on_exit(server):
+    """Remove the metrics of the workers."""
+    shutil.rmtree(metrics_dir, ignore_errors=True)
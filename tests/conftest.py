@@ -0,0 +1,159 @@
+"""Run the tests against a small snapshot of made-up data, without the network.
+
+The app loads its snapshot when it is imported, so the snapshot is written before
+any test module is collected. The upstream servers are replaced by the stand-in
+in benchmarks/standin.py.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+import pytest
+
+COUNTRIES = ["Norway", "Sweden", "Denmark", "Germany", "Italy"]
+STATES = {"Texas": ["Harris", "Dallas"], "Ohio": ["Franklin"]}
+DAYS = 120
+
+_tmp_dir = Path(tempfile.mkdtemp(prefix="covid19-tests-"))
+
+# The stand-in and the synthetic data are shared with the benchmarks
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "benchmarks"))
+
+
+def _counts(rows: int, seed: int) -> np.ndarray:
+    """Cumulative counts that grow at a different rate in each row."""
+    rng = np.random.default_rng(seed)
+    rates = rng.uniform(0.03, 0.1, size=(rows, 1))
+    counts = np.exp(rates * np.arange(DAYS)).cumsum(axis=1).round()
+    # Cumulative counts are sometimes frozen for a few days
+    counts[:, 50:53] = counts[:, [49]]
+    return counts.astype(int)
+
+
+def _write_csse(path: Path, keys: pd.DataFrame, counts: np.ndarray) -> None:
+    """Write a file in the format of the CSSE time series."""
+    dates = pd.date_range("2020-01-22", periods=DAYS)
+    columns = [f"{date.month}/{date.day}/{date.year % 100}" for date in dates]
+    data = pd.concat([keys, pd.DataFrame(counts, columns=columns)], axis=1)
+    data.to_csv(path, index=False)
+
+
+def _write_sources(directory: Path) -> None:
+    """Write the global and US source files."""
+    keys = pd.DataFrame(
+        {
+            "Province/State": np.nan,
+            "Country/Region": COUNTRIES,
+            "Lat": 0.0,
+            "Long": 0.0,
+        }
+    )
+    _write_csse(directory / "infected.csv", keys, _counts(len(COUNTRIES), 0))
+    _write_csse(directory / "deaths.csv", keys, _counts(len(COUNTRIES), 1) // 50)
+
+    counties = [(s, c) for s, names in STATES.items() for c in names]
+    us_keys = pd.DataFrame(
+        {
+            "UID": [84000001 + i for i in range(len(counties))],
+            "iso2": "US",
+            "iso3": "USA",
+            "code3": 840,
+            "FIPS": [1001.0 + i for i in range(len(counties))],
+            "Admin2": [county for _, county in counties],
+            "Province_State": [state for state, _ in counties],
+            "Country_Region": "US",
+            "Lat": 0.0,
+            "Long_": 0.0,
+            "Combined_Key": [f"{c}, {s}, US" for s, c in counties],
+        }
+    )
+    _write_csse(directory / "us_infected.csv", us_keys, _counts(len(counties), 2))
+    us_keys["Population"] = 1_000_000
+    _write_csse(directory / "us_deaths.csv", us_keys, _counts(len(counties), 3) // 50)
+
+
+def pytest_configure(config):
+    """Write the snapshot, and point the app at it."""
+    os.environ.update(
+        COVID19_SNAPSHOT_DIR=str(_tmp_dir / "snapshots"),
+        COVID19_HTTP_CACHE_DIR=str(_tmp_dir / "http"),
+        COVID19_METRICS_DIR=str(_tmp_dir / "metrics"),
+        COVID19_START_SCHEDULER="0",
+    )
+    import covid19.data
+    import covid19.snapshot
+
+    _write_sources(_tmp_dir)
+    snapshot = covid19.data.ingest(
+        _tmp_dir / "infected.csv",
+        _tmp_dir / "deaths.csv",
+        us_infected_csv=_tmp_dir / "us_infected.csv",
+        us_deaths_csv=_tmp_dir / "us_deaths.csv",
+    )
+    covid19.snapshot.SnapshotStore().write(snapshot)
+
+
+def pytest_unconfigure(config):
+    """Remove the snapshot."""
+    shutil.rmtree(_tmp_dir, ignore_errors=True)
+
+
+class StandIn:
+    """A directory served by benchmarks/standin.py."""
+
+    def __init__(self, directory: Path):
+        """Create the directory, but don't serve it yet."""
+        self.directory = directory
+        self.directory.mkdir()
+        self.url = ""
+        # The path and status code of each response
+        self.responses: List[Tuple[str, int]] = []
+        # Responses to give instead of the files: The status and headers, by path
+        self.errors: Dict[str, Tuple[int, Dict[str, str]]] = {}
+        # Files whose download is cut off halfway, by path
+        self.truncated: Set[str] = set()
+
+    def requested(self, name: str) -> List[int]:
+        """Return the status codes of the responses for a file."""
+        return [status for path, status in self.responses if path.endswith(name)]
+
+
+@pytest.fixture
+def upstream(tmp_path: Path) -> Iterator[StandIn]:
+    """Serve a directory as the upstream servers, and record the responses."""
+    import standin
+
+    stand_in = StandIn(tmp_path / "upstream")
+
+    class Handler(standin.StandInHandler):
+        def do_GET(self) -> None:
+            path = self.path.split("?")[0]
+            if path in stand_in.truncated:
+                body = Path(self.translate_path(path)).read_bytes()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body[: len(body) // 2])
+                return
+            if path not in stand_in.errors:
+                super().do_GET()
+                return
+            status, headers = stand_in.errors[path]
+            self.send_response(status)
+            for name, value in {**headers, "Content-Length": "0"}.items():
+                self.send_header(name, value)
+            self.end_headers()
+
+        def send_response(self, code: int, message: Optional[str] = None) -> None:
+            stand_in.responses.append((self.path.split("?")[0], code))
+            super().send_response(code, message)
+
+    server, stand_in.url = standin.serve(stand_in.directory, handler=Handler)
+    yield stand_in
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,51 @@
+"""The caches of a snapshot are released when the app switches to a new one."""
+import dataclasses
+import gc
+import weakref
+
+import covid19.dash_app
+import covid19.dash_deaths
+import covid19.dash_main  # noqa: F401
+import covid19.dash_us
+import covid19.snapshot
+
+# Without the Dash wrapper, but with the cache
+callback = covid19.dash_deaths.deaths_per_inf_figure_base_data.__wrapped__
+
+
+def fill_caches(snapshot: covid19.snapshot.Snapshot) -> None:
+    """Call some of the cached functions."""
+    callback(["Norway", "Sweden"])
+    covid19.dash_us.us_series(snapshot, "Texas", 1001)
+
+
+def test_new_snapshot_clears_caches():
+    current = covid19.dash_app.snapshot
+    new = dataclasses.replace(current, version=f"{current.version}-new")
+    fill_caches(current)
+    try:
+        covid19.dash_app.set_snapshot(new)
+        assert callback.cache_info().currsize == 0
+        assert covid19.dash_us.us_series.cache_info().currsize == 0
+
+        # A call that was still using the old snapshot doesn't keep it cached
+        covid19.dash_us.us_series(current, "Texas", 1001)
+        assert covid19.dash_us.us_series.cache_info().currsize == 0
+        fill_caches(new)
+        assert callback.cache_info().currsize == 1
+        assert covid19.dash_us.us_series.cache_info().currsize == 1
+    finally:
+        covid19.dash_app.set_snapshot(current)
+
+
+def test_old_snapshot_is_released():
+    current = covid19.dash_app.snapshot
+    old = dataclasses.replace(current, version=f"{current.version}-old")
+    covid19.dash_app.set_snapshot(old)
+    fill_caches(old)
+    covid19.dash_app.set_snapshot(current)
+
+    released = weakref.ref(old)
+    del old
+    gc.collect()
+    assert released() is None
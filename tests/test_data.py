@@ -0,0 +1,92 @@
+"""Parsing and preprocessing of the CSSE files."""
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+import pytest
+import synthetic
+
+import covid19.data
+
+
+def test_ingest_us(tmp_path):
+    synthetic.write_csse_files(tmp_path, 5, 30, counties=100)
+    infected_csv = tmp_path / synthetic.US_INFECTED_FILE
+    deaths_csv = tmp_path / synthetic.US_DEATHS_FILE
+    # A county that is missing from the file with deaths
+    lines = deaths_csv.read_text().splitlines(keepends=True)
+    deaths_csv.write_text("".join(lines[:-1]))
+
+    us = covid19.data.ingest_us(infected_csv, deaths_csv)
+    population = covid19.data.read_us_population(deaths_csv)
+    counties = us["us_counties"]
+    assert counties.index.equals(us["us_infected"].index)
+    assert (counties["Population"].iloc[:-1] == population.to_numpy()).all()
+    assert counties["Population"].iloc[-1] == 0
+    assert us["us_states"]["Population"].sum() == population.sum()
+    assert us["us_states_infected"].sum().equals(us["us_infected"].sum())
+
+
+def csse_frame(days: int) -> pd.DataFrame:
+    """A global CSSE file, with a quoted region."""
+    infected, _ = synthetic.synthetic_counts(30, days)
+    frame = synthetic.csse_frame(infected)
+    frame.loc[3, "Country/Region"] = "Korea, South"
+    return frame
+
+
+def read_incrementally(
+    tmp_path: Path, old: pd.DataFrame, new: pd.DataFrame
+) -> Optional[pd.DataFrame]:
+    """Check that an incremental update gives the same result as a full rebuild.
+
+    Returns:
+        pd.DataFrame: The incremental update, or None if it fell back to a full
+                      rebuild.
+    """
+    old_csv, new_csv = tmp_path / "old.csv", tmp_path / "new.csv"
+    old.to_csv(old_csv, index=False)
+    new.to_csv(new_csv, index=False)
+    previous = covid19.data.read_covid_csv(old_csv)
+    updated = covid19.data.read_covid_csv(new_csv, previous=(old_csv, previous))
+    pd.testing.assert_frame_equal(updated, covid19.data.read_covid_csv(new_csv))
+    assert "South Korea" in updated
+    return covid19.data._update_covid_dataframe(new_csv, old_csv, previous)
+
+
+@pytest.mark.parametrize("new_dates", [0, 1, 3])
+def test_appended_dates(tmp_path, new_dates):
+    new = csse_frame(60)
+    old = new.iloc[:, : new.shape[1] - new_dates]
+    assert read_incrementally(tmp_path, old, new) is not None
+
+
+def test_revised_recent_date(tmp_path):
+    new = csse_frame(60)
+    old = new.iloc[:, :-1].copy()
+    old.iloc[3, -covid19.data.MAX_REVISED_DATES] += 1
+    old.iloc[5, -2] += 2
+    assert read_incrementally(tmp_path, old, new) is not None
+
+
+def test_revised_old_date(tmp_path):
+    new = csse_frame(60)
+    old = new.iloc[:, :-1].copy()
+    old.iloc[5, -covid19.data.MAX_REVISED_DATES - 2] += 1
+    assert read_incrementally(tmp_path, old, new) is None
+
+
+@pytest.mark.parametrize("row", [0, 3, -1])
+def test_blank_new_date(tmp_path, row):
+    new = csse_frame(60)
+    last_date = new.columns[-1]
+    new[last_date] = new[last_date].astype("Int64")
+    new.iloc[row, -1] = pd.NA
+    old = new.iloc[:, :-1]
+    assert read_incrementally(tmp_path, old, new) is not None
+
+
+def test_added_region(tmp_path):
+    new = csse_frame(60)
+    old = new.iloc[:-1, :-1]
+    assert read_incrementally(tmp_path, old, new) is None
@@ -0,0 +1,82 @@
+"""Conditional downloads of the source files, cached on disk."""
+import hashlib
+
+import pytest
+import requests
+
+import covid19.fetch
+
+FILE = "data.csv"
+
+
+@pytest.fixture
+def fetch(upstream, tmp_path):
+    """Fetch the file from the stand-in, into a cache of its own."""
+    cache_dir = tmp_path / "http"
+
+    def fetch():
+        return covid19.fetch.fetch(f"{upstream.url}/{FILE}", cache_dir=cache_dir)
+
+    fetch.cache_dir = cache_dir
+    return fetch
+
+
+def write(upstream, text: str) -> str:
+    """Write the file upstream, and return its digest."""
+    (upstream.directory / FILE).write_text(text)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def test_not_modified(fetch, upstream):
+    digest = write(upstream, "a,b\n1,2\n")
+    first = fetch()
+    assert first.modified
+    assert first.digest == digest
+    assert first.path.read_text() == "a,b\n1,2\n"
+
+    second = fetch()
+    assert not second.modified
+    assert (second.path, second.digest) == (first.path, first.digest)
+    assert second.path.read_text() == "a,b\n1,2\n"
+    assert upstream.requested(FILE) == [200, 304]
+
+
+def test_previous(fetch, upstream):
+    old_digest = write(upstream, "a,b\n1,2\n")
+    first = fetch()
+    assert first.previous is None
+    assert first.previous_digest is None
+
+    new_digest = write(upstream, "a,b\n1,2\n3,4\n")
+    for _ in range(2):
+        result = fetch()
+        assert result.digest == new_digest
+        assert result.path.read_text() == "a,b\n1,2\n3,4\n"
+        assert result.previous_digest == old_digest
+        assert result.previous.read_text() == "a,b\n1,2\n"
+    assert upstream.requested(FILE) == [200, 200, 304]
+
+
+def test_partial_download(fetch, upstream):
+    digest = write(upstream, "a,b\n1,2\n")
+    fetch()
+
+    write(upstream, "a,b\n1,2\n3,4\n" * 1000)
+    upstream.truncated.add(f"/{FILE}")
+    with pytest.raises(requests.RequestException):
+        fetch()
+    # Neither the cached file nor a temporary file is left behind
+    assert not list(fetch.cache_dir.glob(".tmp-*"))
+    upstream.truncated.clear()
+    upstream.errors[f"/{FILE}"] = (304, {})
+    result = fetch()
+    assert (result.digest, result.modified) == (digest, False)
+    assert result.path.read_text() == "a,b\n1,2\n"
+
+
+def test_partial_first_download(fetch, upstream):
+    write(upstream, "a,b\n1,2\n" * 1000)
+    upstream.truncated.add(f"/{FILE}")
+    with pytest.raises(requests.RequestException):
+        fetch()
+    assert not list(fetch.cache_dir.iterdir())
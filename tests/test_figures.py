@@ -0,0 +1,110 @@
+"""The figures built as plain dicts must be what plotly would have built."""
+import inspect
+import json
+
+import plotly.graph_objects as go
+import plotly.io
+import pytest
+
+import covid19.dash_app
+import covid19.dash_deaths
+import covid19.dash_forecast
+import covid19.dash_infected
+import covid19.dash_main  # noqa: F401
+import covid19.dash_us
+
+COUNTRY_SELECTIONS = [[], ["Norway"], ["Sweden", "Norway", "Italy"]]
+
+
+def uncached(callback):
+    """Return a callback without its caches and the Dash wrapper."""
+    return inspect.unwrap(callback)
+
+
+def assert_validated(figure: dict) -> None:
+    """Check that plotly validates a figure to the exact same JSON."""
+    plain = json.loads(json.dumps(figure))
+    validated = json.loads(plotly.io.to_json(go.Figure(figure)))
+    # Only the browser adds the template to some figures
+    plain["layout"].pop("template", None)
+    validated["layout"].pop("template")
+    assert plain == validated
+
+
+@pytest.mark.parametrize("countries", COUNTRY_SELECTIONS)
+@pytest.mark.parametrize(
+    "callback",
+    [
+        covid19.dash_infected.infected_in_total_figure_base_data,
+        covid19.dash_infected.infected_per_day_figure_base_data,
+        covid19.dash_deaths.deaths_per_pop_figure_base_data,
+        covid19.dash_deaths.deaths_per_inf_figure_base_data,
+    ],
+)
+def test_country_figures(callback, countries):
+    base = uncached(callback)(covid19.dash_app.snapshot, countries)
+    assert_validated(base["figure"])
+
+
+@pytest.mark.parametrize("idx", [0, 60, -1])
+def test_infected_map_figure(idx):
+    snapshot = covid19.dash_app.snapshot
+    idx = idx % len(snapshot.infected_raw)
+    assert_validated(uncached(covid19.dash_infected.infected_map_figure)(snapshot, idx))
+
+
+@pytest.mark.parametrize(
+    "day_of_control, recovery_days, y_axis_type, plot_options",
+    [
+        (60, 15, "linear", []),
+        (90, 20, "log", []),
+        # Not on the precomputed grid
+        (61, 15, "linear", ["uncertainty"]),
+    ],
+)
+@pytest.mark.parametrize("country", ["Norway", "Italy"])
+def test_forecast_figure(
+    country, day_of_control, recovery_days, y_axis_type, plot_options
+):
+    figure = uncached(covid19.dash_forecast.forecast_figure_figure)(
+        country, day_of_control, 3, recovery_days, y_axis_type, plot_options
+    )
+    assert_validated(figure)
+
+
+@pytest.mark.parametrize("counties", [[], [1001, 1002], [1001, 9999]])
+@pytest.mark.parametrize(
+    "callback",
+    [
+        covid19.dash_us.us_in_total_figure_base_data,
+        covid19.dash_us.us_per_day_figure_base_data,
+    ],
+)
+def test_us_figures(callback, counties):
+    base = uncached(callback)(covid19.dash_app.snapshot, "Texas", counties)
+    assert_validated(base["figure"])
+    # Unknown counties are left out
+    assert [trace["name"] for trace in base["figure"]["data"]] == list(
+        base["population"]
+    )
+    assert len(base["population"]) == 1 + len(set(counties) - {9999})
+
+
+@pytest.mark.parametrize(
+    "callback",
+    [
+        covid19.dash_us.us_in_total_figure_base_data,
+        covid19.dash_us.us_per_day_figure_base_data,
+    ],
+)
+def test_us_populations(callback):
+    # The browser divides each line by its population, per 100k
+    snapshot = covid19.dash_app.snapshot
+    base = uncached(callback)(snapshot, "Texas", [1002, 1001])
+    counties = snapshot.us_counties.set_index("FIPS")
+    assert base["population"] == {
+        "Texas (all)": snapshot.us_states.at["Texas", "Population"],
+        "Dallas": counties.at[1002, "Population"],
+        "Harris": counties.at[1001, "Population"],
+    }
+    assert base["per_pop_size"]["yaxis"] == covid19.dash_us.PER_POP_YAXIS
@@ -0,0 +1,128 @@
+"""The upstream timestamp is cached, renewed conditionally, and backed off."""
+import inspect
+import json
+
+import pandas as pd
+import pytest
+
+import covid19.dash_app
+import covid19.freshness
+import covid19.snapshot
+
+COMMITS_PATH = "/repos/CSSEGISandData/COVID-19/commits"
+
+
+def write_commit(upstream, date: str) -> None:
+    """Write the latest commit, as reported by the GitHub API."""
+    commits = upstream.directory / COMMITS_PATH.lstrip("/")
+    commits.parent.mkdir(parents=True, exist_ok=True)
+    commits.write_text(json.dumps([{"commit": {"committer": {"date": date}}}]))
+
+
+@pytest.fixture
+def make_probe(upstream, tmp_path):
+    """Create probes of the stand-in, sharing the same cache file."""
+
+    def make_probe(ttl=covid19.freshness.TTL):
+        return covid19.freshness.FreshnessProbe(
+            path=tmp_path / "freshness.json",
+            url=f"{upstream.url}{COMMITS_PATH}",
+            ttl=ttl,
+        )
+
+    return make_probe
+
+
+def test_ttl(upstream, make_probe):
+    write_commit(upstream, "2020-11-20T04:00:00Z")
+    probe = make_probe()
+    assert probe.timestamp() == pd.Timestamp("2020-11-20T04:00:00Z")
+
+    # Upstream isn't asked again until the TTL has passed
+    write_commit(upstream, "2020-11-21T04:00:00Z")
+    assert probe.timestamp() == pd.Timestamp("2020-11-20T04:00:00Z")
+    assert upstream.requested(COMMITS_PATH) == [200]
+
+    expired = make_probe(ttl=pd.Timedelta(0))
+    assert expired.timestamp() == pd.Timestamp("2020-11-21T04:00:00Z")
+    assert probe.cached() == pd.Timestamp("2020-11-21T04:00:00Z")
+    assert upstream.requested(COMMITS_PATH) == [200, 200]
+
+
+def test_not_modified(upstream, make_probe):
+    write_commit(upstream, "2020-11-20T04:00:00Z")
+    probe = make_probe(ttl=pd.Timedelta(0))
+    assert probe.timestamp() == pd.Timestamp("2020-11-20T04:00:00Z")
+    assert probe.timestamp() == pd.Timestamp("2020-11-20T04:00:00Z")
+    assert upstream.requested(COMMITS_PATH) == [200, 304]
+
+
+def test_backoff(upstream, make_probe):
+    probe = make_probe(ttl=pd.Timedelta(0))
+    for failures in range(1, 4):
+        start = pd.Timestamp.now(tz="UTC")
+        assert probe.timestamp() is None
+        retry_at = pd.Timestamp(probe._read()["retry_at"])
+        backoff = covid19.freshness.MIN_BACKOFF * 2 ** (failures - 1)
+        assert start + backoff <= retry_at <= pd.Timestamp.now(tz="UTC") + backoff
+
+        # Upstream isn't asked again while backing off
+        assert probe.timestamp() is None
+        assert upstream.requested(COMMITS_PATH) == [404] * failures
+        probe._write({**probe._read(), "retry_at": start.isoformat()})
+
+    # The backoff is reset when upstream answers again
+    write_commit(upstream, "2020-11-20T04:00:00Z")
+    assert probe.timestamp() == pd.Timestamp("2020-11-20T04:00:00Z")
+    assert "retry_at" not in probe._read()
+
+
+def test_backoff_keeps_timestamp(upstream, make_probe):
+    write_commit(upstream, "2020-11-20T04:00:00Z")
+    probe = make_probe(ttl=pd.Timedelta(0))
+    probe.timestamp()
+    upstream.errors[COMMITS_PATH] = (500, {})
+    assert probe.timestamp() == pd.Timestamp("2020-11-20T04:00:00Z")
+    assert upstream.requested(COMMITS_PATH) == [200, 500]
+
+
+def test_rate_limit_reset(upstream, make_probe):
+    reset = pd.Timestamp.now(tz="UTC").floor("s") + pd.Timedelta(hours=2)
+    headers = {
+        "X-RateLimit-Remaining": "0",
+        "X-RateLimit-Reset": str(int(reset.timestamp())),
+    }
+    upstream.errors[COMMITS_PATH] = (403, headers)
+    probe = make_probe()
+    assert probe.timestamp() is None
+    assert pd.Timestamp(probe._read()["retry_at"]) == reset
+
+
+@pytest.fixture
+def no_timestamp(tmp_path, monkeypatch):
+    """Never having found the upstream timestamp, e.g. when rate limited."""
+    monkeypatch.setattr(
+        covid19.freshness,
+        "probe",
+        covid19.freshness.FreshnessProbe(path=tmp_path / "freshness.json"),
+    )
+    store = covid19.snapshot.SnapshotStore(tmp_path / "snapshots")
+    monkeypatch.setattr(covid19.dash_app, "store", store)
+    return store
+
+
+def update_text() -> str:
+    """Return the last-updated-text, calling the callback without Dash."""
+    return inspect.unwrap(covid19.dash_app.live_update_text_children)(0).children
+
+
+def test_update_text_without_timestamp(no_timestamp):
+    text = update_text()
+    assert text.startswith("Data update time unknown. Next update expected in")
+
+
+def test_update_text_from_snapshot(no_timestamp):
+    upstream = pd.Timestamp.now(tz="UTC") - pd.Timedelta(hours=2, minutes=30)
+    no_timestamp.write(covid19.dash_app.snapshot, upstream=upstream)
+    text = update_text()
+    assert text.startswith("Data updated 2 hours and 30 minutes ago.")
@@ -0,0 +1,32 @@
+"""The metrics are aggregated over the processes, and exported on /metrics."""
+import covid19.dash_app
+import covid19.dash_deaths
+import covid19.dash_main  # noqa: F401
+import covid19.metrics
+
+
+def cache_lookups(cache: str) -> dict:
+    """Return the number of hits and misses of a cache, over all processes."""
+    samples = covid19.metrics.aggregate()["covid19_cache_lookups_total"]
+    return {
+        result: samples.get((("cache", cache), ("result", result)), 0)
+        for result in ("hit", "miss")
+    }
+
+
+def test_cache_lookups():
+    # Without the Dash wrapper, but with the cache
+    callback = covid19.dash_deaths.deaths_per_inf_figure_base_data.__wrapped__
+    before = cache_lookups("deaths_per_inf_figure_base_data")
+    callback(["Denmark", "Germany"])
+    callback(["Denmark", "Germany"])
+    callback(["Germany", "Denmark"])
+    after = cache_lookups("deaths_per_inf_figure_base_data")
+    assert after["hit"] - before["hit"] == 1
+    assert after["miss"] - before["miss"] == 2
+
+    response = covid19.dash_app.app.server.test_client().get("/metrics")
+    assert (
+        'covid19_cache_lookups_total{cache="deaths_per_inf_figure_base_data",'
+        f'result="hit"}} {after["hit"]!r}'
+    ) in response.get_data(as_text=True)
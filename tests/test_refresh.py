@@ -0,0 +1,103 @@
+"""The snapshot is only refreshed from upstream when something has changed."""
+import functools
+import json
+
+import pandas as pd
+import pytest
+import synthetic
+
+import covid19.data
+import covid19.fetch
+import covid19.freshness
+import covid19.refresh
+import covid19.snapshot
+
+COMMITS_PATH = "/" + synthetic.COMMITS_FILE.as_posix()
+SOURCES = {
+    "INFECTED_SOURCE_GLOBAL": synthetic.INFECTED_FILE,
+    "DEATHS_SOURCE_GLOBAL": synthetic.DEATHS_FILE,
+    "INFECTED_SOURCE_US": synthetic.US_INFECTED_FILE,
+    "DEATHS_SOURCE_US": synthetic.US_DEATHS_FILE,
+}
+
+
+@pytest.fixture
+def refresh(upstream, tmp_path, monkeypatch):
+    """Refresh a snapshot store from synthetic files served by the stand-in."""
+    synthetic.write_csse_files(upstream.directory, 20, 60, counties=20)
+    for name, file in SOURCES.items():
+        monkeypatch.setattr(covid19.data, name, f"{upstream.url}/{file}")
+    monkeypatch.setattr(
+        covid19.refresh,
+        "fetch",
+        functools.partial(covid19.fetch.fetch, cache_dir=tmp_path / "http"),
+    )
+    # Every refresh looks for new data
+    monkeypatch.setattr(covid19.refresh, "SNAPSHOT_MAX_AGE", pd.Timedelta(0))
+    store = covid19.snapshot.SnapshotStore(tmp_path / "snapshots")
+    probe = covid19.freshness.FreshnessProbe(
+        path=tmp_path / "freshness.json",
+        url=f"{upstream.url}{COMMITS_PATH}",
+        ttl=pd.Timedelta(0),
+    )
+    return functools.partial(covid19.refresh.update_snapshot, store, probe)
+
+
+def test_upstream_unchanged(refresh, upstream):
+    first = refresh()
+    assert upstream.requested(synthetic.INFECTED_FILE) == [200]
+
+    # The upstream timestamp hasn't moved, so the files aren't even asked for
+    assert refresh().version == first.version
+    assert upstream.requested(COMMITS_PATH) == [200, 304]
+    assert upstream.requested(synthetic.INFECTED_FILE) == [200]
+
+
+def new_commit(upstream, date: str) -> None:
+    """Move the upstream timestamp."""
+    commits = upstream.directory / synthetic.COMMITS_FILE
+    commits.write_text(json.dumps([{"commit": {"committer": {"date": date}}}]))
+
+
+def test_us_unavailable(refresh, upstream):
+    upstream.errors["/" + synthetic.US_DEATHS_FILE] = (500, {})
+    first = refresh()
+    assert not first.infected_raw.empty
+    assert first.us_infected.empty
+
+    # The US data is fetched again at the next refresh
+    del upstream.errors["/" + synthetic.US_DEATHS_FILE]
+    new_commit(upstream, "2020-11-21T04:00:00Z")
+    second = refresh()
+    assert second.infected_raw.equals(first.infected_raw)
+    assert len(second.us_infected) == 20
+
+
+def test_us_unparsable(refresh, upstream):
+    store = refresh.args[0]
+    first = refresh()
+    digests = store.sources()
+
+    us_file = upstream.directory / synthetic.US_INFECTED_FILE
+    us_file.write_text("not,a\ncsse,file\n")
+    new_commit(upstream, "2020-11-21T04:00:00Z")
+    second = refresh()
+    assert second.version != first.version
+    assert second.us_infected.equals(first.us_infected)
+    # The new file is parsed again at the next refresh
+    assert store.sources() == digests
+
+
+def test_files_unchanged(refresh, upstream, monkeypatch):
+    first = refresh()
+
+    # The upstream timestamp has moved, but the files haven't reached the servers
+    new_commit(upstream, "2020-11-21T04:00:00Z")
+    monkeypatch.setattr(
+        covid19.data, "ingest", lambda *args, **kwargs: pytest.fail("Ingested")
+    )
+    assert refresh().version == first.version
+    for file in SOURCES.values():
+        assert upstream.requested(file) == [200, 304]
+    # The timestamp is only recorded together with new data
+    assert refresh.args[0].upstream() != pd.Timestamp("2020-11-21T04:00:00Z")
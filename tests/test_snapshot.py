@@ -0,0 +1,25 @@
+"""Snapshots are written, activated and pruned in a store on disk."""
+import dataclasses
+
+import covid19.snapshot
+
+
+def test_prune(tmp_path):
+    snapshot = covid19.snapshot.SnapshotStore().load()
+    store = covid19.snapshot.SnapshotStore(tmp_path)
+    # Things in the store that are not snapshots
+    (tmp_path / "backup").mkdir()
+    (tmp_path / "abc").mkdir()  # Hexadecimal, but without a manifest
+    (tmp_path / "notes.txt").write_text("")
+
+    versions = [f"{version:x}" for version in range(1000, 1005)]
+    for version in versions:
+        store.write(dataclasses.replace(snapshot, version=version))
+        assert store.current_version() == version
+    assert store.load().infected_raw.equals(snapshot.infected_raw)
+
+    keep = covid19.snapshot.SNAPSHOTS_TO_KEEP
+    kept = versions[-keep:]
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(
+        ["backup", "abc", "notes.txt", "CURRENT"] + kept
+    )